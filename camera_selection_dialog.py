@@ -10,9 +10,9 @@ class CameraSelectionDialog(QDialog):
 
     def init_ui(self):
         layout = QVBoxLayout()
-        label = QLabel("Select the number of cameras (3-6):")
+        label = QLabel("Select the number of cameras (3-16):")
         self.combo_box = QComboBox()
-        self.combo_box.addItems([str(i) for i in range(3, 7)])
+        self.combo_box.addItems([str(i) for i in range(3, 17)])
         ok_button = QPushButton("OK")
         ok_button.clicked.connect(self.accept)
 
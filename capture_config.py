@@ -0,0 +1,236 @@
+# capture_config.py
+import logging
+import re
+import shutil
+import subprocess
+from collections import namedtuple
+
+import cv2
+
+CaptureMode = namedtuple('CaptureMode', ['fourcc', 'width', 'height', 'fps'])
+
+# Practical isochronous ceiling of one USB 2.0 high-speed bus (3 x 1024 bytes per microframe)
+USB2_BUS_BYTES_PER_SEC = 3 * 1024 * 8000
+BYTES_PER_PIXEL = {'YUYV': 2, 'UYVY': 2, 'MJPG': 0.25}  # MJPG: typical compressed size
+PROBE_SIZES = ((320, 240), (640, 480), (800, 600), (1024, 768), (1280, 720), (1280, 960),
+               (1600, 1200), (1920, 1080), (2560, 1440), (3840, 2160))
+
+
+def fourcc_code(fourcc):
+    return cv2.VideoWriter_fourcc(*fourcc)
+
+
+def fourcc_name(code):
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+def list_capture_modes(device_index, capture=None):
+    """
+    Return the ``CaptureMode``s a V4L2 device supports, from ``v4l2-ctl`` when
+    it is installed, otherwise by probing common sizes on ``capture``.
+    """
+    if shutil.which('v4l2-ctl'):
+        try:
+            output = subprocess.run(
+                ['v4l2-ctl', f'--device=/dev/video{device_index}', '--list-formats-ext'],
+                capture_output=True, text=True, timeout=5
+            ).stdout
+            modes = parse_v4l2_formats(output)
+            if modes:
+                return modes
+        except (OSError, subprocess.SubprocessError):
+            logging.warning(f"v4l2-ctl failed for camera {device_index}.", exc_info=True)
+    if capture is not None and capture.isOpened():
+        return probe_capture_modes(capture)
+    return []
+
+
+def parse_v4l2_formats(output):
+    modes = []
+    fourcc = None
+    size = None
+    for line in output.splitlines():
+        match = re.search(r"\[\d+\]: '(\w{3,4})'", line)
+        if match:
+            fourcc = match.group(1).ljust(4)
+            size = None
+            continue
+        match = re.search(r'Size: \w+ (\d+)x(\d+)', line)
+        if match and fourcc:
+            size = (int(match.group(1)), int(match.group(2)))
+            continue
+        match = re.search(r'\(([\d.]+) fps\)', line)
+        if match and fourcc and size:
+            modes.append(CaptureMode(fourcc.strip(), size[0], size[1], float(match.group(1))))
+    return modes
+
+
+def probe_capture_modes(capture):
+    """
+    Find supported modes by setting each probe size and reading it back.
+    Restores the original mode afterwards.
+    """
+    original = current_mode(capture)
+    modes = []
+    for fourcc in ('MJPG', 'YUYV'):
+        if not capture.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc)):
+            continue
+        if fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)).strip() != fourcc:
+            continue
+        for width, height in PROBE_SIZES:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            actual = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            if actual == (width, height):
+                modes.append(CaptureMode(fourcc, width, height, capture.get(cv2.CAP_PROP_FPS) or 30.0))
+    apply_capture_mode(capture, original)
+    return modes
+
+
+def current_mode(capture):
+    return CaptureMode(
+        fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)).strip(),
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        capture.get(cv2.CAP_PROP_FPS),
+    )
+
+
+def bus_bytes_per_sec(mode):
+    return mode.width * mode.height * mode.fps * BYTES_PER_PIXEL.get(mode.fourcc, 3)
+
+
+def choose_capture_mode(modes, compose_megapix=-1, target_fps=30.0, num_cameras=1,
+                        bus_budget=USB2_BUS_BYTES_PER_SEC, preferred_fourcc=None, current=None):
+    """
+    Pick the cheapest mode that still covers the compose resolution.
+
+    Modes slower than ``target_fps`` are avoided and the smallest frame with
+    at least ``compose_megapix`` megapixels wins. When compose_megapix is not
+    set the ``current`` frame size is kept (the largest size if it is not
+    available at the target rate). Uncompressed formats are only used
+    when all ``num_cameras`` fit into ``bus_budget`` together; otherwise
+    MJPG is preferred so every camera can run at full rate.
+    """
+    if not modes:
+        return None
+    if preferred_fourcc:
+        preferred = [m for m in modes if m.fourcc == preferred_fourcc]
+        modes = preferred or modes
+    fast = [m for m in modes if m.fps >= target_fps - 0.5] or modes
+
+    if compose_megapix and compose_megapix > 0:
+        needed = compose_megapix * 1e6
+        covering = [m for m in fast if m.width * m.height >= needed]
+        if covering:
+            pixels = min(m.width * m.height for m in covering)
+        else:
+            pixels = max(m.width * m.height for m in fast)
+    elif current is not None and any((m.width, m.height) == (current.width, current.height) for m in fast):
+        pixels = current.width * current.height
+    else:
+        pixels = max(m.width * m.height for m in fast)
+    candidates = [m for m in fast if m.width * m.height == pixels]
+
+    def cost(mode):
+        over_budget = bus_bytes_per_sec(mode) * num_cameras > bus_budget
+        # Prefer uncompressed (no JPEG decode) when the bus can carry it
+        return (over_budget, mode.fourcc == 'MJPG', -mode.fps)
+
+    return min(candidates, key=cost)
+
+
+def apply_capture_mode(capture, mode, buffer_size=1):
+    """
+    Configure ``capture`` for ``mode`` and return the mode the driver accepted.
+    FOURCC must be set before the size for V4L2 to pick the right format.
+    """
+    if mode is None:
+        return current_mode(capture)
+    capture.set(cv2.CAP_PROP_FOURCC, fourcc_code(mode.fourcc))
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, mode.width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, mode.height)
+    capture.set(cv2.CAP_PROP_FPS, mode.fps)
+    if buffer_size:
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+    actual = current_mode(capture)
+    if (actual.width, actual.height, actual.fourcc) != (mode.width, mode.height, mode.fourcc):
+        logging.warning(f"Requested capture mode {mode}, driver selected {actual}.")
+    return actual
+
+
+def plan_capture_modes(device_indices, captures, compose_megapix=-1, target_fps=30.0,
+                       capture_format='auto', bus_budget=USB2_BUS_BYTES_PER_SEC, raw_yuv=False):
+    """
+    Choose a capture mode for every camera of the rig without applying it.
+    With ``raw_yuv``, YUYV cameras deliver their packed YUV frames without
+    conversion to BGR, for stitching in YUV.
+    Returns ``(mode, convert_rgb)`` per camera, ``None`` for cameras that
+    are skipped.
+    """
+    preferred = None if capture_format in (None, '', 'auto') else capture_format
+    plans = []
+    for device_index, capture in zip(device_indices, captures):
+        if capture is None or not capture.isOpened() or device_index is None:
+            plans.append(None)  # Closed, or a virtual camera with a fixed mode
+            continue
+        modes = list_capture_modes(device_index, capture)
+        current = current_mode(capture)
+        mode = choose_capture_mode(modes, compose_megapix, target_fps, len(captures), bus_budget, preferred,
+                                   current=current)
+        mode = mode or current
+        plans.append((mode, not (raw_yuv and mode.fourcc == 'YUYV')))
+    return plans
+
+
+def capture_mode_changes(captures, plans):
+    """
+    Per camera, how applying ``plans`` would change it: ``'format'`` when the
+    frame size, FOURCC or RGB conversion changes (frames look different, so
+    a calibration no longer holds), ``'rate'`` when only the frame rate
+    does, ``None`` otherwise.
+    """
+    changes = []
+    for capture, plan in zip(captures, plans):
+        if plan is None:
+            changes.append(None)
+            continue
+        mode, convert_rgb = plan
+        current = current_mode(capture)
+        if ((mode.fourcc, mode.width, mode.height) != (current.fourcc, current.width, current.height)
+                or convert_rgb != bool(capture.get(cv2.CAP_PROP_CONVERT_RGB))):
+            changes.append('format')
+        elif abs(mode.fps - current.fps) > 0.5:
+            changes.append('rate')
+        else:
+            changes.append(None)
+    return changes
+
+
+def apply_capture_modes(device_indices, captures, plans):
+    """
+    Apply the ``plan_capture_modes`` result; returns the applied modes.
+    """
+    applied = []
+    for device_index, capture, plan in zip(device_indices, captures, plans):
+        if plan is None:
+            applied.append(None)
+            continue
+        mode, convert_rgb = plan
+        applied.append(apply_capture_mode(capture, mode))
+        capture.set(cv2.CAP_PROP_CONVERT_RGB, 1 if convert_rgb else 0)
+        logging.info(f"Camera {device_index}: capture mode {applied[-1]}.")
+    return applied
+
+
+def negotiate_capture_modes(device_indices, captures, compose_megapix=-1, target_fps=30.0,
+                            capture_format='auto', bus_budget=USB2_BUS_BYTES_PER_SEC, raw_yuv=False):
+    """
+    Choose and apply a capture mode for every camera of the rig (see
+    ``plan_capture_modes``). Returns the applied modes, ``None`` for cameras
+    that were skipped.
+    """
+    plans = plan_capture_modes(device_indices, captures, compose_megapix, target_fps, capture_format, bus_budget,
+                               raw_yuv)
+    return apply_capture_modes(device_indices, captures, plans)
@@ -0,0 +1,253 @@
+# capture_sources.py
+import glob
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class ReplaySource:
+    """
+    Virtual camera that replays a video file or a directory of frames and
+    behaves like a ``cv2.VideoCapture`` (``isOpened``/``read``/``get``/
+    ``set``/``release``), so it can stand in for a device anywhere.
+
+    With ``realtime`` the source paces itself like a live camera: frame ``k``
+    arrives at ``k / fps`` plus a random ``jitter`` (seconds, standard
+    deviation), ``read`` blocks until the next frame arrives and a late
+    reader gets the newest arrived frame, as with a one-frame V4L2 buffer.
+    Without it every ``read`` returns the next frame immediately. A fraction
+    ``drop_rate`` of the frames never arrives and reading a fraction
+    ``fail_rate`` of them fails. All randomness is derived from ``seed`` and
+    the frame index, so a run can be repeated exactly.
+    """
+
+    def __init__(self, path, fps=None, jitter=0.0, drop_rate=0.0, fail_rate=0.0, seed=0, realtime=True,
+                 loop=True, preload=False, crop=None, start_frame=0):
+        self.path = path
+        self.jitter = jitter
+        self.drop_rate = min(drop_rate, 0.99)
+        self.fail_rate = fail_rate
+        self.realtime = realtime
+        self.loop = loop
+        self.crop = crop  # (x, y, w, h) cut from every frame
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.capture = None
+        self.files = None
+        self.frames = None
+        self.position = start_frame  # Index of the next frame to deliver
+        self.start_frame = start_frame  # Frame that arrives at ``started``
+        self.opened = False
+
+        if os.path.isdir(path):
+            self.files = sorted(f for f in glob.glob(os.path.join(path, '*'))
+                                if f.lower().endswith(IMAGE_EXTENSIONS))
+            self.frame_count = len(self.files)
+            self.native_fps = 30.0
+        else:
+            self.capture = cv2.VideoCapture(path)
+            self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT)) if self.capture.isOpened() else 0
+            self.native_fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.fps = fps or self.native_fps
+        if self.frame_count <= 0:
+            logging.error(f"Replay source {path} has no frames.")
+            return
+
+        first = self.load(0)
+        if first is None:
+            logging.error(f"Replay source {path} could not be decoded.")
+            return
+        self.height, self.width = first.shape[:2]
+        if preload:
+            self.frames = [first] + [self.load(i) for i in range(1, self.frame_count)]
+        self.opened = True
+        self.started = time.monotonic()
+
+    def load(self, index):
+        if self.files is not None:
+            frame = cv2.imread(self.files[index])
+        else:
+            if int(self.capture.get(cv2.CAP_PROP_POS_FRAMES)) != index:
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = self.capture.read()
+            frame = frame if ok else None
+        if frame is not None and self.crop:
+            x, y, w, h = self.crop
+            frame = np.ascontiguousarray(frame[y:y + h, x:x + w])
+        return frame
+
+    def frame(self, index):
+        if not self.loop and index >= self.frame_count:
+            return None
+        index %= self.frame_count
+        if self.frames is not None:
+            return self.frames[index]
+        return self.load(index)
+
+    def frame_events(self, index):
+        """
+        ``(arrival_time, dropped, failed)`` of frame ``index``, drawn from a
+        generator seeded by the frame index so they do not depend on when or
+        how often the source is read.
+        """
+        rng = np.random.default_rng([self.seed, index])
+        jitter, drop, fail = rng.normal(), rng.random(), rng.random()
+        arrival = self.started + (index - self.start_frame) / self.fps + abs(jitter) * self.jitter
+        return arrival, drop < self.drop_rate, fail < self.fail_rate
+
+    def next_delivered(self, index):
+        """
+        First frame at or after ``index`` that is not dropped in transport.
+        """
+        while self.frame_events(index)[1]:
+            index += 1
+        return index
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        with self.lock:
+            if not self.opened:
+                return False, None
+            index = self.next_delivered(self.position)
+            if self.realtime:
+                delay = self.frame_events(index)[0] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                # A slow reader only sees the newest frame that has arrived
+                following = self.next_delivered(index + 1)
+                while self.frame_events(following)[0] <= time.monotonic():
+                    index = following
+                    following = self.next_delivered(index + 1)
+            self.position = index + 1
+            if self.frame_events(index)[2]:
+                return False, None
+            frame = self.frame(index)
+            if frame is None:
+                return False, None
+            return True, frame.copy() if self.frames is not None else frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width) if self.opened else 0.0
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height) if self.opened else 0.0
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.frame_count)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FOURCC:
+            return float(cv2.VideoWriter_fourcc(*'BGR3'))
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FPS and value > 0:
+            with self.lock:
+                self.fps = float(value)
+                self.restart(self.position)
+            return True
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            with self.lock:
+                self.restart(int(value))
+            return True
+        return False  # Size and format are fixed by the recording
+
+    def restart(self, position):
+        self.position = position
+        self.start_frame = position
+        self.started = time.monotonic()
+
+    def release(self):
+        with self.lock:
+            self.opened = False
+            if self.capture is not None:
+                self.capture.release()
+            self.frames = None
+
+
+def open_device(spec, **params):
+    return cv2.VideoCapture(int(spec), cv2.CAP_V4L2)
+
+
+def open_replay(spec, **params):
+    options = {}
+    for key, value in params.items():
+        if key in ('fps', 'jitter', 'drop_rate', 'fail_rate'):
+            options[key] = float(value)
+        elif key in ('seed', 'start_frame'):
+            options[key] = int(value)
+        elif key in ('realtime', 'loop', 'preload'):
+            options[key] = value.lower() in ('1', 'true', 'yes')
+        elif key == 'crop':
+            options[key] = tuple(int(v) for v in value.split(','))
+        else:
+            logging.warning(f"Unknown replay option '{key}' ignored.")
+    return ReplaySource(spec, **options)
+
+
+CAPTURE_SOURCES = OrderedDict()
+CAPTURE_SOURCES['device'] = open_device
+CAPTURE_SOURCES['replay'] = open_replay
+
+
+def parse_source_spec(spec):
+    """
+    Split ``[kind:]target[?key=value&...]`` into ``(kind, target, params)``.
+    Bare integers are V4L2 device indices; anything else is replayed.
+    """
+    spec = str(spec).strip()
+    kind, target = 'device', spec
+    for name in CAPTURE_SOURCES:
+        if spec.startswith(name + ':'):
+            kind, target = name, spec[len(name) + 1:]
+            break
+    else:
+        if not spec.isdigit():
+            kind = 'replay'
+    params = {}
+    if '?' in target:
+        target, query = target.split('?', 1)
+        params = dict(parse_qsl(query))
+    return kind, target, params
+
+
+def open_capture_source(spec):
+    """
+    Open a camera by its spec: ``"0"`` (device index), ``"replay:clip.mp4?fps=15&jitter=0.004"``
+    or a path to a video file or frame directory.
+    """
+    kind, target, params = parse_source_spec(spec)
+    return CAPTURE_SOURCES[kind](target, **params)
+
+
+def expand_source_specs(specs):
+    """
+    Expand ``;``-separated specs; a spec with a ``count`` parameter becomes
+    ``count`` cameras with ``{index}`` in its target replaced by 0, 1, ...
+    and a different jitter seed each, e.g.
+    ``replay:/data/rig/cam{index}.mp4?count=16&fps=30``.
+    """
+    expanded = []
+    for spec in (s.strip() for s in specs.split(';')):
+        if not spec:
+            continue
+        kind, target, params = parse_source_spec(spec)
+        count = int(params.pop('count', 1))
+        seed = int(params.pop('seed', 0))
+        for index in range(count):
+            options = dict(params, seed=seed + index) if kind == 'replay' else params
+            query = '&'.join(f'{k}={v}' for k, v in options.items())
+            source = f"{kind}:{target.replace('{index}', str(index))}"
+            expanded.append(f"{source}?{query}" if query else source)
+    return expanded
@@ -0,0 +1,38 @@
+# cli_options.py
+import ast
+
+
+def parse_duration(text):
+    """
+    Seconds from ``'90'``, ``'90s'``, ``'15m'`` or ``'8h'``.
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def parse_assignments(items):
+    """
+    ``key=value`` pairs into a dict; values are Python literals where possible.
+    """
+    parsed = {}
+    for item in items or ():
+        key, _, value = item.partition('=')
+        try:
+            parsed[key.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed[key.strip()] = value
+    return parsed
+
+
+def parse_rig_options(items, cast=str):
+    """
+    ``name=value`` pairs into a dict of rig name to ``cast(value)``.
+    """
+    options = {}
+    for item in items or ():
+        name, _, value = item.partition('=')
+        options[name.strip()] = cast(value)
+    return options
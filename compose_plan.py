@@ -0,0 +1,374 @@
+# compose_plan.py
+import copy
+
+import cv2 as cv
+import numpy as np
+
+
+# BGR weights of luma (BT.601), for folding colour gains into a luma plane
+LUMA_WEIGHTS = np.array([0.114, 0.587, 0.299], np.float32)
+
+# Projections the compose stage renders with an OpenCV warper of another name
+WARPER_NAMES = {'equirectangular': 'spherical'}
+
+
+def rotation_warper(warp_type, scale):
+    """
+    ``cv.PyRotationWarper`` for ``warp_type``; 'equirectangular' is the
+    spherical projection, whose canvas is longitude x latitude.
+    """
+    return cv.PyRotationWarper(WARPER_NAMES.get(warp_type, warp_type), scale)
+
+
+class ComposePlan:
+    """
+    Per-calibration state of the compose stage.
+
+    Everything here depends only on the calibrated cameras, the render
+    settings and the size of the incoming frames, so it is built once and
+    reused for every frame: compose-scale cameras, the warper, per-camera
+    remap tables, warped masks and the output canvas ROI. The projection
+    is independent of calibration, so the stitcher keeps one plan per
+    projection and compose resolution and switches between them freely.
+
+    The 'equirectangular' projection covers the full sphere: the canvas
+    spans 360 degrees of longitude and 180 of latitude around the rig,
+    with the cameras placed where they look.
+    """
+
+    channels = 3  # Channels of the frames composed with this plan
+
+    def __init__(self, stitcher, frame_sizes, cache_float_maps=True):
+        self.frame_sizes = tuple(frame_sizes)
+        self.warp_type = stitcher.warp_type
+        self.compose_megapix = stitcher.compose_megapix
+        self.cache_float_maps = cache_float_maps
+        self.num_images = len(self.frame_sizes)
+
+        full_w, full_h = self.frame_sizes[0]
+        self.compose_scale = 1
+        if stitcher.compose_megapix > 0:
+            self.compose_scale = min(1.0, np.sqrt(stitcher.compose_megapix * 1e6 / (full_w * full_h)))
+        compose_work_aspect = self.compose_scale / stitcher.work_scale
+        self.warped_image_scale = stitcher.warped_image_scale * compose_work_aspect
+        self.warper = rotation_warper(stitcher.warp_type, self.warped_image_scale)
+
+        self.K = []
+        self.R = []
+        self.compose_sizes = []
+        self.frame_scales = []
+        self.lenses = []
+        self.corners = []
+        self.sizes = []
+        self.xmaps = []
+        self.ymaps = []
+        self.masks_warped = []
+        for idx in range(self.num_images):
+            cam = stitcher.cameras[idx]
+            K = cam.K().astype(np.float32)
+            K[0, 0] *= compose_work_aspect
+            K[0, 2] *= compose_work_aspect
+            K[1, 1] *= compose_work_aspect
+            K[1, 2] *= compose_work_aspect
+            R = np.asarray(cam.R, dtype=np.float32)
+            sz = (int(round(stitcher.full_img_sizes[idx][0] * self.compose_scale)),
+                  int(round(stitcher.full_img_sizes[idx][1] * self.compose_scale)))
+            roi, xmap, ymap = self.warper.buildMaps(sz, K, R)
+
+            # Fold the compose resize and the lens distortion into the lookup so
+            # each frame is sampled once, straight from the captured frame
+            frame_w, frame_h = self.frame_sizes[idx]
+            sx = frame_w / sz[0]
+            sy = frame_h / sz[1]
+            if abs(sx - 1) > 1e-6 or abs(sy - 1) > 1e-6:
+                xmap = (xmap + 0.5) * sx - 0.5
+                ymap = (ymap + 0.5) * sy - 0.5
+            lens = stitcher.lens_correction(idx, self.frame_sizes[idx])
+            if lens is not None:
+                xmap, ymap = lens.distort(xmap, ymap)
+            xmap, ymap = cv.convertMaps(xmap, ymap, cv.CV_16SC2)
+
+            mask = 255 * np.ones((frame_h, frame_w), np.uint8)
+            mask_warped = cv.remap(mask, xmap, ymap, cv.INTER_NEAREST, borderMode=cv.BORDER_CONSTANT)
+
+            self.K.append(K)
+            self.R.append(R)
+            self.compose_sizes.append(sz)
+            self.frame_scales.append((sx, sy))
+            self.lenses.append(lens)
+            self.corners.append((int(roi[0]), int(roi[1])))
+            self.sizes.append((mask_warped.shape[1], mask_warped.shape[0]))
+            self.xmaps.append(xmap)
+            self.ymaps.append(ymap)
+            self.masks_warped.append(mask_warped)
+
+        self.dst_roi = cv.detail.resultRoi(corners=self.corners, sizes=self.sizes)
+        if self.warp_type == 'equirectangular':
+            # u = scale * longitude in [-pi, pi], v = scale * colatitude in [0, pi]
+            x0, y0, w, h = self.dst_roi
+            left = min(x0, int(np.floor(-np.pi * self.warped_image_scale)))
+            top = min(y0, 0)
+            right = max(x0 + w, int(np.ceil(np.pi * self.warped_image_scale)))
+            bottom = max(y0 + h, int(np.ceil(np.pi * self.warped_image_scale)))
+            self.dst_roi = (left, top, right - left, bottom - top)
+        self.compositor = None  # Compositor built on this plan and the settings it was built for
+        self.compositor_key = None
+        self._partition = None
+        self._yuv_plans = None
+        self._float_maps = {}
+
+    @staticmethod
+    def key(stitcher, frames):
+        """
+        What a plan depends on besides the calibration: projection, compose
+        resolution and frame sizes.
+        """
+        return stitcher.warp_type, stitcher.compose_megapix, tuple((f.shape[1], f.shape[0]) for f in frames)
+
+    def matches(self, frames):
+        return tuple((f.shape[1], f.shape[0]) for f in frames) == self.frame_sizes
+
+    def canvas_roi(self, idx):
+        """
+        Return ``(x, y, w, h)`` of camera ``idx`` relative to the output canvas.
+        """
+        return (self.corners[idx][0] - self.dst_roi[0], self.corners[idx][1] - self.dst_roi[1],
+                self.sizes[idx][0], self.sizes[idx][1])
+
+    def warp(self, idx, frame, dst=None):
+        return cv.remap(frame, self.xmaps[idx], self.ymaps[idx], cv.INTER_LINEAR,
+                        dst=dst, borderMode=cv.BORDER_REFLECT)
+
+    def warp_region(self, idx, frame, rect, dst=None):
+        """
+        Warp only the part of camera ``idx`` that falls in the canvas
+        rectangle ``rect``, which must lie inside the camera's ROI.
+        """
+        x, y, w, h = rect
+        cx, cy, _, _ = self.canvas_roi(idx)
+        rows = slice(y - cy, y - cy + h)
+        cols = slice(x - cx, x - cx + w)
+        return cv.remap(frame, self.xmaps[idx][rows, cols], self.ymaps[idx][rows, cols], cv.INTER_LINEAR,
+                        dst=dst, borderMode=cv.BORDER_REFLECT)
+
+    def to_frame(self, idx, x, y):
+        """
+        Captured-frame coordinates of compose-scale image coordinates of
+        camera ``idx`` (float arrays), i.e. what the remap tables hold.
+        """
+        sx, sy = self.frame_scales[idx]
+        x = (x + 0.5) * sx - 0.5
+        y = (y + 0.5) * sy - 0.5
+        if self.lenses[idx] is not None:
+            return self.lenses[idx].distort(x, y)
+        return x.astype(np.float32), y.astype(np.float32)
+
+    def from_frame(self, idx, x, y):
+        """
+        Compose-scale image coordinates of the captured-frame point ``(x, y)``.
+        """
+        if self.lenses[idx] is not None:
+            x, y = self.lenses[idx].undistort_point(x, y)
+        sx, sy = self.frame_scales[idx]
+        return (x + 0.5) / sx - 0.5, (y + 0.5) / sy - 0.5
+
+    def float_maps(self, idx):
+        """
+        Camera ``idx``'s remap table as float32 ``(map_x, map_y)``, for
+        resampling it at other output positions. Cached unless
+        ``cache_float_maps`` is off, as they are twice the size of the tables.
+        """
+        if idx in self._float_maps:
+            return self._float_maps[idx]
+        maps = cv.convertMaps(self.xmaps[idx], self.ymaps[idx], cv.CV_32FC1)
+        if self.cache_float_maps:
+            self._float_maps[idx] = maps
+        return maps
+
+    def pixel_shape(self, h, w):
+        return (h, w) if self.channels == 1 else (h, w, self.channels)
+
+    def yuv_plans(self):
+        """
+        ``(luma, chroma)`` plans for composing ``YuvFrame`` planes: the luma
+        plan shares this plan's tables, the chroma plan samples them at
+        every other canvas pixel for the half-resolution chroma planes.
+        """
+        if self._yuv_plans is None:
+            luma = copy.copy(self)
+            luma.channels = 1
+            luma.compositor = luma.compositor_key = None
+            self._yuv_plans = (luma, self.chroma_plan())
+        return self._yuv_plans
+
+    def chroma_plan(self):
+        _, _, canvas_w, canvas_h = self.dst_roi
+        chroma = copy.copy(self)
+        chroma.channels = 2
+        chroma.compositor = chroma.compositor_key = None
+        chroma.frame_sizes = tuple(((w + 1) // 2, (h + 1) // 2) for w, h in self.frame_sizes)
+        chroma.dst_roi = (0, 0, (canvas_w + 1) // 2, (canvas_h + 1) // 2)
+        chroma.corners, chroma.sizes = [], []
+        chroma.xmaps, chroma.ymaps, chroma.masks_warped = [], [], []
+        chroma._partition = None
+        chroma._float_maps = {}
+        for idx in range(self.num_images):
+            x, y, w, h = self.canvas_roi(idx)
+            cx, cy = x // 2, y // 2
+            cw, ch = (x + w + 1) // 2 - cx, (y + h + 1) // 2 - cy
+            # Luma position of every chroma pixel centre, in camera-local luma pixels
+            u = np.arange(cx, cx + cw, dtype=np.float32) * 2 + 0.5 - x
+            v = np.arange(cy, cy + ch, dtype=np.float32) * 2 + 0.5 - y
+            local_x, local_y = np.meshgrid(u, v)
+            map_x, map_y = self.float_maps(idx)
+            xmap = cv.remap(map_x, local_x, local_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+            ymap = cv.remap(map_y, local_x, local_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+            xmap, ymap = cv.convertMaps((xmap + 0.5) / 2 - 0.5, (ymap + 0.5) / 2 - 0.5, cv.CV_16SC2)
+            mask = cv.remap(self.masks_warped[idx], local_x, local_y, cv.INTER_NEAREST,
+                            borderMode=cv.BORDER_CONSTANT, borderValue=0)
+            chroma.corners.append((cx, cy))
+            chroma.sizes.append((cw, ch))
+            chroma.xmaps.append(xmap)
+            chroma.ymaps.append(ymap)
+            chroma.masks_warped.append(mask)
+        return chroma
+
+    @property
+    def partition(self):
+        if self._partition is None:
+            self._partition = RegionPartition(self)
+        return self._partition
+
+    def gain_map(self, compensator, idx):
+        """
+        Per-pixel BGR exposure gains of camera ``idx`` at warped size, as the
+        compensator would apply them, so they can be folded into blend weights.
+        Returns ``None`` when the compensator does not change the image, and
+        for chroma planes, which are not compensated.
+        """
+        if self.channels == 2:
+            return None
+        w, h = self.sizes[idx]
+        try:
+            gains = compensator.getMatGains()
+        except cv.error:
+            return None
+        if not gains:
+            return None
+        gain = np.asarray(gains[idx], dtype=np.float32)
+        if gain.ndim >= 2 and gain.shape[0] > 1 and gain.shape[1] > 1:
+            # Block compensators: per-block gain grid, upsampled like BlocksCompensator::apply
+            gain = cv.resize(gain, (w, h), interpolation=cv.INTER_LINEAR)
+            if self.channels == 1:
+                return gain if gain.ndim == 2 else gain @ LUMA_WEIGHTS
+            if gain.ndim == 2:
+                gain = cv.merge([gain, gain, gain])
+            return gain
+        gain = gain.ravel()
+        if gain.size == 1:
+            gain = np.repeat(gain, 3)
+        if self.channels == 1:
+            return np.broadcast_to(np.float32(gain[:3] @ LUMA_WEIGHTS), (h, w))
+        return np.broadcast_to(gain[:3].reshape(1, 1, 3), (h, w, 3))
+
+
+class RegionPartition:
+    """
+    Split of the output canvas into rectangles covered by exactly one camera,
+    which can be copied straight from that camera, and rectangles that need
+    weighted blending (overlaps and mask borders).
+
+    The canvas is classified in ``block`` x ``block`` tiles; runs of tiles
+    with the same class are merged into larger rectangles.
+    """
+
+    BLOCK = 32
+
+    def __init__(self, plan, block=BLOCK):
+        self.block = block
+        _, _, canvas_w, canvas_h = plan.dst_roi
+        coverage = np.zeros((canvas_h, canvas_w), np.uint8)
+        owner = np.full((canvas_h, canvas_w), -1, np.int16)
+        for idx in range(plan.num_images):
+            x, y, w, h = plan.canvas_roi(idx)
+            covered = plan.masks_warped[idx] > 0
+            coverage[y:y + h, x:x + w] += covered.astype(np.uint8)
+            owner[y:y + h, x:x + w][covered] = idx
+
+        rows = -(-canvas_h // block)
+        cols = -(-canvas_w // block)
+        pad = ((0, rows * block - canvas_h), (0, cols * block - canvas_w))
+        cov = np.pad(coverage, pad).reshape(rows, block, cols, block)
+        own = np.pad(owner, pad, constant_values=-1).reshape(rows, block, cols, block)
+        cov_min = cov.min(axis=(1, 3))
+        cov_max = cov.max(axis=(1, 3))
+        own_min = own.min(axis=(1, 3))
+        own_max = own.max(axis=(1, 3))
+
+        # Tile labels: camera index for single coverage, -1 empty, -2 blend
+        labels = np.full((rows, cols), -2, np.int32)
+        single = (cov_min == 1) & (cov_max == 1) & (own_min == own_max)
+        labels[single] = own_min[single]
+        labels[cov_max == 0] = -1
+
+        self.copy_rects = []
+        self.blend_rects = []
+        for label, x, y, w, h in self.merge_tiles(labels):
+            w = min(w, canvas_w - x)
+            h = min(h, canvas_h - y)
+            if label >= 0:
+                self.copy_rects.append((int(label), x, y, w, h))
+            elif label == -2:
+                cams = []
+                for idx in range(plan.num_images):
+                    inter = intersect((x, y, w, h), plan.canvas_roi(idx))
+                    if inter is None:
+                        continue
+                    ix, iy, iw, ih = inter
+                    cx, cy, _, _ = plan.canvas_roi(idx)
+                    if plan.masks_warped[idx][iy - cy:iy - cy + ih, ix - cx:ix - cx + iw].any():
+                        cams.append(idx)
+                self.blend_rects.append((x, y, w, h, cams))
+
+        area = float(canvas_w * canvas_h) or 1.0
+        self.copy_fraction = sum(w * h for _, _, _, w, h in self.copy_rects) / area
+        self.blend_fraction = sum(w * h for _, _, w, h, _ in self.blend_rects) / area
+
+    def merge_tiles(self, labels):
+        """
+        Merge equal-label tiles into rectangles: horizontal runs first, then
+        runs with the same extent on consecutive rows.
+        """
+        block = self.block
+        rects = []
+        open_runs = {}
+        for row in range(labels.shape[0]):
+            runs = []
+            start = 0
+            for col in range(1, labels.shape[1] + 1):
+                if col == labels.shape[1] or labels[row, col] != labels[row, start]:
+                    runs.append((int(labels[row, start]), start, col))
+                    start = col
+            next_runs = {}
+            for run in runs:
+                if run in open_runs:
+                    next_runs[run] = open_runs.pop(run)
+                else:
+                    next_runs[run] = row
+            for (label, c0, c1), r0 in open_runs.items():
+                rects.append((label, c0 * block, r0 * block, (c1 - c0) * block, (row - r0) * block))
+            open_runs = next_runs
+        for (label, c0, c1), r0 in open_runs.items():
+            rects.append((label, c0 * block, r0 * block, (c1 - c0) * block, (labels.shape[0] - r0) * block))
+        return rects
+
+
+def intersect(a, b):
+    """
+    Intersection of two ``(x, y, w, h)`` rectangles, or ``None``.
+    """
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
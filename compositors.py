@@ -0,0 +1,578 @@
+# compositors.py
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+from compose_plan import intersect
+from yuv_frame import YuvFrame
+
+
+class FixedPointCompositor:
+    """
+    Feather compositing in 8-bit fixed point.
+
+    Blend weights (feather ramps, normalised across cameras and multiplied by
+    the exposure gains) are precomputed once per compose plan as Q8 integers.
+    Using the plan's region partition, canvas rectangles covered by a single
+    camera are remapped straight into the uint8 panorama (followed by a gain
+    multiply only if that camera is exposure compensated); only overlap and
+    border rectangles pay for a saturating multiply and add per camera. There
+    are no int16 copies and no min-max normalisation, so brightness stays
+    stable from frame to frame.
+    """
+
+    WEIGHT_BITS = 8
+
+    def __init__(self, plan, blend_type='feather', blend_strength=50, compensator=None, **kwargs):
+        self.plan = plan
+        self.blend_type = blend_type
+        self.blend_strength = blend_strength
+        self.weights = self.build_weights(compensator)
+        self.gains = self.build_gains(compensator)
+        self.tiles = {}
+
+    def feather_width(self):
+        _, _, w, h = self.plan.dst_roi
+        return np.sqrt(w * h) * self.blend_strength / 100
+
+    def owner_map(self, by_distance=False):
+        """
+        Canvas-sized map of the camera each pixel is taken from under a hard
+        seam (-1 where no camera covers the pixel). By default later cameras
+        overwrite earlier ones like Blender_NO; ``by_distance`` gives each
+        pixel to the camera whose mask border is furthest away instead.
+        """
+        plan = self.plan
+        _, _, canvas_w, canvas_h = plan.dst_roi
+        owner = np.full((canvas_h, canvas_w), -1, np.int16)
+        best = np.zeros((canvas_h, canvas_w), np.float32)
+        for idx in range(plan.num_images):
+            x, y, w, h = plan.canvas_roi(idx)
+            mask = plan.masks_warped[idx]
+            if by_distance:
+                dist = cv.distanceTransform(mask, cv.DIST_L1, 3)
+                take = (mask > 0) & (dist >= best[y:y + h, x:x + w])
+                best[y:y + h, x:x + w][take] = dist[take]
+            else:
+                take = mask > 0
+            owner[y:y + h, x:x + w][take] = idx
+        return owner
+
+    def raw_weights(self):
+        """
+        Unnormalised float32 weight map per camera, at warped size.
+        """
+        plan = self.plan
+        blend_width = self.feather_width()
+        weights = []
+        if self.blend_type == 'no' or blend_width < 1:
+            owner = self.owner_map()
+            for idx in range(plan.num_images):
+                x, y, w, h = plan.canvas_roi(idx)
+                weights.append((owner[y:y + h, x:x + w] == idx).astype(np.float32))
+            return weights
+        if self.blend_type != 'feather':
+            logging.warning(f"Blend type '{self.blend_type}' is not supported by the fixed-point "
+                            f"compositor, using feather.")
+        sharpness = 1. / blend_width
+        for mask in plan.masks_warped:
+            # Same ramp as FeatherBlender::createWeightMap
+            weight = cv.distanceTransform(mask, cv.DIST_L1, 3)
+            weight = np.minimum(weight * sharpness, 1.0)
+            weights.append(weight.astype(np.float32))
+        return weights
+
+    def build_weights(self, compensator):
+        plan = self.plan
+        weights = self.raw_weights()
+        _, _, canvas_w, canvas_h = plan.dst_roi
+        total = np.zeros((canvas_h, canvas_w), np.float32)
+        for idx, weight in enumerate(weights):
+            x, y, w, h = plan.canvas_roi(idx)
+            total[y:y + h, x:x + w] += weight
+        total = np.maximum(total, 1e-5)
+
+        one = 1 << self.WEIGHT_BITS
+        fixed = []
+        for idx, weight in enumerate(weights):
+            x, y, w, h = plan.canvas_roi(idx)
+            normed = (weight / total[y:y + h, x:x + w]) * one
+            fixed.append(self.to_fixed(cv.merge([normed] * plan.channels), idx, compensator))
+        return fixed
+
+    def to_fixed(self, weight, idx, compensator):
+        """
+        Fold the exposure gains of camera ``idx`` into a per-channel Q8 weight.
+        """
+        gain = self.plan.gain_map(compensator, idx) if compensator is not None else None
+        if gain is not None:
+            weight = weight * gain
+        return np.clip(np.rint(weight), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+    def build_gains(self, compensator):
+        """
+        Q8 exposure gain map per camera, or ``None`` where the gains are unity
+        and single-coverage regions can be copied without a multiply.
+        """
+        one = 1 << self.WEIGHT_BITS
+        gains = []
+        for idx in range(self.plan.num_images):
+            w, h = self.plan.sizes[idx]
+            gain = self.to_fixed(np.full(self.plan.pixel_shape(h, w), one, np.float32), idx, compensator)
+            gains.append(None if (gain == one).all() else gain)
+        return gains
+
+    def camera_slice(self, idx, rect):
+        """
+        Index of the canvas rectangle ``rect`` in camera ``idx``'s warped arrays.
+        """
+        x, y, w, h = rect
+        cx, cy, _, _ = self.plan.canvas_roi(idx)
+        return slice(y - cy, y - cy + h), slice(x - cx, x - cx + w)
+
+    def compose(self, frames):
+        _, _, canvas_w, canvas_h = self.plan.dst_roi
+        out = np.zeros(self.plan.pixel_shape(canvas_h, canvas_w), np.uint8)
+        partition = self.plan.partition
+        self.compose_rects(frames, out, partition.copy_rects, partition.blend_rects, self.tiles)
+        return out
+
+    def compose_rects(self, frames, out, copy_rects, blend_rects, tiles):
+        """
+        Composite the given partition rectangles into ``out``. ``tiles`` holds
+        the per-rectangle scratch buffers reused between frames.
+        """
+        plan = self.plan
+        scale = 1. / (1 << self.WEIGHT_BITS)
+
+        # Single coverage: remap straight into the panorama
+        for idx, x, y, w, h in copy_rects:
+            roi = out[y:y + h, x:x + w]
+            plan.warp_region(idx, frames[idx], (x, y, w, h), dst=roi)
+            if self.gains[idx] is not None:
+                cv.multiply(roi, self.gains[idx][self.camera_slice(idx, (x, y, w, h))], dst=roi,
+                            scale=scale, dtype=cv.CV_8U)
+
+        # Overlaps and borders: weighted, saturating accumulation
+        for n, (x, y, w, h, cams) in enumerate(blend_rects):
+            for idx in cams:
+                rect = intersect((x, y, w, h), plan.canvas_roi(idx))
+                if rect is None:
+                    continue
+                rx, ry, rw, rh = rect
+                tile = plan.warp_region(idx, frames[idx], rect, dst=tiles.get((n, idx)))
+                cv.multiply(tile, self.weights[idx][self.camera_slice(idx, rect)], dst=tile,
+                            scale=scale, dtype=cv.CV_8U)
+                tiles[(n, idx)] = tile
+                roi = out[ry:ry + rh, rx:rx + rw]
+                cv.add(roi, tile, dst=roi)
+
+    def close(self):
+        pass
+
+
+class MultiBandCompositor(FixedPointCompositor):
+    """
+    Multi-band blending restricted to the overlap bands of the canvas.
+
+    Seams are placed where the camera masks are furthest apart. Away from a
+    seam every pyramid level has a single camera with weight one, so the
+    fixed-point hard-seam composite is already exact there and Laplacian
+    blending only runs on rectangles around the overlaps. The normalised
+    Gaussian pyramids of the seam masks are built once per compose plan;
+    each frame only builds the image pyramids, in buffers reused between
+    frames.
+    """
+
+    def __init__(self, plan, blend_type='multiband', blend_strength=50, compensator=None, max_bands=-1, **kwargs):
+        super().__init__(plan, blend_type=blend_type, blend_strength=blend_strength, compensator=compensator,
+                         **kwargs)
+        blend_width = self.feather_width()
+        self.num_bands = 0
+        if blend_width >= 1:
+            self.num_bands = int(np.log(blend_width) / np.log(2.) - 1.)
+            _, _, canvas_w, canvas_h = plan.dst_roi
+            self.num_bands = max(0, min(self.num_bands, int(np.ceil(np.log2(max(canvas_w, canvas_h))))))
+            if max_bands >= 0:
+                self.num_bands = min(self.num_bands, max_bands)
+        self.bands = self.build_bands(compensator) if self.num_bands > 0 else []
+
+    def raw_weights(self):
+        owner = self.owner_map(by_distance=True)
+        self.owner = owner
+        weights = []
+        for idx in range(self.plan.num_images):
+            x, y, w, h = self.plan.canvas_roi(idx)
+            weights.append((owner[y:y + h, x:x + w] == idx).astype(np.float32))
+        return weights
+
+    def band_rects(self):
+        """
+        Rectangles around the seams between cameras, grown by the support of
+        the coarsest pyramid level and merged where they touch.
+        """
+        owner = self.owner
+        seams = np.zeros(owner.shape, np.uint8)
+        for a, b, target in (
+                (owner[:, 1:], owner[:, :-1], seams[:, 1:]),
+                (owner[1:, :], owner[:-1, :], seams[1:, :])):
+            target |= ((a != b) & (a >= 0) & (b >= 0)).astype(np.uint8)
+        canvas_h, canvas_w = owner.shape
+        margin = 4 << self.num_bands
+        n, _, stats, _ = cv.connectedComponentsWithStats(seams)
+        rects = []
+        for x, y, w, h, _area in stats[1:n]:
+            rects.append([max(0, x - margin), max(0, y - margin),
+                          min(canvas_w, x + w + margin), min(canvas_h, y + h + margin)])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in rects]
+
+    def build_bands(self, compensator):
+        plan = self.plan
+        bands = []
+        unit = {}
+        for bx, by, bw, bh in self.band_rects():
+            sizes = [(bw, bh)]
+            for _ in range(self.num_bands):
+                sizes.append(((sizes[-1][0] + 1) // 2, (sizes[-1][1] + 1) // 2))
+
+            sources = []
+            for idx in range(plan.num_images):
+                cx, cy, cw, ch = plan.canvas_roi(idx)
+                ix0, iy0 = max(bx, cx), max(by, cy)
+                ix1, iy1 = min(bx + bw, cx + cw), min(by + bh, cy + ch)
+                if ix0 >= ix1 or iy0 >= iy1:
+                    continue
+                seam = (self.owner[by:by + bh, bx:bx + bw] == idx).astype(np.float32)
+                if not seam.any():
+                    continue
+                pyramid = [seam]
+                for level in range(self.num_bands):
+                    pyramid.append(cv.pyrDown(pyramid[-1], dstsize=sizes[level + 1]))
+                region = (ix0, iy0, ix1 - ix0, iy1 - iy0)
+                gain = self.gains[idx]
+                if gain is None:
+                    gain = unit.setdefault(idx, np.full(plan.pixel_shape(ch, cw), 1 << self.WEIGHT_BITS, np.uint16))
+                sources.append({
+                    'idx': idx,
+                    'region': region,
+                    'border': (iy0 - by, by + bh - iy1, ix0 - bx, bx + bw - ix1),
+                    'gain': np.ascontiguousarray(gain[self.camera_slice(idx, region)]),
+                    'weights': pyramid,
+                    'warped': None,
+                })
+            if not sources:
+                continue
+
+            # Normalise the weights across cameras at every level, once
+            for level in range(self.num_bands + 1):
+                total = sum(source['weights'][level] for source in sources)
+                total = np.maximum(total, 1e-5)
+                for source in sources:
+                    w = source['weights'][level] / total
+                    source['weights'][level] = cv.merge([w] * plan.channels)
+
+            bands.append({
+                'rect': (bx, by, bw, bh),
+                'sizes': sizes,
+                'sources': sources,
+                'gauss': [np.empty(plan.pixel_shape(h, w), np.float32) for w, h in sizes],
+                'up': [np.empty(plan.pixel_shape(h, w), np.float32) for w, h in sizes[:-1]],
+                'acc': [np.empty(plan.pixel_shape(h, w), np.float32) for w, h in sizes],
+                'inner': [None] * len(sources),
+                'result': np.empty(plan.pixel_shape(bh, bw), np.uint8),
+                'covered': (self.owner[by:by + bh, bx:bx + bw] >= 0).astype(np.uint8),
+            })
+        return bands
+
+    def compose(self, frames):
+        plan = self.plan
+        out = super().compose(frames)
+        scale = 1. / (1 << self.WEIGHT_BITS)
+        for band in self.bands:
+            gauss, up, acc, sizes = band['gauss'], band['up'], band['acc'], band['sizes']
+            for level in acc:
+                level.fill(0)
+            for n, source in enumerate(band['sources']):
+                idx = source['idx']
+                source['warped'] = plan.warp_region(idx, frames[idx], source['region'], dst=source['warped'])
+                band['inner'][n] = cv.multiply(source['warped'], source['gain'], dst=band['inner'][n],
+                                               scale=scale, dtype=cv.CV_32F)
+                top, bottom, left, right = source['border']
+                cv.copyMakeBorder(band['inner'][n], top, bottom, left, right, cv.BORDER_REPLICATE, dst=gauss[0])
+                weights = source['weights']
+                for level in range(self.num_bands):
+                    cv.pyrDown(gauss[level], dst=gauss[level + 1], dstsize=sizes[level + 1])
+                    cv.pyrUp(gauss[level + 1], dst=up[level], dstsize=sizes[level])
+                    cv.subtract(gauss[level], up[level], dst=up[level])
+                    cv.multiply(up[level], weights[level], dst=up[level])
+                    cv.add(acc[level], up[level], dst=acc[level])
+                top_level = self.num_bands
+                cv.multiply(gauss[top_level], weights[top_level], dst=gauss[top_level])
+                cv.add(acc[top_level], gauss[top_level], dst=acc[top_level])
+
+            # Collapse the blended Laplacian pyramid
+            for level in range(self.num_bands - 1, -1, -1):
+                cv.pyrUp(acc[level + 1], dst=up[level], dstsize=sizes[level])
+                cv.add(acc[level], up[level], dst=acc[level])
+            bx, by, bw, bh = band['rect']
+            roi = out[by:by + bh, bx:bx + bw]
+            np.clip(acc[0], 0, 255, out=acc[0])
+            np.copyto(band['result'], acc[0], casting='unsafe')
+            cv.copyTo(band['result'], band['covered'], dst=roi)
+        return out
+
+
+class StripCompositor(FixedPointCompositor):
+    """
+    Fixed-point compositor that splits the canvas into strips along its long
+    axis and composites them on a thread pool.
+
+    Each strip knows, from the precomputed partition, which cameras cover it
+    and which rectangles to copy or blend, so workers only warp what lands in
+    their strip and write into disjoint slices of one shared output array.
+    OpenCV releases the GIL in remap/multiply/add, so strips run concurrently.
+    """
+
+    def __init__(self, plan, blend_type='feather', blend_strength=50, compensator=None, compose_threads=0,
+                 strips_per_thread=2, **kwargs):
+        super().__init__(plan, blend_type=blend_type, blend_strength=blend_strength, compensator=compensator,
+                         **kwargs)
+        self.threads = compose_threads if compose_threads and compose_threads > 0 else (os.cpu_count() or 1)
+        self.strips = self.build_strips(self.threads * strips_per_thread)
+        self.strip_tiles = [{} for _ in self.strips]
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='compose-strip')
+
+    def build_strips(self, count):
+        partition = self.plan.partition
+        _, _, canvas_w, canvas_h = self.plan.dst_roi
+        vertical = canvas_w >= canvas_h
+        length = canvas_w if vertical else canvas_h
+        count = max(1, min(count, length // partition.block))
+        # Cut on tile boundaries so strips do not split partition tiles
+        cuts = [int(round(i * length / count / partition.block)) * partition.block for i in range(count)] + [length]
+        strips = []
+        for start, stop in zip(cuts[:-1], cuts[1:]):
+            if stop <= start:
+                continue
+            if vertical:
+                bounds = (start, 0, stop - start, canvas_h)
+            else:
+                bounds = (0, start, canvas_w, stop - start)
+            copy_rects = []
+            for idx, x, y, w, h in partition.copy_rects:
+                rect = intersect((x, y, w, h), bounds)
+                if rect is not None:
+                    copy_rects.append((idx,) + rect)
+            blend_rects = []
+            for x, y, w, h, cams in partition.blend_rects:
+                rect = intersect((x, y, w, h), bounds)
+                if rect is None:
+                    continue
+                cams = [idx for idx in cams if intersect(rect, self.plan.canvas_roi(idx)) is not None]
+                if cams:
+                    blend_rects.append(rect + (cams,))
+            strips.append((bounds, copy_rects, blend_rects))
+        return strips
+
+    def compose(self, frames):
+        _, _, canvas_w, canvas_h = self.plan.dst_roi
+        out = np.zeros(self.plan.pixel_shape(canvas_h, canvas_w), np.uint8)
+        futures = [
+            self.executor.submit(self.compose_rects, frames, out, copy_rects, blend_rects, tiles)
+            for (_, copy_rects, blend_rects), tiles in zip(self.strips, self.strip_tiles)
+        ]
+        for future in futures:
+            future.result()
+        return out
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class IncrementalCompositor(FixedPointCompositor):
+    """
+    Fixed-point compositor that only recomposes what changed.
+
+    Every frame is reduced to one pixel per ``change_block`` x
+    ``change_block`` block and compared with a per-camera reference; blocks
+    that differ by more than ``change_threshold`` grey levels are marked
+    changed and copied into the reference, so slow drift is still caught
+    once it adds up. The partition rectangles are split into cells of at
+    most ``max_cell`` pixels, each knowing the source blocks it samples from;
+    only cells that read a changed block are warped and blended again, into
+    a panorama kept between frames. When most of the canvas is dirty the
+    whole panorama is recomposed with the merged rectangles instead.
+    """
+
+    def __init__(self, plan, blend_type='feather', blend_strength=50, compensator=None, change_block=16,
+                 change_threshold=6, max_cell=128, full_fraction=0.5, **kwargs):
+        super().__init__(plan, blend_type=blend_type, blend_strength=blend_strength, compensator=compensator,
+                         **kwargs)
+        self.change_block = change_block
+        self.change_threshold = change_threshold
+        self.full_fraction = full_fraction
+        self.cells = self.build_cells(max_cell)
+        self.cell_tiles = [{} for _ in self.cells]
+        self.references = None
+        self.out = None
+        self.dirty_fraction = 1.0
+
+    def source_blocks(self, idx, rect):
+        """
+        Bounding box ``(x0, y0, x1, y1)`` of the change blocks of camera
+        ``idx`` that the canvas rectangle ``rect`` samples, or ``None``.
+        """
+        rows, cols = self.camera_slice(idx, rect)
+        covered = self.plan.masks_warped[idx][rows, cols] > 0
+        if not covered.any():
+            return None
+        map_x, map_y = self.plan.float_maps(idx)
+        xs = map_x[rows, cols][covered]
+        ys = map_y[rows, cols][covered]
+        frame_w, frame_h = self.plan.frame_sizes[idx]
+        block = self.change_block
+        # Bilinear sampling also reads the next pixel
+        x0 = max(int(np.floor(xs.min())), 0) // block
+        y0 = max(int(np.floor(ys.min())), 0) // block
+        x1 = min(int(np.ceil(xs.max())) + 1, frame_w - 1) // block + 1
+        y1 = min(int(np.ceil(ys.max())) + 1, frame_h - 1) // block + 1
+        return (x0, y0, x1, y1)
+
+    def build_cells(self, max_cell):
+        """
+        Split the partition into cells of at most ``max_cell`` pixels a side:
+        ``(rect, idx, None)`` for copies and ``(rect, None, cams)`` for blends,
+        each with the source block boxes ``{idx: box}`` it depends on.
+        """
+        partition = self.plan.partition
+
+        def split(x, y, w, h):
+            for cy in range(y, y + h, max_cell):
+                for cx in range(x, x + w, max_cell):
+                    yield (cx, cy, min(max_cell, x + w - cx), min(max_cell, y + h - cy))
+
+        cells = []
+        for idx, x, y, w, h in partition.copy_rects:
+            for rect in split(x, y, w, h):
+                cells.append((rect, idx, None, {idx: self.source_blocks(idx, rect)}))
+        for x, y, w, h, cams in partition.blend_rects:
+            for rect in split(x, y, w, h):
+                sources = {}
+                for idx in cams:
+                    inter = intersect(rect, self.plan.canvas_roi(idx))
+                    if inter is not None:
+                        sources[idx] = self.source_blocks(idx, inter)
+                cells.append((rect, None, list(sources), sources))
+        return cells
+
+    def reduce(self, frame):
+        h, w = frame.shape[:2]
+        block = self.change_block
+        return cv.resize(frame, (-(-w // block), -(-h // block)), interpolation=cv.INTER_AREA)
+
+    def changed_blocks(self, frames):
+        """
+        Per camera, the integral image of its changed-block mask (``None``
+        when nothing changed), updating the references of changed blocks.
+        """
+        changed = {}
+        for idx, frame in enumerate(frames):
+            small = self.reduce(frame)
+            reference = self.references[idx]
+            diff = cv.absdiff(small, reference)
+            if diff.ndim == 3:
+                diff = diff.max(axis=2)
+            mask = diff > self.change_threshold
+            if mask.any():
+                reference[mask] = small[mask]
+                changed[idx] = cv.integral(mask.astype(np.uint8))
+        return changed
+
+    def compose(self, frames):
+        _, _, canvas_w, canvas_h = self.plan.dst_roi
+        if self.out is None:
+            self.out = np.zeros(self.plan.pixel_shape(canvas_h, canvas_w), np.uint8)
+            self.references = [self.reduce(frame) for frame in frames]
+            self.compose_rects(frames, self.out, self.plan.partition.copy_rects,
+                               self.plan.partition.blend_rects, self.tiles)
+            self.dirty_fraction = 1.0
+            return self.out.copy()
+
+        changed = self.changed_blocks(frames)
+        dirty = []
+        if changed:
+            for n, (rect, copy_idx, cams, sources) in enumerate(self.cells):
+                for idx, box in sources.items():
+                    if box is None or idx not in changed:
+                        continue
+                    x0, y0, x1, y1 = box
+                    integral = changed[idx]
+                    if integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]:
+                        dirty.append(n)
+                        break
+        area = float(canvas_w * canvas_h) or 1.0
+        self.dirty_fraction = sum(self.cells[n][0][2] * self.cells[n][0][3] for n in dirty) / area
+
+        if self.dirty_fraction > self.full_fraction:
+            self.out[:] = 0
+            self.compose_rects(frames, self.out, self.plan.partition.copy_rects,
+                               self.plan.partition.blend_rects, self.tiles)
+        else:
+            for n in dirty:
+                rect, copy_idx, cams, _ = self.cells[n]
+                if copy_idx is not None:
+                    self.compose_rects(frames, self.out, [(copy_idx,) + rect], [], None)
+                else:
+                    x, y, w, h = rect
+                    self.out[y:y + h, x:x + w] = 0
+                    self.compose_rects(frames, self.out, [], [rect + (cams,)], self.cell_tiles[n])
+        # Callers may keep the result while the next frame is composed
+        return self.out.copy()
+
+
+class YuvCompositor:
+    """
+    Composes ``YuvFrame``s plane by plane with two compositors of
+    ``compositor_cls``: luma at full resolution on the plan's luma plan and
+    chroma at half resolution on its chroma plan, so every frame warps and
+    blends half the bytes of BGR. Exposure gains are folded into luma only.
+    Chroma outside all cameras is set to neutral, so uncovered canvas
+    converts to black as in BGR.
+    """
+
+    NEUTRAL_CHROMA = 128
+
+    def __init__(self, plan, compositor_cls, compensator=None, **kwargs):
+        luma_plan, chroma_plan = plan.yuv_plans()
+        self.luma = compositor_cls(luma_plan, compensator=compensator, **kwargs)
+        self.chroma = compositor_cls(chroma_plan, compensator=None, **kwargs)
+        _, _, canvas_w, canvas_h = chroma_plan.dst_roi
+        self.uncovered = np.full((canvas_h, canvas_w), 255, np.uint8)
+        for idx in range(chroma_plan.num_images):
+            x, y, w, h = chroma_plan.canvas_roi(idx)
+            self.uncovered[y:y + h, x:x + w][chroma_plan.masks_warped[idx] > 0] = 0
+
+    def compose(self, frames):
+        uv = self.chroma.compose([frame.uv for frame in frames])
+        cv.add(uv, (self.NEUTRAL_CHROMA, self.NEUTRAL_CHROMA, 0, 0), dst=uv, mask=self.uncovered)
+        return YuvFrame(self.luma.compose([frame.y for frame in frames]), uv)
+
+    def close(self):
+        self.luma.close()
+        self.chroma.close()
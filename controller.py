@@ -1,8 +1,20 @@
 # controller.py
-from stitcher import VideoStitcher
+from stitcher import CalibrationWorker, VideoStitcher, grab_frames
+from capture_config import capture_mode_changes
+from frame_metadata import frame_metadata
+from metrics import StitchMetrics, MetricsServer
+from frame_ring import FramePublisher
 from PyQt5.QtCore import pyqtSlot, QObject, QTimer
 from PyQt5.QtWidgets import QMessageBox
 import logging
+import os
+import time
+
+STITCH_INTERVAL_MS = 30
+METRICS_PORT = int(os.environ.get('CAM_DEV_METRICS_PORT', 9108))  # 0 disables the endpoint
+FRAME_RING_PATH = os.environ.get('CAM_DEV_FRAME_RING')  # e.g. /dev/shm/cam-dev-panorama
+FRAME_RING_CAMERAS = os.environ.get('CAM_DEV_FRAME_RING_CAMERAS', '0') == '1'
+LENS_CALIBRATION_PATH = os.environ.get('CAM_DEV_LENS_CALIBRATION')  # OpenCV YAML/XML/JSON intrinsics
 
 class MainController(QObject):
     def __init__(self, main_window):
@@ -10,31 +22,111 @@ class MainController(QObject):
         self.main_window = main_window
         self.stitcher = None
         self.viewers = [self.main_window.stitched_video_viewer]  # Initialize with the main viewer
+        self.virtual_views = {}  # name -> (view parameters, viewers)
         self.timer = None  # Initialize the timer
+        self.calibration_worker = None  # Worker whose result will be used
+        self.calibration_workers = []  # All running workers, kept alive until they finish
+        self.pending_stitcher = None  # (camera feeds, settings) being calibrated
+        self.metrics = StitchMetrics(frame_interval=STITCH_INTERVAL_MS / 1000.0)
+        self.metrics_server = None
+        if METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, port=METRICS_PORT)
+                self.metrics_server.start()
+            except OSError:
+                logging.error(f"Could not start metrics endpoint on port {METRICS_PORT}.", exc_info=True)
+                self.metrics_server = None
+        self.publisher = None
+        if FRAME_RING_PATH:
+            self.publisher = FramePublisher(FRAME_RING_PATH, publish_cameras=FRAME_RING_CAMERAS)
         logging.info("Controller initialized")
 
     def connect_signals(self):
         logging.info("Connecting signals")
         self.main_window.stitch_button.clicked.connect(self.start_stitching)
+        self.main_window.stitching_settings_panel.render_settings_changed.connect(self.apply_render_settings)
 
     @pyqtSlot()
     def start_stitching(self):
+        """
+        Calibrate a new stitcher in the background; the running stitcher keeps
+        stitching until the new one is ready (see ``on_calibrated``). Only when
+        the negotiated capture modes change a camera's frame size, format or
+        RGB conversion is it stopped first, as its calibration does not hold
+        for the new frames.
+        """
         try:
             # Retrieve camera feeds and settings
-            camera_feeds = [canvas.capture for canvas in self.main_window.video_display_widget.cameras]
             settings = self.main_window.stitching_settings_panel.get_settings()
+            settings['target_fps'] = 1000.0 / STITCH_INTERVAL_MS
+            if LENS_CALIBRATION_PATH:
+                settings['lens_calibration'] = LENS_CALIBRATION_PATH
+            camera_feeds = [canvas.capture for canvas in self.main_window.video_display_widget.cameras]
+            if settings.get('capture_format', 'auto') != 'off':
+                plans = self.main_window.video_display_widget.plan_capture_modes(
+                    compose_megapix=settings['compose_megapix'],
+                    target_fps=1000.0 / STITCH_INTERVAL_MS,
+                    capture_format=settings['capture_format'],
+                    raw_yuv=settings.get('yuv', False)
+                )
+                changes = capture_mode_changes(camera_feeds, plans)
+                if 'format' in changes:
+                    logging.info("Capture modes change; stopping the running stitcher before recalibrating.")
+                    self.stop_stitching()
+                if any(changes):
+                    self.main_window.video_display_widget.apply_capture_modes(plans)
 
-            # Stop existing stitcher if running
-            if self.stitcher and self.stitcher.is_running:
-                self.stitcher.stop()
-                self.stitcher = None
+            # Frames are read here, on the thread that also runs the stitcher, as captures are not thread-safe
+            frames, fallback_cameras = grab_frames(camera_feeds, self.metrics)
+            if self.calibration_worker:
+                logging.info("Superseding the calibration in progress.")
+            worker = CalibrationWorker(frames, settings, fallback_cameras)
+            worker.progress.connect(self.report_calibration_progress)
+            worker.calibrated.connect(self.on_calibrated)
+            worker.finished.connect(self.release_calibration_workers)
+            self.calibration_worker = worker
+            self.calibration_workers.append(worker)
+            self.pending_stitcher = (camera_feeds, settings)
+            self.main_window.statusBar().showMessage("Calibrating...")
+            worker.start()
+            logging.info("Calibration started")
+        except Exception as e:
+            logging.error("Error in start_stitching.", exc_info=True)
+            QMessageBox.critical(self.main_window, "Error", f"Failed to start stitching: {str(e)}")
 
-            if self.timer and self.timer.isActive():
-                self.timer.stop()
-                self.timer = None
+    @pyqtSlot(str, float)
+    def report_calibration_progress(self, stage, seconds):
+        if self.sender() is self.calibration_worker:
+            self.main_window.statusBar().showMessage(f"Calibrating: {stage.replace('_', ' ')} ({seconds:.2f} s)")
+
+    @pyqtSlot(object)
+    def on_calibrated(self, result):
+        """
+        Replace the running stitcher with the newly calibrated one, or keep it
+        and report the error when calibration failed.
+        """
+        if self.sender() is not self.calibration_worker:
+            logging.info("Discarding the result of a superseded calibration.")
+            return
+        self.calibration_worker = None
+        camera_feeds, settings = self.pending_stitcher
+        self.pending_stitcher = None
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result.stage_times.items())
+        if result.error is not None:
+            stage = getattr(result.error, 'stage', None)
+            message = f"Calibration failed{f' during {stage}' if stage else ''}: {result.error}"
+            logging.error(f"{message} ({timings})")
+            self.main_window.statusBar().showMessage(message)
+            QMessageBox.critical(self.main_window, "Error", f"Failed to start stitching: {message}")
+            return
+        logging.info(f"Calibrated in {result.seconds:.2f} s ({timings}).")
+        self.main_window.statusBar().showMessage(f"Calibrated in {result.seconds:.2f} s", 5000)
+        try:
+            self.stop_stitching()
 
-            # Initialize and start the stitcher thread
-            self.stitcher = VideoStitcher(camera_feeds, settings)
+            # Start the stitcher thread with the new calibration
+            self.stitcher = VideoStitcher(camera_feeds, settings, metrics=self.metrics,
+                                          publisher=self.publisher, calibration=result)
 
             self.clear_viewers()
 
@@ -44,17 +136,47 @@ class MainController(QObject):
             # Connect the error_occurred signal to handle_stitcher_error
             self.stitcher.error_occurred.connect(self.handle_stitcher_error)
 
+            # Virtual PTZ views outlive the stitcher they were registered with
+            self.stitcher.view_ready.connect(self.update_virtual_view)
+            for name, (params, _) in self.virtual_views.items():
+                self.stitcher.add_view(name, **params)
+
             # Initialize and start the timer if not already started
             if not self.timer:
                 self.timer = QTimer()
                 self.timer.timeout.connect(self.stitcher.run)
-                self.timer.start(30)  # Adjust the interval as needed
+                self.timer.start(STITCH_INTERVAL_MS)  # Adjust the interval as needed
 
             logging.info("VideoStitcher started")
         except Exception as e:
             logging.error("Error in start_stitching.", exc_info=True)
             QMessageBox.critical(self.main_window, "Error", f"Failed to start stitching: {str(e)}")
 
+    def stop_stitching(self):
+        """
+        Stop the running stitcher and its timer, if any.
+        """
+        if self.stitcher and self.stitcher.is_running:
+            self.stitcher.stop()
+            self.stitcher = None
+
+        if self.timer and self.timer.isActive():
+            self.timer.stop()
+            self.timer = None
+
+    @pyqtSlot()
+    def release_calibration_workers(self):
+        self.calibration_workers = [worker for worker in self.calibration_workers if worker.isRunning()]
+
+    @pyqtSlot(dict)
+    def apply_render_settings(self, settings):
+        """
+        Apply render-only settings to the running stitcher between frames.
+        """
+        if self.stitcher and self.stitcher.stitcher:
+            self.stitcher.update_render_settings(settings)
+            logging.info(f"Render settings queued: {settings}")
+
     @pyqtSlot(object)
     def update_stitched_video(self, frame):
         """
@@ -62,6 +184,38 @@ class MainController(QObject):
         """
         for viewer in self.viewers:
             viewer.display_video(frame)
+        metadata = frame_metadata(frame)
+        if metadata is not None:
+            metadata.display_time = time.time()
+        self.metrics.record_display(metadata)
+
+    @pyqtSlot(str, object)
+    def update_virtual_view(self, name, frame):
+        """
+        Dispatch a virtual view frame to the viewers of that view.
+        """
+        if name in self.virtual_views:
+            for viewer in self.virtual_views[name][1]:
+                viewer.display_video(frame)
+
+    def add_virtual_view(self, name, viewer=None, pan=0.0, tilt=0.0, fov=60.0, size=(640, 360)):
+        """
+        Add or re-aim the virtual PTZ view ``name`` and optionally attach a viewer to it.
+        """
+        params = {'pan': pan, 'tilt': tilt, 'fov': fov, 'size': size}
+        viewers = self.virtual_views.get(name, (None, []))[1]
+        if viewer is not None and viewer not in viewers:
+            viewers.append(viewer)
+        self.virtual_views[name] = (params, viewers)
+        if self.stitcher:
+            self.stitcher.add_view(name, **params)
+        logging.info(f"Virtual view '{name}' set to {params}.")
+
+    def remove_virtual_view(self, name):
+        self.virtual_views.pop(name, None)
+        if self.stitcher:
+            self.stitcher.remove_view(name)
+        logging.info(f"Virtual view '{name}' removed.")
 
     @pyqtSlot(str)
     def handle_stitcher_error(self, error_message):
@@ -96,6 +250,11 @@ class MainController(QObject):
         Stop the stitcher and clean up resources.
         """
         try:
+            # A calibration cannot be interrupted; wait for it so its thread is not destroyed while running
+            self.calibration_worker = None
+            for worker in self.calibration_workers:
+                worker.wait()
+            self.calibration_workers = []
             if self.stitcher and self.stitcher.is_running:
                 self.stitcher.stop()
                 self.stitcher = None
@@ -104,6 +263,12 @@ class MainController(QObject):
                 self.timer.stop()
                 self.timer = None
                 logging.info("Timer stopped.")
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            if self.publisher:
+                self.publisher.close()
+                self.publisher = None
         except Exception as e:
             logging.error("Error stopping the stitcher.", exc_info=True)
 
@@ -0,0 +1,84 @@
+# frame_metadata.py
+import numpy as np
+
+
+class FrameMetadata:
+    """
+    Timing of one frame set through the pipeline, in ``time.time()``
+    seconds: per-camera capture times (``None`` for black fallback frames)
+    and sequence numbers, stitch start and end, and display time.
+
+    Capture times are taken when ``read()`` returns, so driver queueing
+    and exposure are not included; everything after it is.
+    """
+
+    def __init__(self, sequence, capture_times, camera_sequences=None):
+        self.sequence = sequence
+        self.capture_times = list(capture_times)
+        self.camera_sequences = list(camera_sequences) if camera_sequences is not None else None
+        self.stitch_start = None
+        self.stitch_end = None
+        self.display_time = None
+
+    def __repr__(self):
+        return (f"FrameMetadata(sequence={self.sequence}, capture_times={self.capture_times}, "
+                f"stitch_start={self.stitch_start}, stitch_end={self.stitch_end}, display_time={self.display_time})")
+
+    @property
+    def oldest_capture(self):
+        times = [t for t in self.capture_times if t is not None]
+        return min(times) if times else None
+
+    def camera_skew(self):
+        """
+        Per camera, how much older its frame is than the newest frame of the
+        set; ``None`` for fallback frames.
+        """
+        times = [t for t in self.capture_times if t is not None]
+        if not times:
+            return [None] * len(self.capture_times)
+        newest = max(times)
+        return [None if t is None else newest - t for t in self.capture_times]
+
+    def capture_to_stitch(self):
+        oldest = self.oldest_capture
+        if oldest is None or self.stitch_end is None:
+            return None
+        return self.stitch_end - oldest
+
+    def capture_to_display(self):
+        oldest = self.oldest_capture
+        if oldest is None or self.display_time is None:
+            return None
+        return self.display_time - oldest
+
+
+class StampedFrame(np.ndarray):
+    """
+    An ndarray carrying ``FrameMetadata``; it passes through code written
+    for bare frames unchanged. Views and copies keep the metadata, results
+    of OpenCV calls do not.
+    """
+
+    def __array_finalize__(self, obj):
+        self.metadata = getattr(obj, 'metadata', None)
+
+
+def attach_metadata(frame, metadata):
+    """
+    ``frame`` carrying ``metadata``: a ``StampedFrame`` view of an ndarray,
+    or the frame itself for objects that take attributes (``YuvFrame``).
+    """
+    if frame is None:
+        return None
+    if isinstance(frame, np.ndarray):
+        frame = frame.view(StampedFrame)
+    frame.metadata = metadata
+    return frame
+
+
+def frame_metadata(frame):
+    """
+    The ``FrameMetadata`` of ``frame``, or ``None`` for a bare frame.
+    """
+    return getattr(frame, 'metadata', None)
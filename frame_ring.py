@@ -0,0 +1,262 @@
+# frame_ring.py
+import logging
+import os
+import time
+
+import numpy as np
+
+from yuv_frame import as_bgr
+
+# File layout: a 64-byte file header and ``slot_count`` 64-byte slot headers,
+# padded to a page, followed by ``slot_count`` slots of ``slot_bytes`` pixel
+# data each. ``slot_bytes`` is a whole number of pages, so every slot's pixel
+# data starts on a page boundary.
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('slot_count', '<u4'),
+    ('slot_bytes', '<u8'),
+    ('write_seq', '<u8'),
+    ('closed', '<u4'),  # The writer is gone
+    ('replaced', '<u4'),  # A larger file took this one's place
+    ('data_offset', '<u8'),
+    ('reserved', 'V16'),
+])
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('channels', '<u4'),
+    ('dtype', 'S8'),
+    ('nbytes', '<u8'),
+    ('reserved', 'V20'),
+])
+MAGIC = b'CAMRING1'
+VERSION = 2
+PAGE = 4096
+
+
+def _data_offset(slot_count):
+    headers = HEADER_DTYPE.itemsize + slot_count * SLOT_DTYPE.itemsize
+    return -(-headers // PAGE) * PAGE
+
+
+def _slot(mm, index, slot_bytes, data_offset):
+    offset = HEADER_DTYPE.itemsize + index * SLOT_DTYPE.itemsize
+    slot_header = mm[offset:offset + SLOT_DTYPE.itemsize].view(SLOT_DTYPE)
+    data = mm[data_offset + index * slot_bytes:data_offset + (index + 1) * slot_bytes]
+    return slot_header, data
+
+
+class FrameRingWriter:
+    """
+    Single-producer ring of frames in a memory-mapped file.
+
+    Slots are written with a sequence lock: a slot's ``seq`` is cleared
+    before its pixels change and set to the new sequence number afterwards,
+    so readers can detect a frame that was overwritten while they used it.
+    When a frame no longer fits, the file is atomically replaced by a larger
+    one and the old file is marked ``replaced`` so readers reopen it;
+    ``close`` marks the file ``closed``.
+    """
+
+    def __init__(self, path, slot_count=8, slot_bytes=0):
+        self.path = path
+        self.slot_count = slot_count
+        self.slot_bytes = 0
+        self.seq = 0
+        self.mm = None
+        self.header = None
+        self.slots = None
+        if slot_bytes:
+            self._create(slot_bytes)
+
+    def _create(self, slot_bytes):
+        slot_bytes = -(-slot_bytes // PAGE) * PAGE
+        data_offset = _data_offset(self.slot_count)
+        size = data_offset + self.slot_count * slot_bytes
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        mm = np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=(size,))
+        header = mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['slot_count'] = self.slot_count
+        header['slot_bytes'] = slot_bytes
+        header['write_seq'] = self.seq
+        header['data_offset'] = data_offset
+        mm.flush()
+        os.replace(tmp_path, self.path)
+
+        if self.header is not None:
+            self.header['replaced'] = 1
+            self.mm.flush()
+        self.mm = mm
+        self.header = header
+        self.slot_bytes = slot_bytes
+        logging.info(f"Frame ring {self.path}: {self.slot_count} slots of {slot_bytes} bytes.")
+
+    def _slot(self, index):
+        return _slot(self.mm, index, self.slot_bytes, int(self.header['data_offset'][0]))
+
+    def write(self, frame, timestamp=None):
+        """
+        Publish ``frame`` and return its sequence number.
+        """
+        frame = np.ascontiguousarray(frame)
+        if self.mm is None or frame.nbytes > self.slot_bytes:
+            self._create(frame.nbytes)
+        self.seq += 1
+        slot_header, data = self._slot(self.seq % self.slot_count)
+        slot_header['seq'] = 0
+        data[:frame.nbytes] = frame.reshape(-1).view(np.uint8)
+        slot_header['timestamp'] = time.time() if timestamp is None else timestamp
+        slot_header['height'] = frame.shape[0]
+        slot_header['width'] = frame.shape[1] if frame.ndim > 1 else 1
+        slot_header['channels'] = frame.shape[2] if frame.ndim > 2 else 1
+        slot_header['dtype'] = frame.dtype.str.encode('ascii')
+        slot_header['nbytes'] = frame.nbytes
+        slot_header['seq'] = self.seq
+        self.header['write_seq'] = self.seq
+        return self.seq
+
+    def close(self):
+        if self.header is not None:
+            self.header['closed'] = 1
+            self.mm.flush()
+        self.mm = None
+        self.header = None
+
+
+class FrameRingReader:
+    """
+    Zero-copy reader for a ``FrameRingWriter`` file, usable from any process.
+
+    ``latest`` returns a view into the shared file; call ``is_current`` after
+    using it (or pass ``copy=True``) to make sure the writer has not reused
+    the slot in the meantime.
+
+    The reader follows the writer to a replacing file. Once the writer has
+    closed the ring it keeps the last frames and only reopens when a new
+    writer has created a new file at ``path``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+        self.header = None
+        self.file_id = None
+        self.open()
+
+    def open(self):
+        stat = os.stat(self.path)
+        self.mm = np.memmap(self.path, dtype=np.uint8, mode='r')
+        self.header = self.mm[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if self.header['magic'][0] != MAGIC:
+            raise ValueError(f"{self.path} is not a frame ring")
+        if self.header['version'][0] != VERSION:
+            raise ValueError(f"{self.path} is frame ring version {self.header['version'][0]}, expected {VERSION}")
+        self.file_id = (stat.st_dev, stat.st_ino)
+        self.slot_count = int(self.header['slot_count'][0])
+        self.slot_bytes = int(self.header['slot_bytes'][0])
+        self.data_offset = int(self.header['data_offset'][0])
+
+    def _slot(self, index):
+        return _slot(self.mm, index, self.slot_bytes, self.data_offset)
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'][0])
+
+    @property
+    def write_seq(self):
+        if self.header['replaced'][0]:
+            self.open()
+        elif self.header['closed'][0]:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_dev, stat.st_ino) != self.file_id:
+                self.open()
+        return int(self.header['write_seq'][0])
+
+    def read(self, seq, copy=False):
+        """
+        Return ``(meta, frame)`` for sequence number ``seq`` or ``None`` if the
+        slot has been overwritten or is being written.
+        """
+        slot_header, data = self._slot(seq % self.slot_count)
+        if int(slot_header['seq'][0]) != seq:
+            return None
+        meta = {
+            'seq': seq,
+            'timestamp': float(slot_header['timestamp'][0]),
+            'shape': tuple(int(v) for v in (slot_header['height'][0], slot_header['width'][0],
+                                            slot_header['channels'][0])),
+            'dtype': np.dtype(slot_header['dtype'][0].decode('ascii')),
+        }
+        nbytes = int(slot_header['nbytes'][0])
+        frame = data[:nbytes].view(meta['dtype']).reshape(meta['shape'])
+        if copy:
+            frame = frame.copy()
+        if int(slot_header['seq'][0]) != seq:
+            return None
+        return meta, frame
+
+    def latest(self, copy=False):
+        seq = self.write_seq
+        if seq == 0:
+            return None
+        return self.read(seq, copy=copy)
+
+    def is_current(self, meta):
+        slot_header, _ = self._slot(meta['seq'] % self.slot_count)
+        return int(slot_header['seq'][0]) == meta['seq']
+
+    def wait_next(self, last_seq, timeout=1.0, poll=0.001, copy=False):
+        """
+        Block until a frame newer than ``last_seq`` is published.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.write_seq > last_seq:
+                result = self.latest(copy=copy)
+                if result is not None:
+                    return result
+            time.sleep(poll)
+        return None
+
+
+class FramePublisher:
+    """
+    Publishes stitched panoramas to ``path`` and, optionally, each raw camera
+    frame to ``path.cam<index>``.
+    """
+
+    def __init__(self, path, slot_count=8, publish_cameras=False):
+        self.path = path
+        self.slot_count = slot_count
+        self.publish_cameras = publish_cameras
+        self.panorama = FrameRingWriter(path, slot_count)
+        self.cameras = {}
+
+    def publish(self, panorama, frames=None, timestamp=None):
+        """
+        Publish a panorama (and the camera frames); ``YuvFrame``s are
+        published as BGR.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        panorama = as_bgr(panorama)
+        if self.publish_cameras and frames is not None:
+            for idx, frame in enumerate(frames):
+                if idx not in self.cameras:
+                    self.cameras[idx] = FrameRingWriter(f"{self.path}.cam{idx}", self.slot_count)
+                self.cameras[idx].write(as_bgr(frame), timestamp)
+        return self.panorama.write(panorama, timestamp)
+
+    def close(self):
+        self.panorama.close()
+        for writer in self.cameras.values():
+            writer.close()
+        self.cameras = {}
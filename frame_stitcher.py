@@ -1,6 +1,28 @@
 import cv2 as cv
 import numpy as np
+import logging
+import os
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from compose_plan import ComposePlan, RegionPartition, rotation_warper
+from compositors import FixedPointCompositor, IncrementalCompositor, MultiBandCompositor, StripCompositor, YuvCompositor
+from lens_calibration import LensCorrection, load_lens_calibration
+from metrics import buffer_nbytes, buffer_report
+from viewport import ViewRenderer, VirtualView, ptz_view_maps, viewport_canvas_maps
+from yuv_frame import YuvFrame, as_bgr
+
+
+class StitchingError(RuntimeError):
+    """
+    Calibration failed; ``stage`` is the calibration stage that failed.
+    """
+
+    def __init__(self, message, stage=None):
+        super().__init__(message)
+        self.stage = stage
+
 
 class FrameStitcher:
     EXPOS_COMP_CHOICES = OrderedDict()
@@ -21,20 +43,20 @@ class FrameStitcher:
         cv.xfeatures2d_SURF.create()  # check if the function can be called
         FEATURES_FIND_CHOICES['surf'] = cv.xfeatures2d_SURF.create
     except (AttributeError, cv.error):
-        print("SURF not available")
+        logging.info("SURF not available")
     FEATURES_FIND_CHOICES['orb'] = cv.ORB.create
     try:
         FEATURES_FIND_CHOICES['sift'] = cv.SIFT_create
     except AttributeError:
-        print("SIFT not available")
+        logging.info("SIFT not available")
     try:
         FEATURES_FIND_CHOICES['brisk'] = cv.BRISK_create
     except AttributeError:
-        print("BRISK not available")
+        logging.info("BRISK not available")
     try:
         FEATURES_FIND_CHOICES['akaze'] = cv.AKAZE_create
     except AttributeError:
-        print("AKAZE not available")
+        logging.info("AKAZE not available")
 
     SEAM_FIND_CHOICES = OrderedDict()
     SEAM_FIND_CHOICES['gc_color'] = cv.detail_GraphCutSeamFinder('COST_COLOR')
@@ -65,6 +87,7 @@ class FrameStitcher:
         'paniniPortraitA1.5B1',
         'mercator',
         'transverseMercator',
+        'equirectangular',  # Full 360 x 180 degree sphere
     )
 
     WAVE_CORRECT_CHOICES = OrderedDict()
@@ -72,13 +95,53 @@ class FrameStitcher:
     WAVE_CORRECT_CHOICES['no'] = None
     WAVE_CORRECT_CHOICES['vert'] = cv.detail.WAVE_CORRECT_VERT
 
+    TOPOLOGY_CHOICES = ('all', 'linear', 'ring', 'grid')
+
+    # Work resolutions (megapixels) tried before the configured work_megapix
+    COARSE_TO_FINE_LEVELS = (0.05, 0.15, 0.4)
+
+    # Settings that only affect composition and can change without recalibrating
+    RENDER_SETTINGS = ('compose_megapix', 'blend_type', 'blend_strength', 'max_bands', 'exposure_compensation',
+                       'expos_comp', 'warp_type', 'compositor', 'output_crop')
+    # Settings that need a new FrameStitcher
+    CALIBRATION_SETTINGS = ('work_megapix', 'seam_megapix', 'features', 'matcher', 'estimator', 'match_conf',
+                            'conf_thresh', 'ba', 'ba_refine_mask', 'wave_correct', 'rig_topology', 'grid_columns',
+                            'coarse_to_fine', 'calibration_levels', 'min_match_confidence', 'max_residual',
+                            'calibration_group_size', 'lean', 'lens_calibration', 'yuv')
+    SETTING_ATTRIBUTES = {'compositor': 'compositor_type'}
+    # Render settings that re-feed the seam-scale calibration images
+    SEAM_SETTINGS = ('expos_comp',)
+
+    # Calibration stages, in order, as reported to the ``progress`` callback
+    CALIBRATION_STAGES = ('features', 'matching', 'estimation', 'bundle_adjustment', 'wave_correction',
+                          'warp_preparation')
+
+    VIEWPORT_CACHE_SIZE = 8
+    PLAN_CACHE_SIZE = 4  # Compose plans kept for switching projection or resolution
+
+    COMPOSITOR_CHOICES = OrderedDict()
+    COMPOSITOR_CHOICES['opencv'] = None  # cv.detail blenders in int16, min-max normalised
+    COMPOSITOR_CHOICES['fixed_point'] = FixedPointCompositor
+    COMPOSITOR_CHOICES['strips'] = StripCompositor
+    COMPOSITOR_CHOICES['incremental'] = IncrementalCompositor  # For mostly static scenes
+    # Compositors with per-pixel feather weights only; multi-band needs 'fixed_point' or 'opencv'
+    FEATHER_ONLY_COMPOSITORS = ('strips', 'incremental')
+
     def __init__(self, initial_frames, **kwargs):
         # print("kwargs", kwargs)
+        # Called as progress(stage, seconds) when a calibration stage finishes; stages can
+        # repeat (coarse-to-fine levels, camera groups) and may report from worker threads
+        self.progress = kwargs.get('progress', None)
+        self.stage_times = OrderedDict()  # stage -> total seconds
+        self.stage_lock = threading.Lock()
+
         # Initialize parameters with defaults or provided kwargs
         self.matcher_type = kwargs.get('matcher', 'homography')
         self.match_conf = kwargs.get('match_conf', None)
         self.features_type = kwargs.get('features', 'sift')
         self.rangewidth = kwargs.get('rangewidth', -1)
+        self.rig_topology = kwargs.get('rig_topology', 'all')
+        self.grid_columns = kwargs.get('grid_columns', 3)
         self.save_graph = kwargs.get('save_graph', False)
         self.expos_comp = kwargs.get('expos_comp', 'channel_blocks')
         self.expos_comp_nr_feeds = kwargs.get('expos_comp_nr_feeds', 1)
@@ -90,34 +153,158 @@ class FrameStitcher:
         self.warp_type = kwargs.get('warp_type', 'cylindrical')
         self.blend_type = kwargs.get('blend_type', 'feather')
         self.blend_strength = kwargs.get('blend_strength', 50)
+        self.max_bands = kwargs.get('max_bands', -1)  # -1: derived from blend_strength
+        self.exposure_compensation = kwargs.get('exposure_compensation', True)
         self.timelapse = kwargs.get('timelapse', False)
         self.work_megapix = kwargs.get('work_megapix', 0.6)
         self.seam_megapix = kwargs.get('seam_megapix', 0.1)
+        self.compositor_type = kwargs.get('compositor', 'opencv')
+        self.compose_threads = kwargs.get('compose_threads', 0)  # 0: one per core
+        self.output_crop = kwargs.get('output_crop', None)  # (left, top, right, bottom) as fractions of the panorama
+        self.check_blend_type(self.compositor_type, self.blend_type)
+        self.compose_plan = None
+        self.compose_plans = OrderedDict()  # ComposePlan.key -> plan, most recently used last
+        self.compositor = None
+        self.render_dirty = True
+        self.view_compositor = None
+        self.viewports = OrderedDict()
+        self.views = OrderedDict()  # name -> VirtualView
+        self.view_renderers = {}
         self.is_compose_scale_set = False
         self.is_work_scale_set = False
         self.is_seam_scale_set = False
         self.compose_scale = 1
 
-        # Extract features from initial frames
-        self.features, self.images, self.full_img_sizes, self.seam_work_aspect, self.work_scale, self.p = self.feature_extractor(initial_frames)
+        self.coarse_to_fine = kwargs.get('coarse_to_fine', False)
+        self.calibration_levels = kwargs.get('calibration_levels', self.COARSE_TO_FINE_LEVELS)
+        self.min_match_confidence = kwargs.get('min_match_confidence', 1.0)
+        self.max_residual = kwargs.get('max_residual', 2.0)  # RMS reprojection error, full-resolution pixels
+        self.calibration_report = []
 
-        # Leave only the largest component
-        self.indices = cv.detail.leaveBiggestComponent(self.features, self.p, self.conf_thresh)
-        self.num_images = len(self.full_img_sizes)
-        if self.num_images < 2:
-            print("Need more images")
-            exit()
+        self.calibration_group_size = kwargs.get('calibration_group_size', 0)  # 0: calibrate all cameras together
+        self.camera_groups = None
+        self.lean = kwargs.get('lean', False)  # Release calibration-time buffers once calibrated
+        self.plan_cache_size = kwargs.get('plan_cache_size', 1 if self.lean else self.PLAN_CACHE_SIZE)
 
-        # Estimate camera parameters
-        estimator = cv.detail_HomographyBasedEstimator()
-        b, self.cameras = estimator.apply(self.features, self.p, None)
+        # Compose YuvFrames (full-resolution luma, half-resolution chroma) and return YuvFrames
+        self.yuv = kwargs.get('yuv', False)
+        initial_frames = [as_bgr(frame) for frame in initial_frames]
+
+        # Calibration file path or LensModels, one per camera or one for all
+        self.lens_calibration = kwargs.get('lens_calibration', None)
+        self.lenses = self.load_lenses(self.lens_calibration, len(initial_frames))
+        self.lens_corrections = {}
+        if any(self.lenses):
+            initial_frames = [self.undistort(idx, frame) for idx, frame in enumerate(initial_frames)]
+
+        if self.calibration_group_size and len(initial_frames) > self.calibration_group_size:
+            if self.coarse_to_fine:
+                logging.warning("Coarse-to-fine calibration is not combined with group calibration; "
+                                "calibrating the groups at work_megapix only.")
+            self.calibrate_hierarchical(initial_frames)
+        elif self.coarse_to_fine:
+            self.calibrate_coarse_to_fine(initial_frames)
+        else:
+            # Extract features from initial frames
+            self.features, self.images, self.full_img_sizes, self.seam_work_aspect, self.work_scale, self.p = self.feature_extractor(initial_frames)
+
+            # Leave only the largest component
+            self.indices = cv.detail.leaveBiggestComponent(self.features, self.p, self.conf_thresh)
+            self.num_images = len(self.full_img_sizes)
+            if self.num_images < 2:
+                raise StitchingError("Need more images: fewer than two cameras overlap.", 'matching')
+
+            # Estimate camera parameters
+            self.cameras = self.estimate_cameras(self.features, self.p)
+            if self.cameras is None:
+                raise StitchingError("Homography estimation failed.", 'estimation')
+
+            # Bundle adjustment
+            self.cameras = self.bundle_adjust(self.features, self.p, self.cameras)
+            if self.cameras is None:
+                raise StitchingError("Camera parameters adjusting failed.", 'bundle_adjustment')
+
+        # Wave correction
+        start = time.perf_counter()
+        if self.wave_correct is not None:
+            rmats = []
+            for cam in self.cameras:
+                rmats.append(np.copy(cam.R))
+            rmats = cv.detail.waveCorrect(rmats, self.wave_correct)
+            for idx, cam in enumerate(self.cameras):
+                cam.R = rmats[idx]
+        self.stage_done('wave_correction', start)
+
+        # Warp images and prepare for blending
+        start = time.perf_counter()
+        self.prepare_warping_and_blending()
+        self.stage_done('warp_preparation', start)
+        if self.lean:
+            self.release_calibration_buffers()
+        logging.info("Calibration stage times: " + ", ".join(f"{k} {v:.3f}s" for k, v in self.stage_times.items()))
+
+    def stage_done(self, stage, start):
+        """
+        Record a finished calibration stage that began at ``start``
+        (``time.perf_counter``) and report it to ``progress``.
+        """
+        seconds = time.perf_counter() - start
+        with self.stage_lock:
+            self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+            if self.progress:
+                self.progress(stage, seconds)
+
+    @staticmethod
+    def load_lenses(lens_calibration, num_cameras):
+        """
+        One ``LensModel`` (or ``None``) per camera.
+        """
+        if not lens_calibration:
+            return [None] * num_cameras
+        lenses = load_lens_calibration(lens_calibration) if isinstance(lens_calibration, str) else list(lens_calibration)
+        if len(lenses) == 1:
+            return lenses * num_cameras
+        if len(lenses) != num_cameras:
+            raise ValueError(f"Lens calibration has {len(lenses)} cameras, the rig {num_cameras}")
+        return lenses
+
+    def lens_correction(self, idx, frame_size):
+        """
+        ``LensCorrection`` of camera ``idx`` at ``frame_size``, or ``None``
+        for a camera without distortion parameters.
+        """
+        if self.lenses[idx] is None:
+            return None
+        key = (idx, tuple(frame_size))
+        if key not in self.lens_corrections:
+            self.lens_corrections[key] = LensCorrection(self.lenses[idx], frame_size)
+        return self.lens_corrections[key]
+
+    def undistort(self, idx, frame):
+        lens = self.lens_correction(idx, (frame.shape[1], frame.shape[0]))
+        return frame if lens is None else lens.undistort(frame)
+
+    def estimate_cameras(self, features, p):
+        """
+        Initial cameras from the pairwise homographies; ``None`` on failure.
+        """
+        start = time.perf_counter()
+        try:
+            b, cameras = cv.detail_HomographyBasedEstimator().apply(features, p, None)
+        except cv.error:
+            return None
+        finally:
+            self.stage_done('estimation', start)
         if not b:
-            print("Homography estimation failed.")
-            exit()
-        for cam in self.cameras:
+            return None
+        for cam in cameras:
             cam.R = cam.R.astype(np.float32)
+        return cameras
 
-        # Bundle adjustment
+    def bundle_adjust(self, features, p, cameras):
+        """
+        Refine ``cameras`` with ray bundle adjustment; ``None`` on failure.
+        """
         adjuster = cv.detail_BundleAdjusterRay()
         adjuster.setConfThresh(self.conf_thresh)
         refine_mask = np.zeros((3, 3), np.uint8)
@@ -132,24 +319,213 @@ class FrameStitcher:
         if self.ba_refine_mask[4] == 'x':
             refine_mask[1, 2] = 1
         adjuster.setRefinementMask(refine_mask)
-        b, self.cameras = adjuster.apply(self.features, self.p, self.cameras)
+        start = time.perf_counter()
+        try:
+            b, cameras = adjuster.apply(features, p, cameras)
+        except cv.error:
+            return None
+        finally:
+            self.stage_done('bundle_adjustment', start)
         if not b:
-            print("Camera parameters adjusting failed.")
-            exit()
-        for cam in self.cameras:
+            return None
+        for cam in cameras:
             cam.R = cam.R.astype(np.float32)
+        return cameras
 
-        # Wave correction
-        if self.wave_correct is not None:
-            rmats = []
-            for cam in self.cameras:
-                rmats.append(np.copy(cam.R))
-            rmats = cv.detail.waveCorrect(rmats, self.wave_correct)
-            for idx, cam in enumerate(self.cameras):
-                cam.R = rmats[idx]
+    def calibrate_coarse_to_fine(self, initial_frames):
+        """
+        Calibrate at increasing work resolutions and stop at the first level
+        whose matches and bundle adjustment residual are good enough. Each
+        level starts bundle adjustment from the previous level's cameras.
+        """
+        levels = [mp for mp in self.calibration_levels if 0 < mp < self.work_megapix or self.work_megapix < 0]
+        levels = sorted(set(levels)) + [self.work_megapix]
+        previous = None
+        for level, megapix in enumerate(levels):
+            start = time.perf_counter()
+            features, images, full_img_sizes, seam_work_aspect, work_scale, p = self.feature_extractor(
+                initial_frames, work_megapix=megapix)
+            indices = cv.detail.leaveBiggestComponent(features, p, self.conf_thresh)
+            cameras = None
+            if previous is not None:
+                # Reuse the coarse estimate, rescaled to this level's image size
+                prev_cameras, prev_scale = previous
+                ratio = work_scale / prev_scale
+                cameras = []
+                for prev in prev_cameras:
+                    cam = cv.detail.CameraParams()
+                    cam.focal = prev.focal * ratio
+                    cam.aspect = prev.aspect
+                    cam.ppx = prev.ppx * ratio
+                    cam.ppy = prev.ppy * ratio
+                    cam.R = np.copy(prev.R)
+                    cam.t = np.copy(prev.t)
+                    cameras.append(cam)
+                cameras = self.bundle_adjust(features, p, cameras)
+            if cameras is None:
+                cameras = self.estimate_cameras(features, p)
+                if cameras is not None:
+                    cameras = self.bundle_adjust(features, p, cameras)
 
-        # Warp images and prepare for blending
-        self.prepare_warping_and_blending()
+            final = level == len(levels) - 1
+            quality = {'work_megapix': megapix, 'seconds': time.perf_counter() - start,
+                       'components': len(indices), 'ok': False}
+            if cameras is not None:
+                quality.update(self.calibration_quality(features, p, cameras, work_scale))
+                quality['ok'] = bool(len(indices) == len(full_img_sizes)
+                                 and quality['min_confidence'] >= self.min_match_confidence
+                                 and quality['residual'] <= self.max_residual)
+                previous = (cameras, work_scale)
+            self.calibration_report.append(quality)
+            logging.info(f"Calibration level {level} ({megapix} MP): {quality}")
+
+            if quality['ok'] or final:
+                if cameras is None:
+                    raise StitchingError("Camera parameters adjusting failed.", 'bundle_adjustment')
+                self.features, self.images, self.full_img_sizes = features, images, full_img_sizes
+                self.seam_work_aspect, self.work_scale, self.p = seam_work_aspect, work_scale, p
+                self.indices = indices
+                self.num_images = len(full_img_sizes)
+                self.cameras = cameras
+                return
+
+    def group_cameras(self, num_images):
+        """
+        Split cameras, ordered along the rig, into consecutive groups of at
+        most ``calibration_group_size`` that share one camera with the
+        previous group.
+        """
+        size = max(2, self.calibration_group_size)
+        groups = []
+        start = 0
+        while True:
+            stop = min(start + size, num_images)
+            groups.append(list(range(start, stop)))
+            if stop == num_images:
+                return groups
+            start = stop - 1
+
+    def group_mask(self, size):
+        """
+        Pairs to match within one calibration group, or ``None`` for all
+        pairs; only the rig as a whole closes a ring.
+        """
+        mask = self.topology_mask(size) if self.rig_topology in ('linear', 'ring') else None
+        if mask is not None and self.rig_topology == 'ring':
+            mask[0, size - 1] = mask[size - 1, 0] = 0
+        return mask
+
+    def calibrate_group(self, features, group):
+        """
+        Match and bundle-adjust one group on its own; returns its cameras in
+        the group's own frame, or ``None`` when the group cannot be calibrated.
+        """
+        sub_features = [features[idx] for idx in group]
+        p = self.match_features(sub_features, self.group_mask(len(group)))
+        indices = cv.detail.leaveBiggestComponent(sub_features, p, self.conf_thresh)
+        if len(indices) != len(group):
+            logging.error(f"Calibration group {group} is not connected.")
+            return None
+        cameras = self.estimate_cameras(sub_features, p)
+        if cameras is None:
+            return None
+        return self.bundle_adjust(sub_features, p, cameras)
+
+    def calibrate_hierarchical(self, initial_frames):
+        """
+        Calibrate large rigs group by group: features are extracted once,
+        every group is matched and bundle adjusted independently (in
+        parallel), and the groups are then chained into one frame through
+        the camera each shares with the previous group, at the focal scale
+        of that camera averaged over both groups. A final bundle adjustment
+        of the whole rig, seeded with the chained groups and limited to the
+        pairs within groups, reconciles the shared cameras. Matching only
+        covers pairs within fixed-size groups, so it grows linearly with the
+        number of cameras.
+        """
+        features, images, full_img_sizes, seam_work_aspect, work_scale, _ = self.feature_extractor(
+            initial_frames, match=False)
+        groups = self.group_cameras(len(features))
+        with ThreadPoolExecutor(max_workers=min(len(groups), os.cpu_count() or 1)) as executor:
+            group_cameras = list(executor.map(lambda group: self.calibrate_group(features, group), groups))
+        failed = [group for group, cameras in zip(groups, group_cameras) if cameras is None]
+        if failed:
+            raise StitchingError(f"Camera parameters adjusting failed for groups {failed}.", 'bundle_adjustment')
+
+        # Global alignment: rotate each group so its shared camera matches the previous group, and
+        # reconcile the focal scale both groups estimated for it (their geometric mean), rescaling
+        # the cameras chained so far and the new group so adjacent groups meet at the same scale
+        cameras = list(group_cameras[0])
+        for group, group_cams in zip(groups[1:], group_cameras[1:]):
+            shared = cameras[group[0]]
+            focal = np.sqrt(shared.focal * group_cams[0].focal)
+            previous_scale = focal / shared.focal
+            for cam in cameras:
+                cam.focal *= previous_scale
+            group_scale = focal / group_cams[0].focal
+            align = np.asarray(shared.R, np.float64) @ np.asarray(group_cams[0].R, np.float64).T
+            for cam in group_cams[1:]:
+                cam.focal *= group_scale
+                cam.R = (align @ np.asarray(cam.R, np.float64)).astype(np.float32)
+                cameras.append(cam)
+
+        # Global refinement, seeded with the chained cameras: one bundle adjustment over the
+        # whole rig with the pairs matched within the groups (and the ring closure), so every
+        # shared camera ends up with a single K and R that fits both of its groups
+        mask = np.zeros((len(cameras), len(cameras)), np.uint8)
+        for group in groups:
+            local = self.group_mask(len(group))
+            mask[np.ix_(group, group)] = 1 - np.eye(len(group), dtype=np.uint8) if local is None else local
+        if self.rig_topology == 'ring':
+            mask[0, -1] = mask[-1, 0] = 1
+        p = self.match_features(features, mask)
+        refined = self.bundle_adjust(features, p, cameras)
+        if refined is None:
+            logging.warning("Global refinement of the camera groups failed; using the chained groups.")
+        else:
+            cameras = list(refined)
+        logging.info(f"Calibrated {len(cameras)} cameras in groups {groups}.")
+
+        self.features, self.images, self.full_img_sizes = features, images, full_img_sizes
+        self.seam_work_aspect, self.work_scale, self.p = seam_work_aspect, work_scale, None
+        self.indices = list(range(len(cameras)))
+        self.num_images = len(cameras)
+        self.cameras = cameras
+        self.camera_groups = groups
+
+    def calibration_quality(self, features, p, cameras, work_scale):
+        """
+        Weakest adjacent match confidence and the RMS reprojection error of
+        all inlier matches under ``cameras``, in full-resolution pixels.
+        """
+        num_images = len(features)
+        K = [cam.K().astype(np.float64) for cam in cameras]
+        R = [np.asarray(cam.R, np.float64) for cam in cameras]
+        keypoints = [np.array([kp.pt for kp in feat.getKeypoints()], np.float64).reshape(-1, 2) for feat in features]
+        min_confidence = None
+        squared = 0.0
+        count = 0
+        for i in range(num_images):
+            for j in range(i + 1, num_images):
+                match = p[i * num_images + j]
+                if match.confidence < self.conf_thresh:
+                    continue
+                min_confidence = match.confidence if min_confidence is None else min(min_confidence, match.confidence)
+                inliers = np.asarray(match.inliers_mask, bool).ravel()
+                pairs = np.array([(m.queryIdx, m.trainIdx) for m in match.getMatches()], np.int64).reshape(-1, 2)
+                if inliers.size == len(pairs):
+                    pairs = pairs[inliers]
+                if not len(pairs):
+                    continue
+                src = np.hstack([keypoints[i][pairs[:, 0]], np.ones((len(pairs), 1))])
+                # Ray through each source keypoint, reprojected into camera j
+                rays = R[i] @ np.linalg.inv(K[i]) @ src.T
+                proj = K[j] @ R[j].T @ rays
+                proj = (proj[:2] / proj[2]).T
+                squared += float(((proj - keypoints[j][pairs[:, 1]]) ** 2).sum())
+                count += len(pairs)
+        residual = float(np.sqrt(squared / count) / work_scale) if count else float('inf')
+        return {'min_confidence': min_confidence or 0.0, 'residual': residual, 'inliers': count}
 
     def get_matcher(self):
         try_cuda = True
@@ -183,42 +559,88 @@ class FrameStitcher:
             compensator = cv.detail.ExposureCompensator_createDefault(expos_comp_type)
         return compensator
 
-    def feature_extractor(self, cv_images):
-        finder = self.FEATURES_FIND_CHOICES[self.features_type]()
+    def feature_extractor(self, cv_images, work_megapix=None, match=True):
+        if work_megapix is None:
+            work_megapix = self.work_megapix
         seam_work_aspect = 1
         full_img_sizes = []
-        features = []
-        images = []
-        for image in cv_images:
-            full_img = image
+        for full_img in cv_images:
             if full_img is None:
-                print("Cannot read images")
-                exit()
+                raise StitchingError("Cannot read images", 'features')
             full_img_sizes.append((full_img.shape[1], full_img.shape[0]))
-            if self.work_megapix < 0:
+
+        # Scales are taken from the first image, as before
+        first_w, first_h = full_img_sizes[0]
+        if work_megapix < 0:
+            work_scale = 1
+        else:
+            work_scale = min(1.0, np.sqrt(work_megapix * 1e6 / (first_w * first_h)))
+        self.is_work_scale_set = True
+        if self.seam_megapix > 0:
+            seam_scale = min(1.0, np.sqrt(self.seam_megapix * 1e6 / (first_w * first_h)))
+        else:
+            seam_scale = 1.0
+        seam_work_aspect = seam_scale / work_scale
+        self.is_seam_scale_set = True
+
+        def extract(full_img):
+            # One detector per task: Feature2D instances are not shared across threads
+            finder = self.FEATURES_FIND_CHOICES[self.features_type]()
+            if work_megapix < 0:
                 img = full_img
-                work_scale = 1
-                self.is_work_scale_set = True
             else:
-                if self.is_work_scale_set is False:
-                    work_scale = min(1.0, np.sqrt(self.work_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-                    self.is_work_scale_set = True
                 img = cv.resize(src=full_img, dsize=None, fx=work_scale, fy=work_scale, interpolation=cv.INTER_LINEAR_EXACT)
-            if self.is_seam_scale_set is False:
-                if self.seam_megapix > 0:
-                    seam_scale = min(1.0, np.sqrt(self.seam_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-                else:
-                    seam_scale = 1.0
-                seam_work_aspect = seam_scale / work_scale
-                self.is_seam_scale_set = True
             img_feat = cv.detail.computeImageFeatures2(finder, img)
-            features.append(img_feat)
             img = cv.resize(src=full_img, dsize=None, fx=seam_scale, fy=seam_scale, interpolation=cv.INTER_LINEAR_EXACT)
-            images.append(img)
+            return img_feat, img
+
+        # OpenCV releases the GIL while detecting, so cameras are processed concurrently
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(len(cv_images), os.cpu_count() or 1)) as executor:
+            results = list(executor.map(extract, cv_images))
+        self.stage_done('features', start)
+        features = [feat for feat, _ in results]
+        images = [img for _, img in results]
+        if not match:
+            return features, images, full_img_sizes, seam_work_aspect, work_scale, None
+
+        p = self.match_features(features, self.topology_mask(len(features)))
+        return features, images, full_img_sizes, seam_work_aspect, work_scale, p
+
+    def match_features(self, features, mask=None):
+        start = time.perf_counter()
         matcher = self.get_matcher()
-        p = matcher.apply2(features)
+        if mask is None:
+            p = matcher.apply2(features)
+        else:
+            p = matcher.apply2(features, mask)
         matcher.collectGarbage()
-        return features, images, full_img_sizes, seam_work_aspect, work_scale, p
+        self.stage_done('matching', start)
+        return p
+
+    def topology_mask(self, num_images):
+        """
+        Pairs to match for the declared rig topology, or ``None`` to match all
+        pairs. Cameras are assumed to be ordered along the rig (row-major for
+        grids), so only physical neighbours can overlap.
+        """
+        if self.rig_topology not in self.TOPOLOGY_CHOICES:
+            raise ValueError(f"Unknown rig topology '{self.rig_topology}'")
+        if self.rig_topology == 'all':
+            return None
+        mask = np.zeros((num_images, num_images), np.uint8)
+        if self.rig_topology == 'grid':
+            cols = max(1, self.grid_columns)
+            for i in range(num_images):
+                for j in range(num_images):
+                    if i != j and abs(i // cols - j // cols) <= 1 and abs(i % cols - j % cols) <= 1:
+                        mask[i, j] = 1
+            return mask
+        for i in range(num_images - 1):
+            mask[i, i + 1] = mask[i + 1, i] = 1
+        if self.rig_topology == 'ring' and num_images > 2:
+            mask[0, num_images - 1] = mask[num_images - 1, 0] = 1
+        return mask
 
     def prepare_warping_and_blending(self):
         # Prepare masks
@@ -238,7 +660,7 @@ class FrameStitcher:
             self.warped_image_scale = focals[len(focals) // 2]
         else:
             self.warped_image_scale = (focals[len(focals) // 2] + focals[len(focals) // 2 - 1]) / 2
-        self.warper = cv.PyRotationWarper(self.warp_type, self.warped_image_scale * self.seam_work_aspect)
+        self.warper = rotation_warper(self.warp_type, self.warped_image_scale * self.seam_work_aspect)
         for idx in range(0, self.num_images):
             K = self.cameras[idx].K().astype(np.float32)
             swa = self.seam_work_aspect
@@ -253,74 +675,250 @@ class FrameStitcher:
             p, mask_wp = self.warper.warp(self.masks[idx], K, self.cameras[idx].R, cv.INTER_NEAREST, cv.BORDER_CONSTANT)
             self.masks_warped.append(mask_wp.get())
 
-        # Convert images to float32
-        self.images_warped_f = []
-        for img in self.images_warped:
-            imgf = img.astype(np.float32)
-            self.images_warped_f.append(imgf)
-
         # Compensate exposure
         self.compensator = self.get_compensator()
         self.compensator.feed(corners=self.corners, images=self.images_warped, masks=self.masks_warped)
 
+    def release_calibration_buffers(self):
+        """
+        Drop everything only calibration needs: features, pairwise matches,
+        seam-scale images and masks. The exposure compensator keeps its
+        gains, so only a new compensator type (``SEAM_SETTINGS``), which
+        has to be fed again, needs a restart afterwards.
+        """
+        self.features = None
+        self.p = None
+        self.images = None
+        self.images_warped = None
+        self.masks = None
+        self.masks_warped = None
+        self.lean = True
+
+    def update_render_settings(self, **settings):
+        """
+        Change compose-stage settings (see ``RENDER_SETTINGS``) without
+        recalibrating. A new exposure compensator is fed the seam-scale
+        images again (impossible once they have been released); a new
+        projection or compose resolution selects another compose plan, built
+        on first use, and anything else just rebuilds the compositor.
+        Exposure gains are measured once, in the calibration projection, and
+        reused for every output projection.
+        """
+        unknown = set(settings) - set(self.RENDER_SETTINGS)
+        if unknown:
+            raise ValueError(f"Not render settings: {sorted(unknown)}")
+        self.check_blend_type(settings.get('compositor', self.compositor_type),
+                              settings.get('blend_type', self.blend_type))
+        changed = {k: v for k, v in settings.items() if getattr(self, self.SETTING_ATTRIBUTES.get(k, k)) != v}
+        if not changed:
+            return False
+        if self.lean and set(self.SEAM_SETTINGS) & set(changed):
+            raise ValueError(f"{sorted(set(self.SEAM_SETTINGS) & set(changed))} cannot change in lean mode; "
+                             f"restart stitching instead")
+        for key, value in changed.items():
+            setattr(self, self.SETTING_ATTRIBUTES.get(key, key), value)
+        if 'expos_comp' in changed:
+            self.compensator = self.get_compensator()
+            self.compensator.feed(corners=self.corners, images=self.images_warped, masks=self.masks_warped)
+        self.render_dirty = True
+        logging.info(f"Render settings changed: {changed}")
+        return True
+
+    def check_blend_type(self, compositor, blend_type):
+        if blend_type == 'multiband' and compositor in self.FEATHER_ONLY_COMPOSITORS:
+            raise ValueError(f"Compositor '{compositor}' does not support multi-band blending; "
+                             f"use the 'fixed_point' or 'opencv' compositor, or another blend type")
+
+    def compositor_key(self):
+        """
+        Settings the compositor is built from, besides the compose plan.
+        """
+        return (self.compositor_type, self.blend_type, self.blend_strength, self.max_bands,
+                self.exposure_compensation, id(self.compensator), self.compose_threads)
+
+    def get_compose_plan(self, frames):
+        """
+        Return the compose plan for the current projection, compose
+        resolution and frame sizes, and make ``self.compositor`` the
+        compositor for it. Plans are cached (``plan_cache_size``, least
+        recently used dropped first) together with their compositor, so
+        switching back to a projection costs nothing.
+        """
+        key = ComposePlan.key(self, frames)
+        plan = self.compose_plans.get(key)
+        if plan is None:
+            plan = ComposePlan(self, [(f.shape[1], f.shape[0]) for f in frames], cache_float_maps=not self.lean)
+            self.compose_plans[key] = plan
+            while len(self.compose_plans) > max(1, self.plan_cache_size):
+                _, evicted = self.compose_plans.popitem(last=False)
+                if evicted.compositor is not None:
+                    evicted.compositor.close()
+        self.compose_plans.move_to_end(key)
+        compositor_key = self.compositor_key()
+        if plan is not self.compose_plan or plan.compositor_key != compositor_key or self.render_dirty:
+            self.render_dirty = False
+            self.view_compositor = None
+            self.viewports.clear()
+            self.view_renderers = {}
+        if plan.compositor_key != compositor_key:
+            compositor_cls = self.COMPOSITOR_CHOICES[self.compositor_type]
+            if compositor_cls is None and self.yuv:
+                logging.warning("The OpenCV blenders need BGR frames; composing YUV with the fixed-point compositor.")
+                compositor_cls = FixedPointCompositor
+            if compositor_cls is FixedPointCompositor and self.blend_type == 'multiband':
+                compositor_cls = MultiBandCompositor
+            if plan.compositor is not None:
+                plan.compositor.close()
+            plan.compositor = None
+            if compositor_cls is not None:
+                options = dict(blend_type=self.blend_type, blend_strength=self.blend_strength,
+                               compensator=self.compensator if self.exposure_compensation else None,
+                               compose_threads=self.compose_threads, max_bands=self.max_bands)
+                if self.yuv:
+                    plan.compositor = YuvCompositor(plan, compositor_cls, **options)
+                else:
+                    plan.compositor = compositor_cls(plan, **options)
+            plan.compositor_key = compositor_key
+        self.compose_plan = plan
+        self.compositor = plan.compositor
+        return plan
+
+    def view_weights(self):
+        """
+        Per-camera Q8 blend weights used for partial views. Multi-band and
+        the OpenCV blenders have no per-pixel weights, so views fall back to
+        the fixed-point feather weights for the same settings.
+        """
+        compositor = self.compositor
+        if not isinstance(compositor, FixedPointCompositor) or isinstance(compositor, MultiBandCompositor):
+            if self.view_compositor is None:
+                blend_type = 'feather' if self.blend_type == 'multiband' else self.blend_type
+                self.view_compositor = FixedPointCompositor(
+                    self.compose_plan, blend_type=blend_type, blend_strength=self.blend_strength,
+                    compensator=self.compensator if self.exposure_compensation else None)
+            compositor = self.view_compositor
+        return compositor.weights
+
+    def render_viewport(self, frames, rect, out_size=None):
+        """
+        Render only the panorama rectangle ``rect`` = (x, y, w, h), given in
+        pixels of the full panorama, at ``out_size`` (the rectangle's own
+        size by default). Only the cameras whose ROI overlaps the rectangle
+        are warped, directly at the output resolution. Views are rendered
+        in BGR, so ``YuvFrame``s are converted first.
+        """
+        frames = [as_bgr(frame) for frame in frames]
+        plan = self.get_compose_plan(frames)
+        rect = tuple(int(v) for v in rect)
+        out_size = tuple(int(v) for v in out_size) if out_size else rect[2:]
+        key = (rect, out_size)
+        renderer = self.viewports.get(key)
+        if renderer is None:
+            canvas_x, canvas_y = viewport_canvas_maps(rect, out_size)
+            renderer = ViewRenderer(plan, self.view_weights(), canvas_x, canvas_y)
+            self.viewports[key] = renderer
+            while len(self.viewports) > self.VIEWPORT_CACHE_SIZE:
+                self.viewports.popitem(last=False)
+        else:
+            self.viewports.move_to_end(key)
+        return renderer.render(frames)
+
+    def add_view(self, name, pan=0.0, tilt=0.0, fov=60.0, size=(640, 360)):
+        """
+        Register (or re-aim) the virtual PTZ camera ``name``. Angles are in
+        degrees relative to the panorama centre; ``fov`` is horizontal.
+        """
+        self.views[name] = VirtualView(float(pan), float(tilt), float(fov), (int(size[0]), int(size[1])))
+        self.view_renderers.pop(name, None)
+
+    def remove_view(self, name):
+        self.views.pop(name, None)
+        self.view_renderers.pop(name, None)
+
+    def render_views(self, frames):
+        """
+        Render every registered virtual view from the same camera frames.
+        Each view's lookup tables are built on first use and cached until the
+        view, the compose plan or the render settings change.
+        """
+        frames = [as_bgr(frame) for frame in frames]
+        plan = self.get_compose_plan(frames)
+        rendered = OrderedDict()
+        for name, view in list(self.views.items()):
+            renderer = self.view_renderers.get(name)
+            if renderer is None or renderer.view != view:
+                canvas_x, canvas_y, camera_maps = ptz_view_maps(plan, view)
+                renderer = ViewRenderer(plan, self.view_weights(), canvas_x, canvas_y, camera_maps)
+                renderer.view = view
+                self.view_renderers[name] = renderer
+            rendered[name] = renderer.render(frames)
+        return rendered
+
+    def memory_report(self):
+        """
+        Bytes held per attribute, including the compose plan, compositors
+        and view renderers, plus the exposure gains and a ``total``.
+        """
+        report = buffer_report(self, owned=(ComposePlan, RegionPartition, FixedPointCompositor, StripCompositor,
+                                            IncrementalCompositor, YuvCompositor, ViewRenderer))
+        try:
+            gains = buffer_nbytes(self.compensator.getMatGains())
+        except (AttributeError, cv.error):
+            gains = 0
+        if gains:
+            report['compensator.gains'] = gains
+        report['total'] = sum(report.values())
+        return report
+
+    def prepare_frames(self, frames):
+        """
+        Captured frames in the form this stitcher composes: ``YuvFrame``s
+        in YUV mode, BGR arrays otherwise. Raw YUYV captures are converted
+        once here so that stitching, views and publishing share the result.
+        """
+        if self.yuv:
+            return [YuvFrame.from_capture(frame) for frame in frames]
+        return [as_bgr(frame) for frame in frames]
+
     def stitch_frames(self, frames):
-        is_compose_scale_set = False
-        compose_scale = 1
-        corners = []
-        sizes = []
-        blender = None
+        frames = self.prepare_frames(frames)
+        plan = self.get_compose_plan(frames)
+        if self.output_crop:
+            _, _, canvas_w, canvas_h = plan.dst_roi
+            left, top, right, bottom = self.output_crop
+            x, y = int(round(left * canvas_w)), int(round(top * canvas_h))
+            rect = (x, y, max(1, int(round(right * canvas_w)) - x), max(1, int(round(bottom * canvas_h)) - y))
+            view = self.render_viewport(frames, rect)
+            return YuvFrame.from_bgr(view) if self.yuv else view
+        if self.compositor is not None:
+            return self.compositor.compose(frames)
 
+        blender = None
         for idx, frame in enumerate(frames):
-            full_img = frame
-            if not is_compose_scale_set:
-                if self.compose_megapix > 0:
-                    compose_scale = min(1.0, np.sqrt(self.compose_megapix * 1e6 / (full_img.shape[0] * full_img.shape[1])))
-                is_compose_scale_set = True
-                compose_work_aspect = compose_scale / self.work_scale
-                self.warped_image_scale *= compose_work_aspect
-                warper = cv.PyRotationWarper(self.warp_type, self.warped_image_scale)
-                for i in range(len(frames)):
-                    self.cameras[i].focal *= compose_work_aspect
-                    self.cameras[i].ppx *= compose_work_aspect
-                    self.cameras[i].ppy *= compose_work_aspect
-                    sz = (int(round(self.full_img_sizes[i][0] * compose_scale)),
-                          int(round(self.full_img_sizes[i][1] * compose_scale)))
-                    K = self.cameras[i].K().astype(np.float32)
-                    roi = warper.warpRoi(sz, K, self.cameras[i].R)
-                    corners.append(roi[0:2])
-                    sizes.append(roi[2:4])
-
-            if abs(compose_scale - 1) > 1e-1:
-                img = cv.resize(src=full_img, dsize=None, fx=compose_scale, fy=compose_scale,
-                                interpolation=cv.INTER_LINEAR_EXACT)
-            else:
-                img = full_img
-            _img_size = (img.shape[1], img.shape[0])
-            K = self.cameras[idx].K().astype(np.float32)
-            corner, image_warped = warper.warp(img, K, self.cameras[idx].R, cv.INTER_LINEAR, cv.BORDER_REFLECT)
-            mask = 255 * np.ones((img.shape[0], img.shape[1]), np.uint8)
-            p, mask_warped = warper.warp(mask, K, self.cameras[idx].R, cv.INTER_NEAREST, cv.BORDER_CONSTANT)
-            self.compensator.apply(idx, corners[idx], image_warped, mask_warped)
+            image_warped = plan.warp(idx, frame)
+            mask_warped = plan.masks_warped[idx]
+            if self.exposure_compensation:
+                self.compensator.apply(idx, plan.corners[idx], image_warped, mask_warped)
             image_warped_s = image_warped.astype(np.int16)
-            dilated_mask = cv.dilate(mask_warped, None)
-            seam_mask = cv.resize(dilated_mask, (mask_warped.shape[1], mask_warped.shape[0]), 0, 0, cv.INTER_LINEAR_EXACT)
-            mask_warped = cv.bitwise_and(seam_mask, mask_warped)
 
             if blender is None and not self.timelapse:
                 blender = cv.detail.Blender_createDefault(cv.detail.Blender_NO)
-                dst_sz = cv.detail.resultRoi(corners=corners, sizes=sizes)
+                dst_sz = plan.dst_roi
                 blend_width = np.sqrt(dst_sz[2] * dst_sz[3]) * self.blend_strength / 100
                 if blend_width < 1:
                     blender = cv.detail.Blender_createDefault(cv.detail.Blender_NO)
                 elif self.blend_type == "multiband":
                     blender = cv.detail_MultiBandBlender()
-                    blender.setNumBands((np.log(blend_width) / np.log(2.) - 1.).astype(np.int32))
+                    num_bands = (np.log(blend_width) / np.log(2.) - 1.).astype(np.int32)
+                    if self.max_bands >= 0:
+                        num_bands = min(num_bands, self.max_bands)
+                    blender.setNumBands(num_bands)
                 elif self.blend_type == "feather":
                     blender = cv.detail_FeatherBlender()
                     blender.setSharpness(1. / blend_width)
                 blender.prepare(dst_sz)
 
-            blender.feed(cv.UMat(image_warped_s), mask_warped, corners[idx])
+            blender.feed(cv.UMat(image_warped_s), mask_warped, plan.corners[idx])
 
         if not self.timelapse:
             result = None
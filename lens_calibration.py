@@ -0,0 +1,128 @@
+# lens_calibration.py
+import logging
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+# Intrinsics of one camera as calibrated by OpenCV: 3x3 camera matrix,
+# distortion coefficients, the (width, height) they were measured at and
+# the lens model ('pinhole' or 'fisheye')
+LensModel = namedtuple('LensModel', ['camera_matrix', 'dist_coeffs', 'image_size', 'model'])
+
+LENS_MODELS = ('pinhole', 'fisheye')
+
+
+def _read_lens(node):
+    camera_matrix = node.getNode('camera_matrix').mat()
+    dist_coeffs = node.getNode('distortion_coefficients').mat()
+    if camera_matrix is None or dist_coeffs is None:
+        raise ValueError("Lens calibration needs camera_matrix and distortion_coefficients")
+    image_size = (int(node.getNode('image_width').real()), int(node.getNode('image_height').real()))
+    model = node.getNode('model').string() or 'pinhole'
+    if model not in LENS_MODELS:
+        raise ValueError(f"Unknown lens model '{model}'")
+    return LensModel(camera_matrix.astype(np.float64), dist_coeffs.astype(np.float64).ravel(), image_size, model)
+
+
+def load_lens_calibration(path):
+    """
+    Read lens models from an OpenCV YAML/XML/JSON file: either one camera
+    (``camera_matrix``, ``distortion_coefficients``, ``image_width``,
+    ``image_height`` and optionally ``model``, as written by OpenCV's
+    calibration sample) or a ``cameras`` sequence of such entries in rig
+    order. Returns a list of ``LensModel``.
+    """
+    storage = cv.FileStorage(path, cv.FILE_STORAGE_READ)
+    if not storage.isOpened():
+        raise ValueError(f"Cannot read lens calibration {path}")
+    try:
+        cameras = storage.getNode('cameras')
+        if cameras.isSeq():
+            lenses = [_read_lens(cameras.at(i)) for i in range(cameras.size())]
+        else:
+            lenses = [_read_lens(storage.root())]
+    finally:
+        storage.release()
+    logging.info(f"Loaded {len(lenses)} lens model(s) from {path}.")
+    return lenses
+
+
+class LensCorrection:
+    """
+    Distortion of one camera at one frame size.
+
+    Stitching works on the ideal pinhole image with ``ideal_matrix``, which
+    has the frame's size and is cropped to valid pixels. Calibration frames
+    are undistorted once; at compose time ``distort`` maps ideal pixel
+    coordinates to the captured frame, so it can be folded into the remap
+    tables and no separate undistortion pass is needed.
+    """
+
+    def __init__(self, lens, frame_size):
+        self.lens = lens
+        self.frame_size = tuple(frame_size)
+        self.fisheye = lens.model == 'fisheye'
+        scale_x = frame_size[0] / lens.image_size[0]
+        scale_y = frame_size[1] / lens.image_size[1]
+        self.camera_matrix = lens.camera_matrix * np.array([[scale_x], [scale_y], [1.0]])
+        self.dist_coeffs = lens.dist_coeffs
+        if self.fisheye:
+            self.dist_coeffs = self.dist_coeffs[:4].reshape(4, 1)
+            self.ideal_matrix = cv.fisheye.estimateNewCameraMatrixForUndistortRectify(
+                self.camera_matrix, self.dist_coeffs, self.frame_size, np.eye(3), balance=0.0)
+        else:
+            self.ideal_matrix, _ = cv.getOptimalNewCameraMatrix(
+                self.camera_matrix, self.dist_coeffs, self.frame_size, 0.0)
+        self._undistort_maps = None
+
+    def undistort(self, frame):
+        """
+        The ideal pinhole image of ``frame``.
+        """
+        if self._undistort_maps is None:
+            if self.fisheye:
+                self._undistort_maps = cv.fisheye.initUndistortRectifyMap(
+                    self.camera_matrix, self.dist_coeffs, np.eye(3), self.ideal_matrix, self.frame_size, cv.CV_16SC2)
+            else:
+                self._undistort_maps = cv.initUndistortRectifyMap(
+                    self.camera_matrix, self.dist_coeffs, None, self.ideal_matrix, self.frame_size, cv.CV_16SC2)
+        map1, map2 = self._undistort_maps
+        return cv.remap(frame, map1, map2, cv.INTER_LINEAR, borderMode=cv.BORDER_CONSTANT)
+
+    def distort(self, x, y):
+        """
+        Captured-frame coordinates of the ideal pixel coordinates ``x``,
+        ``y`` (float arrays of any shape). Points outside the ideal image
+        become -1, since the distortion polynomial is only valid inside it.
+        """
+        w, h = self.frame_size
+        shape = np.shape(x)
+        x = np.asarray(x, np.float64).ravel()
+        y = np.asarray(y, np.float64).ravel()
+        inside = (x >= -0.5) & (x <= w - 0.5) & (y >= -0.5) & (y <= h - 0.5)
+        fx, fy = self.ideal_matrix[0, 0], self.ideal_matrix[1, 1]
+        cx, cy = self.ideal_matrix[0, 2], self.ideal_matrix[1, 2]
+        normalized = np.stack([(x[inside] - cx) / fx, (y[inside] - cy) / fy], axis=-1).reshape(-1, 1, 2)
+        out_x = np.full(x.shape, -1.0, np.float32)
+        out_y = np.full(y.shape, -1.0, np.float32)
+        if len(normalized):
+            if self.fisheye:
+                distorted = cv.fisheye.distortPoints(normalized, self.camera_matrix, self.dist_coeffs)
+            else:
+                points = cv.convertPointsToHomogeneous(normalized)
+                distorted, _ = cv.projectPoints(points, np.zeros(3), np.zeros(3), self.camera_matrix, self.dist_coeffs)
+            out_x[inside] = distorted[:, 0, 0]
+            out_y[inside] = distorted[:, 0, 1]
+        return out_x.reshape(shape), out_y.reshape(shape)
+
+    def undistort_point(self, x, y):
+        """
+        Ideal pixel coordinates of the captured-frame point ``(x, y)``.
+        """
+        point = np.array([[[x, y]]], np.float64)
+        if self.fisheye:
+            ideal = cv.fisheye.undistortPoints(point, self.camera_matrix, self.dist_coeffs, P=self.ideal_matrix)
+        else:
+            ideal = cv.undistortPoints(point, self.camera_matrix, self.dist_coeffs, P=self.ideal_matrix)
+        return float(ideal[0, 0, 0]), float(ideal[0, 0, 1])
@@ -0,0 +1,412 @@
+# metrics.py
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+
+class StitchMetrics:
+    """
+    Thread-safe counters for the capture -> stitch -> display pipeline.
+
+    Per-frame events only bump counters; a summary line is logged at most once
+    every ``summary_interval`` seconds and the full state can be exported in
+    the Prometheus text format through ``render_prometheus``.
+    """
+
+    LATENCY_PERCENTILES = (50, 90, 99)
+    # Upper bounds (seconds) of the per-camera skew histogram buckets; the last bucket is unbounded
+    SKEW_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+    def __init__(self, frame_interval=None, latency_window=600, fps_window=5.0, summary_interval=10.0):
+        self.frame_interval = frame_interval
+        self.fps_window = fps_window
+        self.summary_interval = summary_interval
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_summary = self.started
+        self.last_tick = None
+
+        self.camera_frames = defaultdict(int)
+        self.camera_read_failures = defaultdict(int)
+        self.camera_black_frames = defaultdict(int)
+        self.camera_frame_times = defaultdict(lambda: deque(maxlen=512))
+
+        self.frames_stitched = 0
+        self.frames_displayed = 0
+        self.frames_dropped = defaultdict(int)
+        self.stitch_errors = 0
+        self.stitch_latencies = deque(maxlen=latency_window)
+        # End-to-end latencies from the oldest capture of a frame set (see FrameMetadata)
+        self.capture_to_stitch = deque(maxlen=latency_window)
+        self.capture_to_display = deque(maxlen=latency_window)
+        self.camera_skew_counts = defaultdict(lambda: np.zeros(len(self.SKEW_BUCKETS) + 1, np.int64))
+        self.camera_skew_sum = defaultdict(float)
+        # Running sum and count of every latency series, for the Prometheus summaries
+        self.latency_sums = defaultdict(float)
+        self.latency_counts = defaultdict(int)
+        self.stitch_times = deque(maxlen=512)
+        self.display_times = deque(maxlen=512)
+        self.quality_tier = 0
+        self.quality_tier_changes = 0
+
+    def record_camera_read(self, camera_index, ok, opened=True):
+        """
+        Record the outcome of one ``cap.read()``; failed or closed feeds are
+        replaced by a black frame upstream.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if ok:
+                self.camera_frames[camera_index] += 1
+                self.camera_frame_times[camera_index].append(now)
+            else:
+                if opened:
+                    self.camera_read_failures[camera_index] += 1
+                self.camera_black_frames[camera_index] += 1
+
+    def record_tick(self):
+        """
+        Record a stitching timer tick and count the ticks that were missed
+        because the previous iteration overran ``frame_interval``.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.frame_interval and self.last_tick is not None:
+                missed = int((now - self.last_tick) / self.frame_interval) - 1
+                if missed > 0:
+                    self.frames_dropped['overrun'] += missed
+            self.last_tick = now
+
+    def record_stitch(self, latency, ok=True):
+        now = time.monotonic()
+        with self.lock:
+            self.stitch_latencies.append(latency)
+            self._count_latency('stitch', latency)
+            if ok:
+                self.frames_stitched += 1
+                self.stitch_times.append(now)
+            else:
+                self.stitch_errors += 1
+
+    def record_frame_set(self, metadata):
+        """
+        Record the capture skew and capture-to-stitch latency of a stitched
+        frame set from its ``FrameMetadata``.
+        """
+        latency = metadata.capture_to_stitch()
+        with self.lock:
+            if latency is not None:
+                self.capture_to_stitch.append(latency)
+                self._count_latency('capture_to_stitch', latency)
+            for idx, skew in enumerate(metadata.camera_skew()):
+                if skew is not None:
+                    self.camera_skew_counts[idx][np.searchsorted(self.SKEW_BUCKETS, skew)] += 1
+                    self.camera_skew_sum[idx] += skew
+
+    def record_dropped(self, reason):
+        with self.lock:
+            self.frames_dropped[reason] += 1
+
+    def record_quality_tier(self, tier):
+        with self.lock:
+            if tier != self.quality_tier:
+                self.quality_tier_changes += 1
+            self.quality_tier = tier
+
+    def record_display(self, metadata=None):
+        """
+        Record a displayed panorama; with its ``FrameMetadata`` (display time
+        set) also the capture-to-display latency.
+        """
+        latency = metadata.capture_to_display() if metadata is not None else None
+        with self.lock:
+            self.frames_displayed += 1
+            self.display_times.append(time.monotonic())
+            if latency is not None:
+                self.capture_to_display.append(latency)
+                self._count_latency('capture_to_display', latency)
+
+    def _count_latency(self, name, latency):
+        self.latency_sums[name] += latency
+        self.latency_counts[name] += 1
+
+    def _rate(self, times, now):
+        recent = [t for t in times if now - t <= self.fps_window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / max(recent[-1] - recent[0], 1e-6)
+
+    def _percentiles(self, values):
+        values = np.array(values, dtype=np.float64)
+        if not values.size:
+            return {p: 0.0 for p in self.LATENCY_PERCENTILES}
+        return dict(zip(self.LATENCY_PERCENTILES, np.percentile(values, self.LATENCY_PERCENTILES)))
+
+    @staticmethod
+    def memory_usage():
+        """
+        Current resident set size of this process in bytes, or ``None``
+        where ``/proc`` is not available.
+        """
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    @staticmethod
+    def peak_memory_usage():
+        """
+        Peak resident set size of this process in bytes, or ``None``.
+        """
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def snapshot(self):
+        """
+        Return a consistent copy of all metrics as a plain dict.
+        """
+        now = time.monotonic()
+        with self.lock:
+            cameras = sorted(set(self.camera_frames) | set(self.camera_black_frames))
+            return {
+                'uptime': now - self.started,
+                'cameras': {
+                    idx: {
+                        'frames': self.camera_frames[idx],
+                        'fps': self._rate(self.camera_frame_times[idx], now),
+                        'read_failures': self.camera_read_failures[idx],
+                        'black_frames': self.camera_black_frames[idx],
+                        # Counts per SKEW_BUCKETS upper bound, then above the last one
+                        'skew_histogram': self.camera_skew_counts[idx].tolist(),
+                        'skew_sum': self.camera_skew_sum[idx],
+                    }
+                    for idx in cameras
+                },
+                'frames_stitched': self.frames_stitched,
+                'frames_displayed': self.frames_displayed,
+                'frames_dropped': dict(self.frames_dropped),
+                'stitch_errors': self.stitch_errors,
+                'stitch_fps': self._rate(self.stitch_times, now),
+                'display_fps': self._rate(self.display_times, now),
+                'stitch_latency': self._percentiles(self.stitch_latencies),
+                'capture_to_stitch_latency': self._percentiles(self.capture_to_stitch),
+                'capture_to_display_latency': self._percentiles(self.capture_to_display),
+                # (sum, count) of every latency ever recorded, per series
+                'latency_totals': {name: (self.latency_sums[name], self.latency_counts[name])
+                                   for name in ('stitch', 'capture_to_stitch', 'capture_to_display')},
+                'quality_tier': self.quality_tier,
+                'quality_tier_changes': self.quality_tier_changes,
+                'memory_rss': self.memory_usage(),
+                'memory_peak_rss': self.peak_memory_usage(),
+            }
+
+    def render_prometheus(self):
+        """
+        Render the current snapshot in the Prometheus text exposition format.
+        """
+        snap = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP camdev_{name} {help_text}")
+            lines.append(f"# TYPE camdev_{name} {kind}")
+            for labels, value in samples:
+                label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"camdev_{name}{{{label_str}}} {value}" if label_str else f"camdev_{name} {value}")
+
+        def summary(name, help_text, series):
+            lines.append(f"# HELP camdev_{name} {help_text}")
+            lines.append(f"# TYPE camdev_{name} summary")
+            for p, v in snap[f"{series}_latency"].items():
+                lines.append(f'camdev_{name}{{quantile="{p / 100:.2f}"}} {v:.6f}')
+            total, count = snap['latency_totals'][series]
+            lines.append(f"camdev_{name}_sum {total:.6f}")
+            lines.append(f"camdev_{name}_count {count}")
+
+        cams = snap['cameras']
+        metric('camera_frames_total', 'counter', 'Frames read successfully per camera.',
+               [({'camera': i}, c['frames']) for i, c in cams.items()])
+        metric('camera_fps', 'gauge', 'Recent capture rate per camera.',
+               [({'camera': i}, f"{c['fps']:.3f}") for i, c in cams.items()])
+        metric('camera_read_failures_total', 'counter', 'Failed reads on opened camera feeds.',
+               [({'camera': i}, c['read_failures']) for i, c in cams.items()])
+        metric('camera_black_frames_total', 'counter', 'Black fallback frames substituted per camera.',
+               [({'camera': i}, c['black_frames']) for i, c in cams.items()])
+        metric('frames_stitched_total', 'counter', 'Panoramas produced.', [({}, snap['frames_stitched'])])
+        metric('frames_displayed_total', 'counter', 'Panoramas handed to viewers.', [({}, snap['frames_displayed'])])
+        metric('frames_dropped_total', 'counter', 'Frames that never reached the viewers.',
+               [({'reason': r}, n) for r, n in sorted(snap['frames_dropped'].items())])
+        metric('stitch_errors_total', 'counter', 'Exceptions raised while stitching.', [({}, snap['stitch_errors'])])
+        metric('stitch_fps', 'gauge', 'Recent stitching rate.', [({}, f"{snap['stitch_fps']:.3f}")])
+        metric('display_fps', 'gauge', 'Recent display rate.', [({}, f"{snap['display_fps']:.3f}")])
+        summary('stitch_latency_seconds', 'Stitch latency; quantiles over the recent window.', 'stitch')
+        summary('capture_to_stitch_latency_seconds',
+                'Oldest camera capture to stitched panorama; quantiles over the recent window.', 'capture_to_stitch')
+        summary('capture_to_display_latency_seconds',
+                'Oldest camera capture to display; quantiles over the recent window.', 'capture_to_display')
+        lines.append("# HELP camdev_camera_skew_seconds How much older each camera frame is than the newest of its set.")
+        lines.append("# TYPE camdev_camera_skew_seconds histogram")
+        bounds = [f"{b:g}" for b in self.SKEW_BUCKETS] + ['+Inf']
+        for i, c in cams.items():
+            for le, count in zip(bounds, np.cumsum(c['skew_histogram'])):
+                lines.append(f'camdev_camera_skew_seconds_bucket{{camera="{i}",le="{le}"}} {count}')
+            lines.append(f'camdev_camera_skew_seconds_sum{{camera="{i}"}} {c["skew_sum"]:.6f}')
+            lines.append(f'camdev_camera_skew_seconds_count{{camera="{i}"}} {sum(c["skew_histogram"])}')
+        metric('quality_tier', 'gauge', 'Quality governor tier; 0 is the configured quality.',
+               [({}, snap['quality_tier'])])
+        metric('quality_tier_changes_total', 'counter', 'Quality governor tier transitions.',
+               [({}, snap['quality_tier_changes'])])
+        if snap['memory_rss'] is not None:
+            metric('memory_rss_bytes', 'gauge', 'Resident set size of the process.', [({}, snap['memory_rss'])])
+        if snap['memory_peak_rss'] is not None:
+            metric('memory_peak_rss_bytes', 'gauge', 'Peak resident set size of the process.',
+                   [({}, snap['memory_peak_rss'])])
+        return '\n'.join(lines) + '\n'
+
+    def format_summary(self, snap=None):
+        snap = snap or self.snapshot()
+        cams = ' '.join(
+            f"cam{i}={c['fps']:.1f}fps/{c['read_failures']}fail/{c['black_frames']}black"
+            for i, c in snap['cameras'].items()
+        )
+        lat = snap['stitch_latency']
+        e2e = snap['capture_to_display_latency']
+        dropped = sum(snap['frames_dropped'].values())
+        return (
+            f"stitch={snap['stitch_fps']:.1f}fps display={snap['display_fps']:.1f}fps "
+            f"latency p50={lat[50] * 1000:.1f}ms p90={lat[90] * 1000:.1f}ms p99={lat[99] * 1000:.1f}ms "
+            f"capture-to-display p50={e2e[50] * 1000:.1f}ms p99={e2e[99] * 1000:.1f}ms "
+            f"dropped={dropped} errors={snap['stitch_errors']} tier={snap['quality_tier']} rss={(snap['memory_rss'] or 0) / 2 ** 20:.0f}MiB {cams}"
+        )
+
+    def maybe_log_summary(self):
+        """
+        Log a one-line summary if ``summary_interval`` has elapsed since the last one.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_summary < self.summary_interval:
+                return False
+            self.last_summary = now
+        logging.info("Metrics: %s", self.format_summary())
+        return True
+
+
+def buffer_nbytes(value, seen=None):
+    """
+    Bytes held by the arrays in ``value`` (arrays, UMats, OpenCV feature and
+    match structures, and lists/tuples/dicts of them). Memory shared by
+    several views is counted once per ``seen`` set.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(value, np.ndarray):
+        root = value
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        if id(root) in seen:
+            return 0
+        seen.add(id(root))
+        return root.nbytes
+    if isinstance(value, cv2.UMat):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        return value.get().nbytes
+    if isinstance(value, cv2.detail.ImageFeatures):
+        # KeyPoint: pt, size, angle, response, octave, class_id
+        return len(value.keypoints) * 28 + buffer_nbytes(value.descriptors, seen)
+    if isinstance(value, cv2.detail.MatchesInfo):
+        # DMatch: queryIdx, trainIdx, imgIdx, distance
+        return len(value.matches) * 16 + len(value.inliers_mask) + buffer_nbytes(value.H, seen)
+    if isinstance(value, dict):
+        return sum(buffer_nbytes(v, seen) for v in value.values())
+    if isinstance(value, (list, tuple, deque)):
+        return sum(buffer_nbytes(v, seen) for v in value)
+    return 0
+
+
+def buffer_report(obj, prefix='', owned=(), seen=None):
+    """
+    ``{attribute path: bytes}`` for every attribute of ``obj`` that holds
+    arrays. Attributes that are ``owned`` instances (or lists/dicts of them)
+    are broken down recursively; objects and arrays reachable along several
+    paths are reported at the first one only.
+    """
+    seen = set() if seen is None else seen
+    seen.add(id(obj))
+    report = {}
+    for name, value in vars(obj).items():
+        path = f"{prefix}{name}"
+        if isinstance(value, owned):
+            children = [(path, value)]
+        elif isinstance(value, dict) and value and all(isinstance(v, owned) for v in value.values()):
+            children = [(f"{path}[{key}]", child) for key, child in value.items()]
+        elif isinstance(value, (list, tuple)) and value and all(isinstance(v, owned) for v in value):
+            children = [(f"{path}[{i}]", child) for i, child in enumerate(value)]
+        else:
+            size = buffer_nbytes(value, seen)
+            if size:
+                report[path] = size
+            continue
+        for child_path, child in children:
+            if id(child) not in seen:
+                report.update(buffer_report(child, f"{child_path}.", owned, seen))
+    return report
+
+
+class MetricsServer:
+    """
+    Serve ``StitchMetrics.render_prometheus`` on ``http://host:port/metrics``
+    from a daemon thread.
+    """
+
+    def __init__(self, metrics, port=9108, host='127.0.0.1'):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would otherwise spam stderr
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+        self.thread.start()
+        logging.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+            self.thread = None
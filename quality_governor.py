@@ -0,0 +1,139 @@
+# quality_governor.py
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+
+class QualityGovernor:
+    """
+    Holds a target frame rate by trading render quality for stitch time.
+
+    Tier 0 is the configured quality; every further tier is cheaper than the
+    one before: fewer multi-band levels, feather instead of multi-band, no
+    exposure compensation, then lower compose resolutions. Stitch latencies
+    are averaged over ``window`` frames; the governor steps down when the
+    average misses the frame budget and back up after ``upgrade_window``
+    frames with enough headroom. An upgrade that has to be undone shortly
+    afterwards doubles the wait before the next attempt, so the governor
+    does not oscillate between two tiers.
+    """
+
+    GOVERNED_SETTINGS = ('compose_megapix', 'blend_type', 'blend_strength', 'max_bands', 'exposure_compensation')
+
+    TIERS = (
+        {},
+        {'max_bands': 2},
+        {'blend_type': 'feather'},
+        {'blend_type': 'feather', 'exposure_compensation': False},
+        {'blend_type': 'feather', 'exposure_compensation': False, 'compose_fraction': 0.5},
+        {'blend_type': 'feather', 'exposure_compensation': False, 'compose_fraction': 0.25},
+    )
+
+    def __init__(self, base_settings, frame_size, target_fps=30.0, window=15, headroom=0.6,
+                 upgrade_window=60, settle_frames=2, tiers=TIERS):
+        self.base_settings = base_settings
+        self.frame_megapix = frame_size[0] * frame_size[1] / 1e6
+        self.budget = 1.0 / target_fps
+        self.window = window
+        self.headroom = headroom
+        self.upgrade_window = upgrade_window
+        self.settle_frames = settle_frames
+        self.tiers = tiers
+        self.tier = 0
+        self.max_upgrade_window = upgrade_window * 16
+        self.latencies = deque(maxlen=max(window, self.max_upgrade_window))
+        self.skip = 0
+        self.upgraded = False
+        self.transitions = []
+
+    def tier_settings(self, tier=None):
+        """
+        Values of the ``GOVERNED_SETTINGS`` for ``tier``.
+        """
+        tier = self.tier if tier is None else tier
+        overrides = dict(self.tiers[tier])
+        settings = {
+            'compose_megapix': self.base_settings.get('compose_megapix', -1),
+            'blend_type': self.base_settings.get('blend_type', 'feather'),
+            'blend_strength': self.base_settings.get('blend_strength', 50),
+            'max_bands': self.base_settings.get('max_bands', -1),
+            'exposure_compensation': self.base_settings.get('exposure_compensation', True),
+        }
+        fraction = overrides.pop('compose_fraction', None)
+        if fraction is not None:
+            base_megapix = settings['compose_megapix']
+            if base_megapix is None or base_megapix <= 0:
+                base_megapix = self.frame_megapix
+            settings['compose_megapix'] = base_megapix * fraction
+        if 'max_bands' in overrides and settings['max_bands'] >= 0:
+            overrides['max_bands'] = min(overrides['max_bands'], settings['max_bands'])
+        settings.update(overrides)
+        return settings
+
+    def record(self, latency):
+        """
+        Record one stitch latency in seconds. Returns the new tier's settings
+        when the tier changes, otherwise ``None``.
+        """
+        if self.skip > 0:
+            # The first frames after a change include rebuilding the compose plan
+            self.skip -= 1
+            return None
+        self.latencies.append(latency)
+        if len(self.latencies) < self.window:
+            return None
+
+        recent = np.mean(list(self.latencies)[-self.window:])
+        if recent > self.budget and self.tier < len(self.tiers) - 1:
+            if self.upgraded and len(self.latencies) < self.upgrade_window:
+                # The last upgrade did not hold; wait longer before the next one
+                self.upgrade_window = min(self.upgrade_window * 2, self.max_upgrade_window)
+            return self.change_tier(self.next_tier(1), recent)
+
+        if self.tier > 0 and len(self.latencies) >= self.upgrade_window:
+            sustained = np.mean(list(self.latencies)[-self.upgrade_window:])
+            if sustained < self.budget * self.headroom:
+                return self.change_tier(self.next_tier(-1), sustained)
+        return None
+
+    def next_tier(self, step):
+        """
+        Neighbouring tier in direction ``step`` whose settings actually differ
+        from the current ones (e.g. band limits are moot without multi-band).
+        """
+        current = self.tier_settings()
+        tier = self.tier + step
+        while 0 < tier < len(self.tiers) - 1 and self.tier_settings(tier) == current:
+            tier += step
+        return tier
+
+    def change_tier(self, tier, latency):
+        direction = 'down' if tier > self.tier else 'up'
+        logging.info(f"Quality governor: stepping {direction} from tier {self.tier} to {tier} "
+                     f"(latency {latency * 1000:.1f}ms, budget {self.budget * 1000:.1f}ms): {self.tiers[tier]}")
+        self.upgraded = direction == 'up'
+        self.transitions.append((time.monotonic(), self.tier, tier, latency))
+        self.tier = tier
+        self.latencies.clear()
+        self.skip = self.settle_frames
+        return self.tier_settings()
+
+    def revert(self, tier):
+        """
+        Go back to ``tier`` when the settings of the tier just chosen could
+        not be applied.
+        """
+        logging.info(f"Quality governor: staying at tier {tier} instead of {self.tier}.")
+        self.transitions.append((time.monotonic(), self.tier, tier, None))
+        self.tier = tier
+        self.upgraded = False
+
+    def rebase(self, settings):
+        """
+        Take new configured values for governed settings, e.g. from a live
+        settings change, and return the current tier's settings for them.
+        """
+        self.base_settings.update({k: v for k, v in settings.items() if k in self.GOVERNED_SETTINGS})
+        return self.tier_settings()
@@ -0,0 +1,317 @@
+# rig_server.py
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+from capture_sources import expand_source_specs
+from cli_options import parse_assignments, parse_rig_options
+from frame_ring import FramePublisher
+from metrics import StitchMetrics
+from stitching_session import StitchingSession
+
+
+class Rig:
+    """
+    One camera rig hosted by a ``RigServer``: a ``StitchingSession`` whose
+    stitching runs on the server's workers. Iterate it (``for frame in
+    rig`` or ``async for``) for its ``StitchedFrame``s; live controls go to
+    ``rig.session``.
+
+    ``target_fps`` caps the rate it is stitched at (0 or ``None``: as fast
+    as frames arrive); ``priority`` is its weight when rigs compete for
+    workers: while more rigs have work than there are workers, a rig with
+    priority 2 gets twice the worker time of a rig with priority 1.
+    """
+
+    def __init__(self, name, session, target_fps=30.0, priority=1.0, publisher=None):
+        self.name = name
+        self.session = session
+        self.target_fps = target_fps
+        self.priority = priority
+        self.publisher = publisher
+        self.virtual_time = 0.0  # Worker seconds used, divided by priority
+        self.next_due = 0.0
+        self.busy = False
+        self.steps = 0
+        self.worker_seconds = 0.0
+
+    @property
+    def state(self):
+        if self.session.finished:
+            return 'failed' if self.session.error is not None else 'finished'
+        return 'running' if self.session.stitcher is not None else 'calibrating'
+
+    def schedulable(self, now):
+        return (not self.busy and self.session.stitcher is not None and not self.session.finished
+                and now >= self.next_due and self.session.has_new_frames())
+
+    def __iter__(self):
+        return self.session.frames()
+
+    def __aiter__(self):
+        return self.session.stream()
+
+
+class RigServer:
+    """
+    Hosts several independent rigs in one process on one shared pool of
+    ``workers`` threads, instead of a process, timer and OpenCV pool per
+    rig competing for the cores.
+
+    A scheduler thread hands out one stitching step at a time to a free
+    worker, choosing among the rigs that have new frames and are due for
+    their ``target_fps`` the one with the least priority-weighted worker
+    time (start-time fair queuing), so a slow rig cannot starve the others
+    and a rig that was idle does not get a burst afterwards. A rig never
+    has more than one step in flight, which keeps its frames in order.
+    Rigs calibrate on their own thread and can be added and removed while
+    the server runs.
+
+    Rigs compose single-threaded (``compose_threads=1``) unless their
+    settings say otherwise, as parallelism comes from running rigs side by
+    side; ``opencv_threads`` sets OpenCV's own pool size for the process.
+    With ``publish_dir`` every rig publishes its panoramas to a frame ring
+    ``<publish_dir>/cam-dev-<name>``.
+    """
+
+    IDLE_POLL = 0.002  # Seconds between scheduling attempts while no rig has work
+
+    def __init__(self, workers=None, opencv_threads=None, publish_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.publish_dir = publish_dir
+        if opencv_threads is not None:
+            cv.setNumThreads(opencv_threads)
+        self.executor = None
+        self.rigs = OrderedDict()
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.virtual_clock = 0.0
+        self.running = False
+        self.scheduler = None
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rig-worker')
+        self.scheduler = threading.Thread(target=self.schedule_loop, name="rig-scheduler", daemon=True)
+        self.scheduler.start()
+        logging.info(f"Rig server started with {self.workers} workers.")
+        return self
+
+    def close(self):
+        """
+        Stop scheduling, remove every rig and stop the workers.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.scheduler:
+            self.scheduler.join()
+            self.scheduler = None
+        for name in list(self.rigs):
+            self.remove_rig(name)
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Rigs
+
+    def add_rig(self, name, sources, settings=None, target_fps=30.0, priority=1.0, lockstep=False, buffer_size=2):
+        """
+        Open the rig's sources and calibrate it in the background; it is
+        stitched once calibrated. Returns the ``Rig``.
+        """
+        if priority <= 0:
+            raise ValueError("Rig priority must be positive")
+        with self.condition:
+            if name in self.rigs:
+                raise ValueError(f"Rig '{name}' already exists")
+        settings = dict(settings or {})
+        settings.setdefault('compose_threads', 1)
+        publisher = None
+        if self.publish_dir:
+            publisher = FramePublisher(os.path.join(self.publish_dir, f"cam-dev-{name}"))
+        # The server logs its own per-rig summary (``format_stats``)
+        metrics = StitchMetrics(summary_interval=float('inf'))
+        session = StitchingSession(sources, settings, buffer_size=buffer_size, overflow='drop', lockstep=lockstep,
+                                   target_fps=target_fps, metrics=metrics, publisher=publisher)
+        session.start(stitch_thread=False)
+        rig = Rig(name, session, target_fps, priority, publisher)
+        with self.condition:
+            self.rigs[name] = rig
+        threading.Thread(target=self.calibrate, args=(rig,), name=f"calibrate-{name}", daemon=True).start()
+        logging.info(f"Rig '{name}' added with {len(session.captures)} cameras, {target_fps} fps, "
+                     f"priority {priority}.")
+        return rig
+
+    def remove_rig(self, name):
+        """
+        Stop stitching the rig, wait for its step in flight and close it.
+        """
+        with self.condition:
+            rig = self.rigs.pop(name)
+            while rig.busy:
+                self.condition.wait()
+        rig.session.close()
+        if rig.publisher:
+            rig.publisher.close()
+        logging.info(f"Rig '{name}' removed.")
+        return rig
+
+    def configure_rig(self, name, target_fps=None, priority=None):
+        """
+        Change a rig's FPS target or priority while it runs.
+        """
+        with self.condition:
+            rig = self.rigs[name]
+            if target_fps is not None:
+                rig.target_fps = target_fps
+                rig.next_due = 0.0
+            if priority is not None:
+                if priority <= 0:
+                    raise ValueError("Rig priority must be positive")
+                rig.priority = priority
+            self.condition.notify_all()
+
+    def calibrate(self, rig):
+        try:
+            rig.session.calibrate()
+        except Exception as e:
+            logging.error(f"Calibration of rig '{rig.name}' failed.", exc_info=True)
+            rig.session.finish(e)
+        with self.condition:
+            self.condition.notify_all()
+
+    # Scheduling
+
+    def pick(self, now):
+        """
+        The schedulable rig with the earliest virtual start time, or ``None``.
+        """
+        if self.in_flight >= self.workers:
+            return None
+        best = None
+        best_start = None
+        for rig in self.rigs.values():
+            if not rig.schedulable(now):
+                continue
+            start = max(rig.virtual_time, self.virtual_clock)
+            if best is None or start < best_start:
+                best, best_start = rig, start
+        if best is not None:
+            best.virtual_time = best_start
+            self.virtual_clock = best_start
+        return best
+
+    def schedule_loop(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                rig = self.pick(time.monotonic())
+                if rig is None:
+                    self.condition.wait(self.IDLE_POLL)
+                    continue
+                rig.busy = True
+                self.in_flight += 1
+            self.executor.submit(self.step, rig)
+
+    def step(self, rig):
+        start = time.perf_counter()
+        try:
+            more = rig.session.stitch_newest()
+        except Exception:
+            logging.error(f"Error stitching rig '{rig.name}'.", exc_info=True)
+            more = True
+        seconds = time.perf_counter() - start
+        now = time.monotonic()
+        with self.condition:
+            rig.busy = False
+            self.in_flight -= 1
+            rig.steps += 1
+            rig.worker_seconds += seconds
+            rig.virtual_time += seconds / rig.priority
+            if rig.target_fps:
+                interval = 1.0 / rig.target_fps
+                rig.next_due = max(rig.next_due + interval, now - interval)
+            self.condition.notify_all()
+        if not more:
+            logging.info(f"Rig '{rig.name}': all sources are exhausted.")
+            rig.session.finish()
+
+    def stats(self):
+        """
+        Per rig: state, targets, achieved rate, share of the worker time and
+        drops, from the rig's metrics.
+        """
+        with self.condition:
+            rigs = list(self.rigs.values())
+        total = sum(rig.worker_seconds for rig in rigs) or 1.0
+        stats = OrderedDict()
+        for rig in rigs:
+            snap = rig.session.metrics.snapshot()
+            stats[rig.name] = {
+                'state': rig.state,
+                'target_fps': rig.target_fps,
+                'priority': rig.priority,
+                'stitch_fps': snap['stitch_fps'],
+                'stitch_latency': snap['stitch_latency'],
+                'worker_share': rig.worker_seconds / total,
+                'steps': rig.steps,
+                'frames_dropped': snap['frames_dropped'],
+                'error': str(rig.session.error) if rig.session.error is not None else None,
+            }
+        return stats
+
+    def format_stats(self):
+        return ' '.join(
+            f"{name}={s['state']}/{s['stitch_fps']:.1f}of{s['target_fps'] or 0:g}fps/"
+            f"p{s['priority']:g}/{s['worker_share'] * 100:.0f}%"
+            for name, s in self.stats().items()
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stitch several camera rigs in one process.")
+    parser.add_argument('--rig', action='append', required=True,
+                        help="name=';'-separated capture specs, e.g. north='replay:/data/n/cam{index}.mp4?count=4'")
+    parser.add_argument('--fps', action='append', help="Per-rig FPS target as name=fps (default 30)")
+    parser.add_argument('--priority', action='append', help="Per-rig priority as name=weight (default 1)")
+    parser.add_argument('--setting', action='append', help="FrameStitcher setting for all rigs as key=value")
+    parser.add_argument('--workers', type=int, default=None, help="Shared stitching workers (default: one per core)")
+    parser.add_argument('--opencv-threads', type=int, default=None)
+    parser.add_argument('--publish-dir', default=None, help="Publish each rig's panoramas to frame rings here")
+    parser.add_argument('--stats-interval', type=float, default=10.0)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+
+    fps = parse_rig_options(args.fps, float)
+    priority = parse_rig_options(args.priority, float)
+    settings = parse_assignments(args.setting)
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    with RigServer(args.workers, args.opencv_threads, args.publish_dir) as server:
+        for name, specs in parse_rig_options(args.rig).items():
+            server.add_rig(name, expand_source_specs(specs), settings, target_fps=fps.get(name, 30.0),
+                           priority=priority.get(name, 1.0))
+        while not stop.wait(args.stats_interval):
+            logging.info(f"Rigs: {server.format_stats()}")
+
+
+if __name__ == "__main__":
+    main()
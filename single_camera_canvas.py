@@ -5,6 +5,8 @@ from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtCore import pyqtSignal, Qt
 import cv2
 import logging
+from capture_config import apply_capture_mode
+from capture_sources import open_capture_source
 
 class SingleCameraCanvas(QWidget):
     camera_selection_changed = pyqtSignal(int, str)  # Arguments: canvas index, selected camera
@@ -14,6 +16,7 @@ class SingleCameraCanvas(QWidget):
         self.canvas_index = canvas_index
         self.all_cameras = all_cameras
         self.capture = None
+        self.capture_mode = None  # Negotiated CaptureMode, re-applied when the camera is reopened
         self.init_ui()
         self.camera_dropdown.setCurrentIndex(camera_index)
         self.change_camera()
@@ -54,22 +57,38 @@ class SingleCameraCanvas(QWidget):
             camera_device_index = self.camera_dropdown.currentText()
             if self.capture:
                 self.capture.release()
-            # Convert to integer index
-            device_index = int(camera_device_index)
-            # Specify the backend (e.g., CAP_V4L2 for Linux)
-            self.capture = cv2.VideoCapture(device_index, cv2.CAP_V4L2)
+            # Device index (opened with CAP_V4L2) or a virtual camera spec
+            self.capture = open_capture_source(camera_device_index)
             if not self.capture.isOpened():
                 raise ValueError(f"Cannot open camera {camera_device_index}")
+            if self.capture_mode:
+                apply_capture_mode(self.capture, self.capture_mode)
         except Exception as e:
             logging.error("Error changing camera.", exc_info=True)
             QMessageBox.critical(self, "Error", f"Failed to change camera: {str(e)}")
 
+    def configure_capture(self, mode):
+        """
+        Remember ``mode`` for this canvas; it has already been applied to the
+        open capture by the caller.
+        """
+        self.capture_mode = mode
+
+    def device_index(self):
+        try:
+            return int(self.camera_dropdown.currentText())
+        except ValueError:
+            return None
+
     def update_frame(self):
         try:
             if self.capture and self.capture.isOpened():
                 ret, frame = self.capture.read()
                 if ret:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    if frame.ndim == 3 and frame.shape[2] == 2:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_YUYV)  # Raw capture for YUV stitching
+                    else:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                     image = QImage(
                         frame.data, frame.shape[1], frame.shape[0], QImage.Format_RGB888
                     )
@@ -0,0 +1,293 @@
+# soak_harness.py
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict, namedtuple
+
+import cv2 as cv
+import numpy as np
+
+from capture_sources import expand_source_specs
+from cli_options import parse_assignments, parse_duration
+from metrics import StitchMetrics
+from stitching_session import StitchingSession
+
+# One measurement of a soak run. ``camera_params`` holds focal, ppx, ppy and
+# the flattened rotation of every camera (one row each), ``rss`` the current
+# RSS and ``traced`` the bytes tracemalloc sees (both 0 when unavailable) and
+# ``output_shape``/``dst_roi`` the geometry of the last panorama.
+SoakSample = namedtuple('SoakSample', ['elapsed', 'frames', 'fps', 'rss', 'traced', 'camera_params',
+                                       'warped_image_scale', 'output_shape', 'dst_roi', 'quality_tier'])
+
+# Outcome of a soak run; it passed when ``failures`` is empty
+SoakReport = namedtuple('SoakReport', ['samples', 'failures', 'top_allocations', 'frames', 'seconds'])
+
+DEFAULT_THRESHOLDS = OrderedDict()
+DEFAULT_THRESHOLDS['rss_growth_mib'] = 256.0  # RSS growth since the end of the warm-up
+DEFAULT_THRESHOLDS['rss_slope_mib_per_hour'] = 64.0  # Fitted RSS trend, once enough time has passed
+DEFAULT_THRESHOLDS['traced_growth_mib'] = 128.0  # Python and numpy allocations since the warm-up
+DEFAULT_THRESHOLDS['min_fps'] = 0.0  # Lowest rate of any sample interval; 0 disables
+DEFAULT_THRESHOLDS['fps_drop'] = 0.5  # Largest fractional drop below the warm-up rate
+DEFAULT_THRESHOLDS['param_drift'] = 1e-6  # Relative change of focal lengths, principal points and warp scale
+DEFAULT_THRESHOLDS['rotation_drift'] = 1e-6  # Largest change of any camera rotation matrix element
+
+RSS_SLOPE_MIN_SPAN = 600.0  # Seconds of samples after the warm-up before the RSS trend is judged
+MIB = 2 ** 20
+
+
+def synthetic_rig(directory, num_cameras=3, width=640, height=480, num_frames=60, step_deg=35.0, seed=0):
+    """
+    Render a rotating rig looking at a textured cylinder into
+    ``directory/cam<i>/`` and return replay specs for it. The scene sways
+    periodically, so looped playback has no jump and every frame differs.
+    """
+    rng = np.random.default_rng(seed)
+    scene_w, scene_h = 4000, 1600
+    scene = cv.resize(rng.integers(0, 255, (scene_h // 16, scene_w // 16, 3), dtype=np.uint8),
+                      (scene_w, scene_h), interpolation=cv.INTER_CUBIC)
+    for _ in range(3000):
+        x, y = int(rng.integers(0, scene_w)), int(rng.integers(0, scene_h))
+        color = tuple(int(v) for v in rng.integers(0, 255, 3))
+        cv.circle(scene, (x, y), int(rng.integers(3, 30)), color, -1)
+        cv.rectangle(scene, (x, y), (x + int(rng.integers(5, 50)), y + int(rng.integers(5, 50))), color, 2)
+
+    focal = 0.94 * width
+    radius = scene_w / (2 * np.pi)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float64)
+    dx = (xs - width / 2) / focal
+    dy = (ys - height / 2) / focal
+    specs = []
+    for idx in range(num_cameras):
+        camera_dir = os.path.join(directory, f"cam{idx}")
+        os.makedirs(camera_dir, exist_ok=True)
+        yaw = np.deg2rad((idx - (num_cameras - 1) / 2) * step_deg)
+        x = np.cos(yaw) * dx + np.sin(yaw)
+        z = -np.sin(yaw) * dx + np.cos(yaw)
+        map_x = (np.arctan2(x, z) * radius + scene_w / 2).astype(np.float32)
+        map_y = (dy / np.sqrt(x ** 2 + z ** 2) * radius + scene_h / 2).astype(np.float32)
+        gain = 0.85 + 0.3 * rng.random()
+        for k in range(num_frames):
+            sway = 6.0 * np.sin(2 * np.pi * k / num_frames)
+            frame = cv.remap(scene, map_x + np.float32(sway), map_y, cv.INTER_LINEAR)
+            frame = cv.convertScaleAbs(frame, alpha=gain)
+            cv.imwrite(os.path.join(camera_dir, f"{k:05d}.png"), frame)
+        specs.append(f"replay:{camera_dir}?preload=1&seed={seed + idx}")
+    return specs
+
+
+class SoakHarness:
+    """
+    Run a ``StitchingSession`` for a long time and watch it for leaks and
+    drift: RSS and tracemalloc growth (with the top growing allocation
+    sites), stitch rate per sample interval, and changes of the calibrated
+    cameras and of the output geometry, which must all stay constant
+    while the settings do.
+
+    Everything measured during ``warmup`` seconds (plan and compositor
+    caches filling, allocator pools growing) is excluded; the first sample
+    after it is the baseline. ``thresholds`` override
+    ``DEFAULT_THRESHOLDS``; with ``fail_fast`` the run stops at the first
+    failing sample.
+    """
+
+    def __init__(self, sources, settings=None, duration=3600.0, sample_interval=10.0, warmup=30.0,
+                 thresholds=None, lockstep=False, target_fps=None, trace_allocations=True, fail_fast=False,
+                 csv_path=None):
+        self.sources = list(sources)
+        self.settings = dict(settings or {})
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.warmup = warmup
+        self.thresholds = OrderedDict(DEFAULT_THRESHOLDS)
+        unknown = set(thresholds or {}) - set(self.thresholds)
+        if unknown:
+            raise ValueError(f"Unknown soak thresholds: {sorted(unknown)}")
+        self.thresholds.update(thresholds or {})
+        self.lockstep = lockstep
+        self.target_fps = target_fps
+        self.trace_allocations = trace_allocations
+        self.fail_fast = fail_fast
+        self.csv_path = csv_path
+        self.metrics = StitchMetrics(summary_interval=max(sample_interval, 10.0))
+
+    def sample(self, session, frame, frames, elapsed, previous):
+        stitcher = session.stitcher
+        camera_params = np.array([[cam.focal, cam.ppx, cam.ppy] + list(np.asarray(cam.R, np.float64).ravel())
+                                  for cam in stitcher.cameras], np.float64)
+        interval = elapsed - previous.elapsed if previous else elapsed
+        fps = (frames - (previous.frames if previous else 0)) / max(interval, 1e-6)
+        plan = stitcher.compose_plan
+        return SoakSample(
+            elapsed, frames, fps, StitchMetrics.memory_usage() or 0,
+            tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0,
+            camera_params, stitcher.warped_image_scale, tuple(frame.panorama.shape),
+            tuple(plan.dst_roi) if plan is not None else None, frame.quality_tier,
+        )
+
+    def check(self, baseline, samples):
+        """
+        Failures of ``samples`` (taken after ``baseline``) against the thresholds.
+        """
+        limits = self.thresholds
+        failures = []
+        latest = samples[-1]
+        growth = (latest.rss - baseline.rss) / MIB
+        if baseline.rss and latest.rss and growth > limits['rss_growth_mib']:
+            failures.append(f"RSS grew by {growth:.1f} MiB (limit {limits['rss_growth_mib']})")
+        if baseline.rss and latest.elapsed - baseline.elapsed >= RSS_SLOPE_MIN_SPAN and len(samples) >= 3:
+            hours = np.array([s.elapsed for s in samples]) / 3600.0
+            slope = np.polyfit(hours, np.array([s.rss for s in samples]) / MIB, 1)[0]
+            if slope > limits['rss_slope_mib_per_hour']:
+                failures.append(f"RSS grows by {slope:.1f} MiB/hour (limit {limits['rss_slope_mib_per_hour']})")
+        if baseline.traced and latest.traced:
+            traced = (latest.traced - baseline.traced) / MIB
+            if traced > limits['traced_growth_mib']:
+                failures.append(f"Traced allocations grew by {traced:.1f} MiB (limit {limits['traced_growth_mib']})")
+        slowest = min(samples, key=lambda s: s.fps)
+        if limits['min_fps'] and slowest.fps < limits['min_fps']:
+            failures.append(f"Rate fell to {slowest.fps:.1f} fps at {slowest.elapsed:.0f}s (minimum {limits['min_fps']})")
+        if baseline.fps > 0 and 1.0 - slowest.fps / baseline.fps > limits['fps_drop']:
+            failures.append(f"Rate dropped from {baseline.fps:.1f} to {slowest.fps:.1f} fps at {slowest.elapsed:.0f}s")
+
+        scale = np.abs(baseline.camera_params[:, :3]) + 1e-12
+        drift = float(np.max(np.abs(latest.camera_params[:, :3] - baseline.camera_params[:, :3]) / scale))
+        drift = max(drift, abs(latest.warped_image_scale - baseline.warped_image_scale) / baseline.warped_image_scale)
+        if drift > limits['param_drift']:
+            failures.append(f"Camera parameters drifted by {drift:.3g} (limit {limits['param_drift']})")
+        rotation = float(np.max(np.abs(latest.camera_params[:, 3:] - baseline.camera_params[:, 3:])))
+        if rotation > limits['rotation_drift']:
+            failures.append(f"Camera rotations drifted by {rotation:.3g} (limit {limits['rotation_drift']})")
+        for s in samples:
+            # The quality governor changes the geometry on purpose; compare like with like
+            if s.quality_tier == baseline.quality_tier and (s.output_shape, s.dst_roi) != (baseline.output_shape,
+                                                                                           baseline.dst_roi):
+                failures.append(f"Output geometry changed from {baseline.output_shape} {baseline.dst_roi} "
+                                f"to {s.output_shape} {s.dst_roi} at {s.elapsed:.0f}s")
+                break
+        return failures
+
+    def write_csv(self, samples):
+        with open(self.csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['elapsed', 'frames', 'fps', 'rss_mib', 'traced_mib', 'max_focal', 'warped_image_scale',
+                             'output_shape', 'quality_tier'])
+            for s in samples:
+                writer.writerow([f"{s.elapsed:.1f}", s.frames, f"{s.fps:.2f}", f"{s.rss / MIB:.1f}",
+                                 f"{s.traced / MIB:.1f}", f"{s.camera_params[:, 0].max():.6f}",
+                                 f"{s.warped_image_scale:.6f}", 'x'.join(map(str, s.output_shape)), s.quality_tier])
+
+    def run(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        samples = []
+        baseline = None
+        baseline_index = None
+        baseline_snapshot = None
+        failures = []
+        frames = 0
+        stopped = False
+        session = StitchingSession(self.sources, self.settings, lockstep=self.lockstep,
+                                   overflow='block' if self.lockstep else 'drop',
+                                   target_fps=self.target_fps, metrics=self.metrics)
+        try:
+            with session:
+                session.wait_ready()
+                start = time.monotonic()
+                next_sample = start + self.sample_interval
+                logging.info(f"Soak run started: {len(self.sources)} cameras for {self.duration:.0f}s.")
+                for frame in session.frames(timeout=max(self.sample_interval, 5.0)):
+                    frames += 1
+                    now = time.monotonic()
+                    if now < next_sample and now - start < self.duration:
+                        continue
+                    while next_sample <= now:
+                        next_sample += self.sample_interval
+                    sample = self.sample(session, frame, frames, now - start, samples[-1] if samples else None)
+                    samples.append(sample)
+                    if baseline is None:
+                        if sample.elapsed >= self.warmup:
+                            baseline, baseline_index = sample, len(samples) - 1
+                            if tracemalloc.is_tracing():
+                                baseline_snapshot = tracemalloc.take_snapshot()
+                    else:
+                        failures = self.check(baseline, samples[baseline_index + 1:])
+                    logging.info(f"Soak {sample.elapsed:.0f}s: {sample.frames} frames, {sample.fps:.1f} fps, "
+                                 f"rss {sample.rss / MIB:.1f} MiB, traced {sample.traced / MIB:.1f} MiB"
+                                 + (f", failing: {failures}" if failures else ""))
+                    if (failures and self.fail_fast) or now - start >= self.duration:
+                        stopped = True
+                        break
+                seconds = time.monotonic() - start
+                if not stopped:
+                    if session.finished:
+                        failures.append(f"Session ended after {seconds:.0f}s of {self.duration:.0f}s")
+                    else:
+                        failures.append(f"No panorama for {max(self.sample_interval, 5.0):.0f}s after {seconds:.0f}s")
+        finally:
+            top_allocations = []
+            if baseline_snapshot is not None:
+                stats = tracemalloc.take_snapshot().compare_to(baseline_snapshot, 'lineno')
+                top_allocations = [str(stat) for stat in stats[:10] if stat.size_diff > 0]
+            if self.trace_allocations:
+                tracemalloc.stop()
+        if baseline is None:
+            failures.append(f"Run ended after {seconds:.0f}s, before the {self.warmup:.0f}s warm-up completed")
+        if self.csv_path:
+            self.write_csv(samples)
+        return SoakReport(samples, failures, top_allocations, frames, seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test the stitching loop for leaks and drift.")
+    parser.add_argument('--sources', help="';'-separated capture specs, e.g. 'replay:/data/cam{index}.mp4?count=4'")
+    parser.add_argument('--synthetic', type=int, default=3, help="Cameras of a synthetic rig when no sources are given")
+    parser.add_argument('--synthetic-size', default='640x480')
+    parser.add_argument('--duration', default='1h', help="Run time, e.g. 600, 30m, 8h")
+    parser.add_argument('--sample-interval', default='10s')
+    parser.add_argument('--warmup', default='30s')
+    parser.add_argument('--setting', action='append', help="FrameStitcher setting as key=value (repeatable)")
+    parser.add_argument('--threshold', action='append',
+                        help=f"Override a threshold as key=value; keys: {', '.join(DEFAULT_THRESHOLDS)}")
+    parser.add_argument('--lockstep', action='store_true', help="Stitch every frame instead of the newest")
+    parser.add_argument('--target-fps', type=float, default=None)
+    parser.add_argument('--no-tracemalloc', action='store_true', help="Skip allocation tracing (it slows Python)")
+    parser.add_argument('--fail-fast', action='store_true')
+    parser.add_argument('--csv', help="Write the samples to this CSV file")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+
+    with tempfile.TemporaryDirectory(prefix='soak-rig-') as directory:
+        if args.sources:
+            sources = expand_source_specs(args.sources)
+        else:
+            width, height = (int(v) for v in args.synthetic_size.lower().split('x'))
+            sources = synthetic_rig(directory, args.synthetic, width, height)
+        harness = SoakHarness(
+            sources, parse_assignments(args.setting), duration=parse_duration(args.duration),
+            sample_interval=parse_duration(args.sample_interval), warmup=parse_duration(args.warmup),
+            thresholds=parse_assignments(args.threshold), lockstep=args.lockstep, target_fps=args.target_fps,
+            trace_allocations=not args.no_tracemalloc, fail_fast=args.fail_fast, csv_path=args.csv,
+        )
+        report = harness.run()
+
+    print(f"{report.frames} frames in {report.seconds:.0f}s, {len(report.samples)} samples.")
+    if report.top_allocations:
+        print("Top allocation growth since the warm-up:")
+        for line in report.top_allocations:
+            print(f"  {line}")
+    if report.failures:
+        print("FAILED:")
+        for failure in report.failures:
+            print(f"  {failure}")
+        return 1
+    print("PASSED")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,7 @@ from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtCore import Qt, pyqtSignal
 import cv2
 import logging
+from yuv_frame import YuvFrame
 
 class StitchedVideoViewer(QWidget):
     fullscreen_requested = pyqtSignal()  # Signal to request fullscreen
@@ -36,7 +37,10 @@ class StitchedVideoViewer(QWidget):
 
     def display_video(self, frame):
         try:
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if isinstance(frame, YuvFrame):
+                frame_rgb = frame.to_rgb()  # The only conversion of a YUV-stitched panorama
+            else:
+                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             h, w, ch = frame_rgb.shape
             bytes_per_line = ch * w
             qt_image = QImage(frame_rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
@@ -2,86 +2,289 @@
 from PyQt5.QtCore import QThread, pyqtSignal, QObject
 import cv2
 import numpy as np
+from collections import OrderedDict, namedtuple
+from frame_metadata import FrameMetadata, attach_metadata
 from frame_stitcher import FrameStitcher
+from metrics import StitchMetrics, buffer_report
+from frame_ring import FrameRingWriter
+from quality_governor import QualityGovernor
 import logging
+import time
 import traceback
 
 # Configure logging
 logging.basicConfig(
     filename='video_stitcher.log',
-    level=logging.ERROR,
+    level=logging.INFO,
     format='%(asctime)s:%(levelname)s:%(message)s'
 )
 
+# Outcome of calibrating a FrameStitcher: either ``stitcher`` (with its optional
+# quality ``governor``) or the ``error`` (a StitchingError or other exception);
+# ``stage_times`` maps calibration stages to seconds
+CalibrationResult = namedtuple('CalibrationResult', ['stitcher', 'governor', 'error', 'stage_times',
+                                                     'fallback_cameras', 'seconds'])
+
+
+def grab_frames(camera_feeds, metrics, capture_times=None):
+    """
+    Read one frame from every feed, substituting a black frame for feeds
+    that are closed or fail to deliver. Outcomes go to the metrics rather
+    than the log so a flaky camera does not produce a warning per frame.
+    Returns the frames and the indices of the cameras that fell back; the
+    ``time.time()`` each read returned (``None`` for fallbacks) is appended
+    to ``capture_times`` when given.
+    """
+    frames = []
+    fallback_cameras = []
+    for idx, cap in enumerate(camera_feeds):
+        if cap and cap.isOpened():
+            ret, frame = cap.read()
+            if ret:
+                if capture_times is not None:
+                    capture_times.append(time.time())
+                frames.append(frame)
+                metrics.record_camera_read(idx, True)
+                continue
+            metrics.record_camera_read(idx, False)
+        else:
+            metrics.record_camera_read(idx, False, opened=False)
+        if capture_times is not None:
+            capture_times.append(None)
+        fallback_cameras.append(idx)
+        frames.append(np.zeros((480, 640, 3), dtype=np.uint8))  # Black frame
+    return frames, fallback_cameras
+
+
+def calibrate_stitcher(frames, settings, fallback_cameras=(), progress=None):
+    """
+    Calibrate a ``FrameStitcher`` on ``frames``. Never raises: failures are
+    returned in the ``CalibrationResult``.
+    """
+    start = time.perf_counter()
+    stage_times = OrderedDict()
+
+    def report(stage, seconds):
+        stage_times[stage] = stage_times.get(stage, 0.0) + seconds
+        if progress:
+            progress(stage, seconds)
+
+    try:
+        if fallback_cameras:
+            logging.warning(f"Calibrating with black fallback frames for cameras {list(fallback_cameras)}.")
+        stitcher = FrameStitcher(frames, progress=report, **settings)
+        governor = None
+        if settings.get('quality_governor', False):
+            base = {key: getattr(stitcher, key) for key in QualityGovernor.GOVERNED_SETTINGS}
+            governor = QualityGovernor(base, (frames[0].shape[1], frames[0].shape[0]),
+                                       target_fps=settings.get('target_fps', 30.0))
+        stitcher.progress = None  # Progress is only reported while calibrating
+        return CalibrationResult(stitcher, governor, None, stage_times, list(fallback_cameras),
+                                 time.perf_counter() - start)
+    except Exception as e:
+        logging.error("Error during stitcher calibration.", exc_info=True)
+        return CalibrationResult(None, None, e, stage_times, list(fallback_cameras), time.perf_counter() - start)
+
+
+class CalibrationWorker(QThread):
+    """
+    Calibrates a ``FrameStitcher`` off the GUI thread. ``progress`` is
+    emitted with each finished calibration stage and its seconds,
+    ``calibrated`` once with the ``CalibrationResult``.
+    """
+    progress = pyqtSignal(str, float)
+    calibrated = pyqtSignal(object)
+
+    def __init__(self, frames, settings, fallback_cameras=()):
+        super(CalibrationWorker, self).__init__()
+        self.frames = frames
+        self.settings = settings
+        self.fallback_cameras = fallback_cameras
+
+    def run(self):
+        result = calibrate_stitcher(self.frames, self.settings, self.fallback_cameras, progress=self.progress.emit)
+        self.frames = None
+        self.calibrated.emit(result)
+
+
 class VideoStitcher(QThread):
+    """
+    Emitted panoramas and views are ``StampedFrame``s (or ``YuvFrame``s)
+    carrying the ``FrameMetadata`` of their frame set, for consumers that
+    want it (see ``frame_metadata``); others use them as plain frames.
+    """
     frame_ready = pyqtSignal(object)
+    view_ready = pyqtSignal(str, object)  # Virtual PTZ view name, frame
     error_occurred = pyqtSignal(str)  # Signal to emit error messages
 
-    def __init__(self, camera_feeds, settings):
+    def __init__(self, camera_feeds, settings, metrics=None, publisher=None, calibration=None):
+        """
+        Calibrates on the current frames unless a successful
+        ``CalibrationResult`` (from a ``CalibrationWorker``) is given.
+        """
         super(VideoStitcher, self).__init__()
         self.camera_feeds = camera_feeds
         self.settings = settings
+        self.metrics = metrics if metrics is not None else StitchMetrics()
+        self.publisher = publisher  # Optional FramePublisher for out-of-process consumers
         self.is_running = True
         self.stitcher = None
-        try:
-            frames = []
-            for cap in self.camera_feeds:
-                if cap and cap.isOpened():
-                    ret, frame = cap.read()
-                    if ret:
-                        frames.append(frame)
-                    else:
-                        logging.warning("Failed to read frame from a camera feed. Using black frame as fallback.")
-                        frames.append(np.zeros((480, 640, 3), dtype=np.uint8))  # Black frame
-                else:
-                    logging.warning("Camera feed is not opened. Using black frame as fallback.")
-                    frames.append(np.zeros((480, 640, 3), dtype=np.uint8))  # Black frame
+        self.governor = None
+        self.pending_render_settings = {}
+        self.frame_sequence = 0
+        self.camera_sequences = [0] * len(camera_feeds)
+        self.metadata = None  # FrameMetadata of the last grabbed frame set
+        if calibration is None:
+            frames = self.grab_frames()
             # print("settings", settings)
-            self.stitcher = FrameStitcher(frames, **settings)
-        except Exception as e:
-            logging.error("Error during VideoStitcher initialization.", exc_info=True)
-            self.error_occurred.emit(f"Initialization error: {str(e)}")
-            self.stitcher = None  # Ensure stitcher is set to None to avoid further errors
+            calibration = calibrate_stitcher(frames, settings, self.fallback_cameras)
+        self.fallback_cameras = calibration.fallback_cameras
+        if calibration.error is not None:
+            self.error_occurred.emit(f"Initialization error: {str(calibration.error)}")
+        self.stitcher = calibration.stitcher  # None when calibration failed
+        self.governor = calibration.governor
+        if self.governor:
+            self.metrics.record_quality_tier(self.governor.tier)
+
+    def update_render_settings(self, settings):
+        """
+        Queue render-only settings (``FrameStitcher.RENDER_SETTINGS``); they
+        are applied between frames without recalibrating. A lean stitcher
+        has released the images needed for ``FrameStitcher.SEAM_SETTINGS``,
+        which then only take effect on the next restart.
+        """
+        settings = {k: v for k, v in settings.items() if k in FrameStitcher.RENDER_SETTINGS}
+        if self.stitcher and self.stitcher.lean:
+            fixed = {k for k in FrameStitcher.SEAM_SETTINGS
+                     if k in settings and settings[k] != getattr(self.stitcher, k)}
+            if fixed:
+                logging.warning(f"Lean mode: {sorted(fixed)} will apply when stitching restarts.")
+            settings = {k: v for k, v in settings.items() if k not in fixed}
+        self.pending_render_settings.update(settings)
+
+    def apply_render_settings(self):
+        settings, self.pending_render_settings = self.pending_render_settings, {}
+        self.settings.update(settings)
+        if self.governor:
+            # The governor keeps stepping down from the new configured values
+            settings.update(self.governor.rebase(settings))
+        try:
+            self.stitcher.update_render_settings(**settings)
+        except Exception:
+            logging.error("Error applying render settings.", exc_info=True)
+
+    def apply_quality_tier(self, latency):
+        """
+        Feed a stitch latency to the quality governor and apply the tier it
+        chooses; if that fails the current tier is kept.
+        """
+        tier = self.governor.tier
+        try:
+            render_settings = self.governor.record(latency)
+            if render_settings is None:
+                return
+            self.stitcher.update_render_settings(**render_settings)
+        except Exception:
+            logging.error(f"Error applying quality tier {self.governor.tier}; keeping tier {tier}.", exc_info=True)
+            self.governor.revert(tier)
+            return
+        self.metrics.record_quality_tier(self.governor.tier)
+
+    @property
+    def quality_tier(self):
+        """
+        Current quality governor tier; 0 is the configured quality.
+        """
+        return self.governor.tier if self.governor else 0
+
+    def grab_frames(self):
+        """
+        Read one frame from every feed (see the module's ``grab_frames``) and
+        start the ``FrameMetadata`` of the set.
+        """
+        capture_times = []
+        frames, self.fallback_cameras = grab_frames(self.camera_feeds, self.metrics, capture_times)
+        for idx, captured in enumerate(capture_times):
+            if captured is not None:
+                self.camera_sequences[idx] += 1
+        self.frame_sequence += 1
+        self.metadata = FrameMetadata(self.frame_sequence, capture_times, self.camera_sequences)
+        return frames
 
     def run(self):
         # while self.is_running:
         if not self.is_running:
             return  # Avoid running the loop if the stitcher is stopped 
         
-        
+        self.metrics.record_tick()
         try:
-            frames = []
-            for cap in self.camera_feeds:
-                if cap and cap.isOpened():
-                    ret, frame = cap.read()
-                    if ret:
-                        frames.append(frame)
-                    else:
-                        logging.warning("Failed to read frame from a camera feed. Using black frame as fallback.")
-                        frames.append(np.zeros((480, 640, 3), dtype=np.uint8))  # Black frame
-                else:
-                    logging.warning("Camera feed is not opened. Using black frame as fallback.")
-                    frames.append(np.zeros((480, 640, 3), dtype=np.uint8))  # Black frame
+            frames = self.grab_frames()
 
             if frames and self.stitcher:
+                if self.pending_render_settings:
+                    self.apply_render_settings()
+                frames = self.stitcher.prepare_frames(frames)
+                metadata = self.metadata
+                metadata.stitch_start = time.time()
+                start = time.perf_counter()
                 try:
                     stitched_frame = self.stitcher.stitch_frames(frames)
+                    latency = time.perf_counter() - start
+                    metadata.stitch_end = time.time()
+                    self.metrics.record_stitch(latency)
                     if stitched_frame is not None:
-                        self.frame_ready.emit(stitched_frame)
+                        self.metrics.record_frame_set(metadata)
+                        if self.publisher:
+                            self.publisher.publish(stitched_frame, frames, metadata.stitch_end)
+                        self.frame_ready.emit(attach_metadata(stitched_frame, metadata))
+                        if self.stitcher.views:
+                            for name, view in self.stitcher.render_views(frames).items():
+                                self.view_ready.emit(name, attach_metadata(view, metadata))
                     else:
-                        logging.error("Stitcher returned None.")
+                        self.metrics.record_dropped('empty_result')
                         # self.error_occurred.emit("Stitcher returned an invalid frame.")
                 except Exception as e:
+                    self.metrics.record_stitch(time.perf_counter() - start, ok=False)
+                    self.metrics.record_dropped('stitch_error')
                     logging.error("Error during frame stitching.", exc_info=True)
                     # self.error_occurred.emit(f"Stitching error: {str(e)}")
+                else:
+                    if self.governor:
+                        self.apply_quality_tier(latency)
             else:
-                logging.error("No frames to stitch or stitcher not initialized.")
+                self.metrics.record_dropped('not_initialized')
                 # self.error_occurred.emit("No frames to stitch or stitcher not initialized.")
         except Exception as e:
             logging.error("Unexpected error in VideoStitcher run loop.", exc_info=True)
             # self.error_occurred.emit(f"Unexpected error: {str(e)}")
             # Depending on the severity, you might choose to stop the thread
             # self.is_running = False
+        self.metrics.maybe_log_summary()
+
+    def add_view(self, name, pan=0.0, tilt=0.0, fov=60.0, size=(640, 360)):
+        """
+        Register a virtual PTZ view; its frames are emitted on ``view_ready``.
+        """
+        if self.stitcher:
+            self.stitcher.add_view(name, pan, tilt, fov, size)
+
+    def remove_view(self, name):
+        if self.stitcher:
+            self.stitcher.remove_view(name)
+
+    def memory_report(self):
+        """
+        Bytes held by the stitcher (see ``FrameStitcher.memory_report``) and
+        the publisher's frame rings, plus the process RSS for comparison.
+        """
+        report = {}
+        if self.stitcher:
+            report.update({f"stitcher.{k}": v for k, v in self.stitcher.memory_report().items() if k != 'total'})
+        if self.publisher:
+            report.update(buffer_report(self.publisher, 'publisher.', owned=(FrameRingWriter,)))
+        report['total'] = sum(report.values())
+        report['process_rss'] = self.metrics.memory_usage()
+        return report
 
     def stop(self):
         self.is_running = False
@@ -0,0 +1,536 @@
+# stitching_session.py
+import asyncio
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from capture_sources import open_capture_source
+from frame_metadata import FrameMetadata, attach_metadata, frame_metadata
+from frame_stitcher import FrameStitcher
+from metrics import StitchMetrics
+from quality_governor import QualityGovernor
+from viewport import VirtualView
+
+# One stitched panorama and what it was made from. ``capture_times`` are the
+# ``time.time()`` arrival times of the camera frames, ``latency`` the stitch
+# time in seconds, ``fallback_cameras`` the cameras replaced by black frames
+# and ``dropped`` the number of panoramas discarded so far for slow consumers.
+# ``panorama`` and the views carry the set's ``FrameMetadata``.
+StitchedFrame = namedtuple('StitchedFrame', ['index', 'panorama', 'frames', 'timestamp', 'capture_times',
+                                             'latency', 'fallback_cameras', 'quality_tier', 'views', 'dropped'])
+
+FALLBACK_FRAME_SHAPE = (480, 640, 3)
+
+
+class StitchingSession:
+    """
+    Stitching without Qt: owns the capture sources, a reader thread per
+    camera and a stitch thread, and hands out ``StitchedFrame``s through a
+    blocking iterator (``for frame in session``) or an asynchronous one
+    (``async for frame in session``).
+
+    ``sources`` are capture specs (see ``capture_sources``) or already
+    opened captures; the session releases only the ones it opened. At most
+    ``buffer_size`` panoramas wait for the consumer: with ``overflow='drop'``
+    the oldest is discarded, as a live viewer would, with ``'block'`` the
+    stitch thread waits for the consumer. With ``lockstep`` the stitch
+    thread reads every source itself once per panorama instead of stitching
+    the newest frames, so recorded sources are processed frame by frame;
+    the session then ends when no source delivers any more.
+
+    Otherwise a panorama is stitched once every camera has delivered a new
+    frame, or once the first new frame has waited ``COALESCE_FACTOR`` times
+    the slowest camera's frame interval (a camera that stalls does not hold
+    up the others), so the stitch rate follows the cameras' rate rather
+    than their sum.
+    """
+
+    OVERFLOW_CHOICES = ('drop', 'block')
+    COALESCE_FACTOR = 1.5
+
+    def __init__(self, sources, settings=None, buffer_size=2, overflow='drop', lockstep=False, target_fps=None,
+                 metrics=None, publisher=None, start_timeout=5.0):
+        if overflow not in self.OVERFLOW_CHOICES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'")
+        self.source_specs = list(sources)
+        self.settings = dict(settings or {})
+        self.buffer_size = max(1, buffer_size)
+        self.overflow = overflow
+        self.lockstep = lockstep
+        self.target_fps = target_fps
+        self.metrics = metrics if metrics is not None else StitchMetrics()
+        self.publisher = publisher  # Optional FramePublisher for out-of-process consumers
+        self.start_timeout = start_timeout
+
+        self.captures = []
+        self.owned_captures = []
+        self.stitcher = None
+        self.governor = None
+        self.pending_render_settings = {}
+        self.views = {}
+        self.error = None
+        self.dropped = 0
+        self.frame_index = 0
+        self.seen = None  # Camera sequence numbers last stitched; None until the first panorama
+
+        self.running = False
+        self.finished = False
+        self.ready = threading.Event()
+        self.threads = []
+        # Newest frame of every camera: (frame, arrival time, sequence number)
+        self.latest = []
+        self.frame_intervals = []  # Smoothed seconds between frames, per camera
+        self.capture_condition = threading.Condition()
+        # Stitched frames waiting for the consumer
+        self.buffer = deque()
+        self.condition = threading.Condition()
+        self.async_waiters = set()
+
+    def start(self, stitch_thread=True):
+        """
+        Open the sources and start the threads. Calibration runs on the
+        stitch thread; ``wait_ready`` blocks until it is done. Without
+        ``stitch_thread`` the caller runs ``calibrate`` and then
+        ``stitch_newest`` whenever it wants a panorama.
+        """
+        if self.running or self.finished:
+            return self
+        for spec in self.source_specs:
+            if isinstance(spec, (str, int)):
+                capture = open_capture_source(spec)
+                self.owned_captures.append(capture)
+            else:
+                capture = spec
+            if capture is None or not capture.isOpened():
+                logging.warning(f"Capture source {spec} could not be opened.")
+            self.captures.append(capture)
+        self.latest = [None] * len(self.captures)
+        self.frame_intervals = [None] * len(self.captures)
+        self.running = True
+        if not self.lockstep:
+            for idx, capture in enumerate(self.captures):
+                self.threads.append(threading.Thread(target=self.capture_loop, args=(idx, capture),
+                                                     name=f"capture-{idx}", daemon=True))
+        if stitch_thread:
+            self.threads.append(threading.Thread(target=self.stitch_loop, name="stitch", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait for calibration; raises its error if it failed.
+        """
+        self.ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.ready.is_set()
+
+    def close(self):
+        """
+        Stop the threads, release the sources the session opened and end
+        both iterators. Frames still buffered can be read until then.
+        """
+        self.running = False
+        with self.capture_condition:
+            self.capture_condition.notify_all()
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+        for capture in self.owned_captures:
+            capture.release()
+        self.owned_captures = []
+        self.finish()
+
+    def finish(self, error=None):
+        with self.condition:
+            if error is not None and self.error is None:
+                self.error = error
+            self.finished = True
+            self.condition.notify_all()
+        self.ready.set()
+        self.wake_async_waiters()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def update_render_settings(self, **settings):
+        """
+        Queue render-only settings (``FrameStitcher.RENDER_SETTINGS``) for
+        the next frame.
+        """
+        unknown = set(settings) - set(FrameStitcher.RENDER_SETTINGS)
+        if unknown:
+            raise ValueError(f"Not render settings: {sorted(unknown)}")
+        with self.capture_condition:
+            self.pending_render_settings.update(settings)
+
+    def add_view(self, name, pan=0.0, tilt=0.0, fov=60.0, size=(640, 360)):
+        """
+        Render the virtual PTZ view ``name`` into every ``StitchedFrame.views``.
+        """
+        with self.capture_condition:
+            self.views[name] = VirtualView(float(pan), float(tilt), float(fov), (int(size[0]), int(size[1])))
+
+    def remove_view(self, name):
+        with self.capture_condition:
+            self.views.pop(name, None)
+
+    # Capture
+
+    def capture_loop(self, idx, capture):
+        seq = 0
+        while self.running:
+            if capture is None or not capture.isOpened():
+                self.metrics.record_camera_read(idx, False, opened=False)
+                time.sleep(0.5)
+                continue
+            ok, frame = capture.read()
+            self.metrics.record_camera_read(idx, ok)
+            if not ok:
+                time.sleep(0.01)
+                continue
+            seq += 1
+            now = time.time()
+            with self.capture_condition:
+                previous = self.latest[idx]
+                if previous is not None:
+                    interval = now - previous[1]
+                    smoothed = self.frame_intervals[idx]
+                    self.frame_intervals[idx] = interval if smoothed is None else 0.9 * smoothed + 0.1 * interval
+                self.latest[idx] = (frame, now, seq)
+                self.capture_condition.notify_all()
+
+    def read_lockstep(self):
+        """
+        Read one frame from every source; ``False`` when none delivered.
+        """
+        delivered = False
+        for idx, capture in enumerate(self.captures):
+            ok, frame = (False, None)
+            if capture is not None and capture.isOpened():
+                ok, frame = capture.read()
+                self.metrics.record_camera_read(idx, ok)
+            else:
+                self.metrics.record_camera_read(idx, False, opened=False)
+            if ok:
+                previous = self.latest[idx]
+                self.latest[idx] = (frame, time.time(), previous[2] + 1 if previous else 1)
+                delivered = True
+        return delivered
+
+    def frame_set_due(self, seen):
+        """
+        Seconds until the frames newer than ``seen`` make a frame set worth
+        stitching: 0 when every camera delivered or the first new frame has
+        waited long enough, ``None`` when no camera delivered. Call with
+        ``capture_condition`` held.
+        """
+        fresh = [entry for entry, last in zip(self.latest, seen) if entry is not None and entry[2] != last]
+        if not fresh:
+            return None
+        if len(fresh) == sum(entry is not None for entry in self.latest):
+            return 0.0
+        intervals = [interval for interval in self.frame_intervals if interval is not None]
+        window = self.COALESCE_FACTOR * max(intervals) if intervals else 0.0
+        return max(0.0, min(entry[1] for entry in fresh) + window - time.time())
+
+    def wait_for_frames(self, seen, timeout):
+        """
+        Wait until the frames newer than ``seen`` are due for stitching (or,
+        before calibration, until every camera has one). Returns the newest
+        frames.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.capture_condition:
+            while self.running:
+                if not self.ready.is_set():
+                    due = 0.0 if all(entry is not None for entry in self.latest) else None
+                else:
+                    due = self.frame_set_due(seen)
+                if due == 0.0:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                wait = 0.1 if remaining is None else remaining
+                self.capture_condition.wait(wait if due is None else min(wait, due))
+            return list(self.latest)
+
+    def assemble(self, latest):
+        """
+        Frames, capture times and fallback cameras from the newest entries.
+        """
+        frames, capture_times, fallback = [], [], []
+        for idx, entry in enumerate(latest):
+            if entry is None:
+                fallback.append(idx)
+                frames.append(np.zeros(FALLBACK_FRAME_SHAPE, np.uint8))  # Black frame
+                capture_times.append(None)
+            else:
+                frames.append(entry[0])
+                capture_times.append(entry[1])
+        return frames, capture_times, fallback
+
+    # Stitching
+
+    def calibrate(self):
+        if self.lockstep:
+            self.read_lockstep()
+            latest = list(self.latest)
+        else:
+            latest = self.wait_for_frames([None] * len(self.latest), self.start_timeout)
+        frames, _, fallback = self.assemble(latest)
+        if fallback:
+            logging.warning(f"Calibrating with black fallback frames for cameras {fallback}.")
+        self.stitcher = FrameStitcher(frames, **self.settings)
+        if self.settings.get('quality_governor', False):
+            base = {key: getattr(self.stitcher, key) for key in QualityGovernor.GOVERNED_SETTINGS}
+            self.governor = QualityGovernor(base, (frames[0].shape[1], frames[0].shape[0]),
+                                            target_fps=self.target_fps or self.settings.get('target_fps', 30.0))
+            self.metrics.record_quality_tier(self.governor.tier)
+        self.ready.set()
+        logging.info(f"Stitching session calibrated with {len(frames)} cameras.")
+        return latest
+
+    def stitch_loop(self):
+        try:
+            self.calibrate()
+        except Exception as e:
+            logging.error("Error during stitching session calibration.", exc_info=True)
+            self.finish(e)
+            return
+
+        interval = 1.0 / self.target_fps if self.target_fps else 0.0
+        next_time = time.monotonic()
+        while self.running:
+            if interval:
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_time = max(next_time + interval, time.monotonic() - interval)
+            if self.seen is not None and not self.lockstep:
+                self.wait_for_frames(self.seen, 1.0)
+                if not self.running:
+                    break
+            if not self.stitch_newest():
+                logging.info("Stitching session: all sources are exhausted.")
+                break
+        self.finish()
+
+    def has_new_frames(self):
+        """
+        Whether ``stitch_newest`` has a frame set due for stitching.
+        """
+        if self.seen is None or self.lockstep:
+            return True
+        with self.capture_condition:
+            return self.frame_set_due(self.seen) == 0.0
+
+    def stitch_newest(self):
+        """
+        One stitching step: stitch and deliver the newest frames if a frame
+        set is due since the last step (the calibration frames come first).
+        In lockstep every source is read once first. Returns ``False`` when
+        the sources are exhausted. Drives the session when it was started
+        without its own stitch thread.
+        """
+        if self.lockstep and self.seen is not None:
+            if not self.read_lockstep():
+                return False
+        elif not self.has_new_frames():
+            return True
+        with self.capture_condition:
+            latest = list(self.latest)
+        self.seen = [entry[2] if entry else None for entry in latest]
+        self.metrics.record_tick()
+        result = self.stitch(*self.assemble(latest), camera_sequences=self.seen)
+        if result is not None:
+            self.deliver(result)
+        self.metrics.maybe_log_summary()
+        return True
+
+    def stitch(self, frames, capture_times, fallback, camera_sequences=None):
+        with self.capture_condition:
+            settings, self.pending_render_settings = self.pending_render_settings, {}
+            views = dict(self.views)
+        if settings:
+            if self.governor:
+                settings.update(self.governor.rebase(settings))
+            try:
+                self.stitcher.update_render_settings(**settings)
+            except Exception:
+                logging.error("Error applying render settings.", exc_info=True)
+        for name in set(self.stitcher.views) - set(views):
+            self.stitcher.remove_view(name)
+        for name, view in views.items():
+            if self.stitcher.views.get(name) != view:
+                self.stitcher.add_view(name, *view)
+
+        frames = self.stitcher.prepare_frames(frames)
+        metadata = FrameMetadata(self.frame_index + 1, capture_times, camera_sequences)
+        metadata.stitch_start = time.time()
+        start = time.perf_counter()
+        try:
+            panorama = self.stitcher.stitch_frames(frames)
+            latency = time.perf_counter() - start
+            metadata.stitch_end = time.time()
+            self.metrics.record_stitch(latency)
+        except Exception:
+            self.metrics.record_stitch(time.perf_counter() - start, ok=False)
+            self.metrics.record_dropped('stitch_error')
+            logging.error("Error during frame stitching.", exc_info=True)
+            return None
+        if panorama is None:
+            self.metrics.record_dropped('empty_result')
+            return None
+        self.metrics.record_frame_set(metadata)
+        rendered = dict(self.stitcher.render_views(frames)) if self.stitcher.views else {}
+        rendered = {name: attach_metadata(view, metadata) for name, view in rendered.items()}
+        timestamp = time.time()
+        if self.publisher:
+            self.publisher.publish(panorama, frames, timestamp)
+        self.frame_index += 1
+        panorama = attach_metadata(panorama, metadata)
+        result = StitchedFrame(self.frame_index, panorama, frames, timestamp, capture_times, latency, fallback,
+                               self.governor.tier if self.governor else 0, rendered, self.dropped)
+        if self.governor:
+            self.apply_quality_tier(latency)
+        return result
+
+    def apply_quality_tier(self, latency):
+        """
+        Feed a stitch latency to the quality governor and apply the tier it
+        chooses for the next frame; if that fails the current tier is kept.
+        """
+        tier = self.governor.tier
+        try:
+            render_settings = self.governor.record(latency)
+            if render_settings is None:
+                return
+            self.stitcher.update_render_settings(**render_settings)
+        except Exception:
+            logging.error(f"Error applying quality tier {self.governor.tier}; keeping tier {tier}.", exc_info=True)
+            self.governor.revert(tier)
+            return
+        self.metrics.record_quality_tier(self.governor.tier)
+
+    # Delivery
+
+    def deliver(self, result):
+        with self.condition:
+            if self.overflow == 'block':
+                while self.running and len(self.buffer) >= self.buffer_size:
+                    self.condition.wait(0.1)
+            if len(self.buffer) >= self.buffer_size:
+                self.buffer.popleft()
+                self.dropped += 1
+                self.metrics.record_dropped('consumer_slow')
+            self.buffer.append(result)
+            self.condition.notify_all()
+        self.wake_async_waiters()
+
+    def wake_async_waiters(self):
+        with self.condition:
+            waiters = list(self.async_waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # The consumer's loop has been closed
+
+    def take(self):
+        """
+        Next buffered frame, ``None`` if there is none yet. Raises
+        ``StopIteration`` once the session has finished and the buffer is
+        drained, or the error that ended the session.
+        """
+        with self.condition:
+            if self.buffer:
+                result = self.buffer.popleft()
+                self.condition.notify_all()
+                metadata = frame_metadata(result.panorama)
+                if metadata is not None:
+                    metadata.display_time = time.time()
+                self.metrics.record_display(metadata)
+                return result
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                raise StopIteration
+            return None
+
+    def next_frame(self, timeout=None):
+        """
+        Block until the next panorama is available; ``None`` on timeout.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            while not self.buffer and not self.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.take()
+
+    def frames(self, timeout=None):
+        """
+        Blocking generator of ``StitchedFrame``s until the session ends.
+        """
+        while True:
+            try:
+                result = self.next_frame(timeout)
+            except StopIteration:
+                return
+            if result is None:
+                return
+            yield result
+
+    def __iter__(self):
+        return self.frames()
+
+    async def stream(self):
+        """
+        Asynchronous generator of ``StitchedFrame``s. Waiting never blocks
+        the event loop, and cancelling the consumer loses no frame.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self.condition:
+            self.async_waiters.add(waiter)
+        try:
+            while True:
+                event.clear()
+                try:
+                    result = self.take()
+                except StopIteration:
+                    return
+                if result is None:
+                    await event.wait()
+                    continue
+                yield result
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
+
+    def __aiter__(self):
+        return self.stream()
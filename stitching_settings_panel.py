@@ -1,9 +1,14 @@
+from PyQt5.QtCore import pyqtSignal, QTimer
 from PyQt5.QtWidgets import QWidget, QFormLayout, QSpinBox, QCheckBox, QDoubleSpinBox, QComboBox, QLabel
 
 class StitchingSettingsPanel(QWidget):
+    render_settings_changed = pyqtSignal(dict)  # Render-only settings, applied without recalibrating
+    COMPOSE_MEGAPIX_DELAY_MS = 400
+
     def __init__(self):
         super().__init__()
         self.init_ui()
+        self.connect_render_settings()
 
     def init_ui(self):
         layout = QFormLayout()
@@ -55,7 +60,8 @@ class StitchingSettingsPanel(QWidget):
             'cylindrical', 'plane', 'affine', 'spherical', 'fisheye', 'stereographic',
             'compressedPlaneA2B1', 'compressedPlaneA1.5B1', 'compressedPlanePortraitA2B1',
             'compressedPlanePortraitA1.5B1', 'paniniA2B1', 'paniniA1.5B1',
-            'paniniPortraitA2B1', 'paniniPortraitA1.5B1', 'mercator', 'transverseMercator'
+            'paniniPortraitA2B1', 'paniniPortraitA1.5B1', 'mercator', 'transverseMercator',
+            'equirectangular'
         ])
 
         # Seam finding method
@@ -82,12 +88,48 @@ class StitchingSettingsPanel(QWidget):
         self.blend_strength.setSingleStep(1)
         self.blend_strength.setValue(5)
 
+        # Capture format negotiation
+        self.capture_format = QComboBox()
+        self.capture_format.addItems(['auto', 'MJPG', 'YUYV', 'off'])
+
+        # Compositing implementation
+        self.compositor = QComboBox()
+        self.compositor.addItems(['opencv', 'fixed_point', 'strips', 'incremental'])
+
+        # Step render quality down when stitching cannot keep up
+        self.quality_governor = QCheckBox("Hold frame rate")
+        self.quality_governor.setChecked(False)
+
         # Output
         self.output = QLabel("Output: result.jpg")
 
         # Timelapse option
         self.timelapse = QCheckBox("Output timelapse frames")
 
+        # Rig topology: restricts matching to physically adjacent cameras
+        self.rig_topology = QComboBox()
+        self.rig_topology.addItems(['all', 'linear', 'ring', 'grid'])
+        self.grid_columns = QSpinBox()
+        self.grid_columns.setRange(1, 16)
+        self.grid_columns.setValue(3)
+
+        # Large rigs: calibrate groups of cameras independently, 0 disables
+        self.calibration_group_size = QSpinBox()
+        self.calibration_group_size.setRange(0, 12)
+        self.calibration_group_size.setValue(0)
+
+        # Calibrate at low resolution first, refining only if needed
+        self.coarse_to_fine = QCheckBox("Coarse-to-fine calibration")
+        self.coarse_to_fine.setChecked(False)
+
+        # Stitch luma at full and chroma at half resolution
+        self.yuv = QCheckBox("Stitch in YUV")
+        self.yuv.setChecked(False)
+
+        # Free calibration-only buffers once stitching starts
+        self.lean = QCheckBox("Lean memory")
+        self.lean.setChecked(False)
+
         # Range width
         self.rangewidth = QSpinBox()
         self.rangewidth.setRange(-1, 100)
@@ -101,6 +143,10 @@ class StitchingSettingsPanel(QWidget):
         # layout.addRow("Estimator:", self.estimator)
         # layout.addRow("Match Confidence:", self.match_conf)
         layout.addRow("Confidence Threshold:", self.conf_thresh)
+        layout.addRow("Rig Topology:", self.rig_topology)
+        layout.addRow("Grid Columns:", self.grid_columns)
+        layout.addRow("Calibration:", self.coarse_to_fine)
+        layout.addRow("Calibration Group Size:", self.calibration_group_size)
         # layout.addRow("Bundle Adjuster:", self.ba)
         # layout.addRow("Refinement Mask:", self.ba_refine_mask)
         # layout.addRow("Wave Correction:", self.wave_correct)
@@ -111,12 +157,54 @@ class StitchingSettingsPanel(QWidget):
         # layout.addRow("Exposure Compensation Method:", self.expos_comp)
         layout.addRow("Blending Method:", self.blend)
         layout.addRow("Blending Strength:", self.blend_strength)
+        layout.addRow("Compositor:", self.compositor)
+        layout.addRow("Quality Governor:", self.quality_governor)
+        layout.addRow("Capture Format:", self.capture_format)
+        layout.addRow("Memory:", self.lean)
+        layout.addRow("Color:", self.yuv)
         # layout.addRow("Output:", self.output)
         # layout.addRow("Timelapse:", self.timelapse)
         # layout.addRow("Range Width:", self.rangewidth)
 
         self.setLayout(layout)
 
+    def connect_render_settings(self):
+        """
+        Emit ``render_settings_changed`` whenever a widget that only affects
+        composition changes. Everything else needs "Start Stitching" again.
+        """
+        self.warp.currentTextChanged.connect(self.emit_render_settings)
+        # Every spin-box step would select (and cache) another compose plan; emit once the value settles
+        self.compose_megapix_timer = QTimer(self)
+        self.compose_megapix_timer.setSingleShot(True)
+        self.compose_megapix_timer.setInterval(self.COMPOSE_MEGAPIX_DELAY_MS)
+        self.compose_megapix_timer.timeout.connect(self.emit_render_settings)
+        self.compose_megapix.valueChanged.connect(lambda *_: self.compose_megapix_timer.start())
+        self.expos_comp.currentTextChanged.connect(self.emit_render_settings)
+        self.blend.currentTextChanged.connect(self.emit_render_settings)
+        self.blend_strength.valueChanged.connect(self.emit_render_settings)
+        # Connected first, so the blend type is valid by the time the change is emitted
+        self.compositor.currentTextChanged.connect(self.restrict_blend_types)
+        self.compositor.currentTextChanged.connect(self.emit_render_settings)
+
+    def restrict_blend_types(self, compositor):
+        """
+        Multi-band blending is not available with the strip and incremental
+        compositors; fall back to feather when one of them is selected.
+        """
+        feather_only = compositor in ('strips', 'incremental')
+        self.blend.model().item(self.blend.findText('multiband')).setEnabled(not feather_only)
+        if feather_only and self.blend.currentText() == 'multiband':
+            self.blend.setCurrentText('feather')
+
+    def get_render_settings(self):
+        settings = self.get_settings()
+        return {key: settings[key] for key in ('warp_type', 'compose_megapix', 'expos_comp', 'blend_type',
+                                               'blend_strength', 'compositor')}
+
+    def emit_render_settings(self, *args):
+        self.render_settings_changed.emit(self.get_render_settings())
+
     def get_settings(self):
         settings = {
             'try_cuda': self.try_cuda.isChecked(),
@@ -136,9 +224,18 @@ class StitchingSettingsPanel(QWidget):
             'expos_comp': self.expos_comp.currentText(),
             'blend_type': self.blend.currentText(),
             'blend_strength': self.blend_strength.value(),
+            'compositor': self.compositor.currentText(),
+            'capture_format': self.capture_format.currentText(),
             'output': self.output.text().replace('Output: ', ''),
             'timelapse': self.timelapse.isChecked(),
-            'rangewidth': self.rangewidth.value()
+            'rangewidth': self.rangewidth.value(),
+            'rig_topology': self.rig_topology.currentText(),
+            'grid_columns': self.grid_columns.value(),
+            'coarse_to_fine': self.coarse_to_fine.isChecked(),
+            'calibration_group_size': self.calibration_group_size.value(),
+            'quality_governor': self.quality_governor.isChecked(),
+            'lean': self.lean.isChecked(),
+            'yuv': self.yuv.isChecked()
         }
         return settings
 
@@ -0,0 +1,46 @@
+# tests/conftest.py
+import glob
+import os
+import sys
+
+import cv2 as cv
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from soak_harness import synthetic_rig  # noqa: E402
+
+
+def read_rig(directory, num_cameras, num_frames):
+    cameras = [sorted(glob.glob(os.path.join(directory, f"cam{idx}", '*.png'))) for idx in range(num_cameras)]
+    return [[cv.imread(paths[k]) for paths in cameras] for k in range(num_frames)]
+
+
+@pytest.fixture(scope='session')
+def rig_directory(tmp_path_factory):
+    """
+    Directory of a small synthetic 3-camera rig: ``cam<i>/`` holds the 4
+    frames of camera ``i``.
+    """
+    directory = str(tmp_path_factory.mktemp('rig'))
+    synthetic_rig(directory, num_cameras=3, width=400, height=300, num_frames=4)
+    return directory
+
+
+@pytest.fixture(scope='session')
+def rig_frames(rig_directory):
+    """
+    Frame sets of the synthetic 3-camera rig, one list of BGR frames per
+    time step.
+    """
+    return read_rig(rig_directory, 3, 4)
+
+
+@pytest.fixture(scope='session')
+def large_rig_frames(tmp_path_factory):
+    """
+    One frame set of a synthetic 8-camera rig, 35 degrees between cameras.
+    """
+    directory = str(tmp_path_factory.mktemp('large-rig'))
+    synthetic_rig(directory, num_cameras=8, width=400, height=300, num_frames=1)
+    return read_rig(directory, 8, 1)[0]
@@ -0,0 +1,92 @@
+# tests/test_calibration.py
+import numpy as np
+import pytest
+
+from frame_stitcher import FrameStitcher
+
+
+def relative_angles(cameras):
+    """
+    Rotation angle in degrees between each pair of adjacent cameras.
+    """
+    angles = []
+    for a, b in zip(cameras, cameras[1:]):
+        relative = np.asarray(a.R, np.float64).T @ np.asarray(b.R, np.float64)
+        angles.append(np.degrees(np.arccos(np.clip((np.trace(relative) - 1) / 2, -1, 1))))
+    return np.array(angles)
+
+
+def relative_rotations(cameras):
+    return [np.asarray(a.R, np.float64).T @ np.asarray(b.R, np.float64) for a, b in zip(cameras, cameras[1:])]
+
+
+@pytest.fixture(scope='module')
+def flat(large_rig_frames):
+    return FrameStitcher(large_rig_frames, rig_topology='linear', compositor='fixed_point')
+
+
+def test_flat_calibration_recovers_the_rig(flat):
+    assert len(flat.cameras) == 8
+    np.testing.assert_allclose(relative_angles(flat.cameras), 35.0, atol=1.0)
+
+
+def test_group_calibration_matches_flat(flat, large_rig_frames):
+    grouped = FrameStitcher(large_rig_frames, rig_topology='linear', calibration_group_size=4,
+                            compositor='fixed_point')
+    assert grouped.camera_groups == [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7]]
+    for flat_rel, grouped_rel in zip(relative_rotations(flat.cameras), relative_rotations(grouped.cameras)):
+        difference = flat_rel.T @ grouped_rel
+        angle = np.degrees(np.arccos(np.clip((np.trace(difference) - 1) / 2, -1, 1)))
+        assert angle < 0.1
+    flat_focals = np.array([cam.focal for cam in flat.cameras])
+    grouped_focals = np.array([cam.focal for cam in grouped.cameras])
+    np.testing.assert_allclose(grouped_focals / np.median(grouped_focals), flat_focals / np.median(flat_focals),
+                               rtol=0.01)
+    panorama = grouped.stitch_frames(large_rig_frames)
+    assert panorama is not None and panorama.shape[1] > 4 * large_rig_frames[0].shape[1]
+
+
+def test_group_calibration_warns_about_coarse_to_fine(large_rig_frames, caplog):
+    FrameStitcher(large_rig_frames, rig_topology='linear', calibration_group_size=4, coarse_to_fine=True,
+                  compositor='fixed_point')
+    assert any('Coarse-to-fine' in record.getMessage() for record in caplog.records)
+
+
+def full_resolution_focals(stitcher):
+    return np.array([cam.focal / stitcher.work_scale for cam in stitcher.cameras])
+
+
+@pytest.fixture(scope='module')
+def single_level(rig_frames):
+    return FrameStitcher(rig_frames[0], compositor='fixed_point', work_megapix=0.12)
+
+
+def coarse_to_fine(frames, **settings):
+    return FrameStitcher(frames, compositor='fixed_point', work_megapix=0.12, coarse_to_fine=True,
+                         calibration_levels=(0.03, 0.06), **settings)
+
+
+def test_coarse_to_fine_stops_at_the_first_good_level(rig_frames, single_level):
+    stitcher = coarse_to_fine(rig_frames[0])
+    assert [(level['work_megapix'], level['ok']) for level in stitcher.calibration_report] == [(0.03, True)]
+    assert stitcher.work_scale < single_level.work_scale
+    np.testing.assert_allclose(full_resolution_focals(stitcher), full_resolution_focals(single_level), rtol=0.01)
+
+
+@pytest.mark.parametrize('strict', [{'max_residual': 0.0}, {'min_match_confidence': 100.0}])
+def test_coarse_to_fine_seeds_every_level_until_the_last(rig_frames, single_level, monkeypatch, strict):
+    estimates = []
+    estimate_cameras = FrameStitcher.estimate_cameras
+
+    def counting(self, features, p):
+        estimates.append(len(features))
+        return estimate_cameras(self, features, p)
+
+    monkeypatch.setattr(FrameStitcher, 'estimate_cameras', counting)
+    stitcher = coarse_to_fine(rig_frames[0], **strict)
+    report = stitcher.calibration_report
+    assert [level['work_megapix'] for level in report] == [0.03, 0.06, 0.12]
+    assert not any(level['ok'] for level in report)
+    assert estimates == [3]  # Only the coarsest level estimates from scratch
+    assert stitcher.work_scale == single_level.work_scale
+    np.testing.assert_allclose(full_resolution_focals(stitcher), full_resolution_focals(single_level), rtol=0.01)
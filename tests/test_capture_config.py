@@ -0,0 +1,120 @@
+# tests/test_capture_config.py
+from types import SimpleNamespace
+
+import cv2
+import pytest
+
+import capture_config
+from capture_config import (CaptureMode, capture_mode_changes, choose_capture_mode, fourcc_code, fourcc_name,
+                            parse_v4l2_formats, plan_capture_modes)
+
+# ``v4l2-ctl --list-formats-ext`` of a typical USB 2.0 webcam: MJPG at full
+# rate in every size, uncompressed YUYV only at full rate up to VGA
+V4L2_FORMATS = """\
+ioctl: VIDIOC_ENUM_FMT
+	Type: Video Capture
+
+	[0]: 'MJPG' (Motion-JPEG, compressed)
+		Size: Discrete 1920x1080
+			Interval: Discrete 0.033s (30.000 fps)
+		Size: Discrete 1280x720
+			Interval: Discrete 0.033s (30.000 fps)
+		Size: Discrete 640x480
+			Interval: Discrete 0.033s (30.000 fps)
+	[1]: 'YUYV' (YUYV 4:2:2)
+		Size: Discrete 1920x1080
+			Interval: Discrete 0.200s (5.000 fps)
+		Size: Discrete 1280x720
+			Interval: Discrete 0.100s (10.000 fps)
+		Size: Discrete 640x480
+			Interval: Discrete 0.033s (30.000 fps)
+			Interval: Discrete 0.067s (15.000 fps)
+		Size: Discrete 320x240
+			Interval: Discrete 0.033s (30.000 fps)
+"""
+MODES = parse_v4l2_formats(V4L2_FORMATS)
+VGA = CaptureMode('YUYV', 640, 480, 30.0)
+
+
+class FakeCapture:
+    def __init__(self, mode=VGA, convert_rgb=1):
+        self.props = {
+            cv2.CAP_PROP_FOURCC: float(fourcc_code(mode.fourcc)),
+            cv2.CAP_PROP_FRAME_WIDTH: float(mode.width),
+            cv2.CAP_PROP_FRAME_HEIGHT: float(mode.height),
+            cv2.CAP_PROP_FPS: float(mode.fps),
+            cv2.CAP_PROP_CONVERT_RGB: float(convert_rgb),
+        }
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return self.props.get(prop, 0.0)
+
+    def set(self, prop, value):
+        self.props[prop] = float(value)
+        return True
+
+
+@pytest.fixture
+def fake_v4l2_ctl(monkeypatch):
+    monkeypatch.setattr(capture_config.shutil, 'which', lambda name: '/usr/bin/' + name)
+    monkeypatch.setattr(capture_config.subprocess, 'run',
+                        lambda *args, **kwargs: SimpleNamespace(stdout=V4L2_FORMATS))
+
+
+def test_parse_v4l2_formats():
+    assert len(MODES) == 8
+    assert MODES[0] == CaptureMode('MJPG', 1920, 1080, 30.0)
+    assert CaptureMode('YUYV', 640, 480, 15.0) in MODES
+    assert parse_v4l2_formats("") == []
+
+
+def test_fourcc_names_round_trip():
+    assert fourcc_name(fourcc_code('MJPG')) == 'MJPG'
+
+
+@pytest.mark.parametrize('compose_megapix, target_fps, num_cameras, preferred, current, expected', [
+    # Smallest mode covering the compose resolution; YUYV while the bus carries it
+    (0.3, 30.0, 1, None, None, CaptureMode('YUYV', 640, 480, 30.0)),
+    # Two uncompressed VGA streams exceed one USB 2.0 bus
+    (0.3, 30.0, 2, None, None, CaptureMode('MJPG', 640, 480, 30.0)),
+    # YUYV 720p only runs at 10 fps
+    (0.5, 30.0, 1, None, None, CaptureMode('MJPG', 1280, 720, 30.0)),
+    (0.5, 10.0, 1, None, None, CaptureMode('YUYV', 1280, 720, 10.0)),
+    (0.5, 10.0, 3, None, None, CaptureMode('MJPG', 1280, 720, 30.0)),
+    # Nothing covers it: the largest mode at the rate
+    (5.0, 30.0, 1, None, None, CaptureMode('MJPG', 1920, 1080, 30.0)),
+    # No compose resolution: keep the current size, else the largest
+    (-1, 30.0, 1, None, VGA, CaptureMode('YUYV', 640, 480, 30.0)),
+    (-1, 30.0, 1, None, None, CaptureMode('MJPG', 1920, 1080, 30.0)),
+    # A preferred format limits the choice
+    (0.5, 30.0, 1, 'YUYV', None, CaptureMode('YUYV', 640, 480, 30.0)),
+    (0.1, 30.0, 1, 'MJPG', None, CaptureMode('MJPG', 640, 480, 30.0)),
+])
+def test_choose_capture_mode(compose_megapix, target_fps, num_cameras, preferred, current, expected):
+    assert choose_capture_mode(MODES, compose_megapix, target_fps, num_cameras, preferred_fourcc=preferred,
+                               current=current) == expected
+
+
+def test_choose_capture_mode_without_modes():
+    assert choose_capture_mode([], 0.3) is None
+
+
+def test_plan_capture_modes_from_v4l2_ctl(fake_v4l2_ctl):
+    captures = [FakeCapture(), FakeCapture(), None]
+    plans = plan_capture_modes([0, 1, 2], captures, compose_megapix=0.3, raw_yuv=True)
+    # Three cameras on one bus: MJPG, which is always converted
+    assert plans == [(CaptureMode('MJPG', 640, 480, 30.0), True)] * 2 + [None]
+    assert capture_mode_changes(captures, plans) == ['format', 'format', None]
+
+    plans = plan_capture_modes([0], captures[:1], compose_megapix=0.3, raw_yuv=True)
+    assert plans == [(VGA, False)]  # Raw YUYV for YUV stitching
+    assert capture_mode_changes(captures[:1], plans) == ['format']
+    assert capture_mode_changes(captures[:1], [(VGA, True)]) == [None]
+    assert capture_mode_changes(captures[:1], [(VGA._replace(fps=15.0), True)]) == ['rate']
+
+
+def test_virtual_cameras_are_not_planned(fake_v4l2_ctl):
+    assert plan_capture_modes([None], [FakeCapture()], compose_megapix=0.3) == [None]
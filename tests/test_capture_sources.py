@@ -0,0 +1,101 @@
+# tests/test_capture_sources.py
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from capture_sources import ReplaySource, expand_source_specs, open_capture_source, parse_source_spec
+
+
+@pytest.fixture
+def camera_directory(rig_directory):
+    return os.path.join(rig_directory, 'cam0')
+
+
+def replay(source, reads, frames):
+    """
+    What ``reads`` reads of ``source`` return: the index of each frame read
+    (counting on when looping), ``None`` for failed reads.
+    """
+    results = []
+    for _ in range(reads):
+        ok, frame = source.read()
+        index = source.position - 1
+        if ok:
+            np.testing.assert_array_equal(frame, frames[index % len(frames)])
+        results.append(index if ok else None)
+    return results
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('0', ('device', '0', {})),
+    ('device:2', ('device', '2', {})),
+    ('/data/clip.mp4', ('replay', '/data/clip.mp4', {})),
+    ('replay:/data/cam0?fps=15&jitter=0.004', ('replay', '/data/cam0', {'fps': '15', 'jitter': '0.004'})),
+    (' replay:clip.mp4?count=2 ', ('replay', 'clip.mp4', {'count': '2'})),
+])
+def test_parse_source_spec(spec, expected):
+    assert parse_source_spec(spec) == expected
+
+
+def test_expand_source_specs_gives_each_camera_its_seed():
+    assert expand_source_specs("replay:/rig/cam{index}?count=3&seed=5&fps=30; 1 ;") == [
+        "replay:/rig/cam0?fps=30&seed=5",
+        "replay:/rig/cam1?fps=30&seed=6",
+        "replay:/rig/cam2?fps=30&seed=7",
+        "device:1",
+    ]
+    assert expand_source_specs("replay:/rig/cam{index}?count=2") == [
+        "replay:/rig/cam0?seed=0", "replay:/rig/cam1?seed=1"]
+
+
+def test_replays_a_frames_directory(camera_directory, rig_frames):
+    frames = [frame_set[0] for frame_set in rig_frames]
+    source = open_capture_source(f"replay:{camera_directory}?realtime=0&loop=0&fps=15")
+    assert isinstance(source, ReplaySource) and source.isOpened()
+    assert (source.get(cv2.CAP_PROP_FRAME_WIDTH), source.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (400.0, 300.0)
+    assert source.get(cv2.CAP_PROP_FPS) == 15.0
+    assert source.get(cv2.CAP_PROP_FRAME_COUNT) == 4.0
+    assert replay(source, 5, frames) == [0, 1, 2, 3, None]
+
+    assert source.set(cv2.CAP_PROP_POS_FRAMES, 2)
+    assert replay(source, 2, frames) == [2, 3]
+    assert not source.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    source.release()
+    assert not source.isOpened() and source.read() == (False, None)
+
+
+def test_looping_and_cropping(camera_directory, rig_frames):
+    frames = [frame_set[0] for frame_set in rig_frames]
+    source = open_capture_source(f"replay:{camera_directory}?realtime=0&preload=1&crop=10,20,100,50")
+    ok, frame = source.read()
+    assert ok and frame.shape == (50, 100, 3)
+    np.testing.assert_array_equal(frame, frames[0][20:70, 10:110])
+    for _ in range(3):
+        source.read()
+    ok, frame = source.read()
+    np.testing.assert_array_equal(frame, frames[0][20:70, 10:110])
+
+
+def test_injected_drops_and_failures_repeat_with_the_seed(camera_directory, rig_frames):
+    frames = [frame_set[0] for frame_set in rig_frames]
+    spec = f"replay:{camera_directory}?realtime=0&preload=1&drop_rate=0.3&fail_rate=0.2&seed=%d"
+    source = open_capture_source(spec % 1)
+    first = replay(source, 200, frames)
+    assert replay(open_capture_source(spec % 1), 200, frames) == first
+    assert replay(open_capture_source(spec % 2), 200, frames) != first
+
+    # Dropped frames never arrive, so 200 reads get further than 200 frames
+    assert 240 < source.position < 340
+    assert 0.1 < first.count(None) / len(first) < 0.3
+
+
+def test_realtime_source_paces_reads(camera_directory):
+    source = ReplaySource(camera_directory, fps=100.0, preload=True)
+    start = source.started
+    for _ in range(5):
+        assert source.read()[0]
+    assert source.position == 5
+    # Frame 4 arrives 40 ms after the start
+    assert source.frame_events(4)[0] == pytest.approx(start + 0.04)
@@ -0,0 +1,139 @@
+# tests/test_compositors.py
+import cv2 as cv
+import numpy as np
+import pytest
+
+from compositors import FixedPointCompositor, MultiBandCompositor, YuvCompositor
+from frame_stitcher import FrameStitcher
+from viewport import VirtualView, ptz_view_maps
+from yuv_frame import YuvFrame
+
+
+@pytest.fixture(scope='module')
+def stitcher(rig_frames):
+    return FrameStitcher(rig_frames[0], compositor='fixed_point')
+
+
+def compose(stitcher, frames, **settings):
+    stitcher.update_render_settings(**settings)
+    return stitcher.stitch_frames(frames)
+
+
+def compose_unpartitioned(compositor, frames):
+    """
+    The fixed-point compose without the region partition: the whole canvas
+    as one blend rectangle, every camera weighted.
+    """
+    plan = compositor.plan
+    _, _, canvas_w, canvas_h = plan.dst_roi
+    out = np.zeros(plan.pixel_shape(canvas_h, canvas_w), np.uint8)
+    compositor.compose_rects(frames, out, [], [(0, 0, canvas_w, canvas_h, list(range(plan.num_images)))], {})
+    return out
+
+
+def test_partition_matches_unpartitioned(stitcher, rig_frames):
+    panorama = compose(stitcher, rig_frames[1], compositor='fixed_point')
+    assert stitcher.compose_plan.partition.copy_rects
+    np.testing.assert_array_equal(panorama, compose_unpartitioned(stitcher.compositor, rig_frames[1]))
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_strips_match_fixed_point(stitcher, rig_frames, threads):
+    expected = compose(stitcher, rig_frames[1], compositor='fixed_point')
+    stitcher.compose_threads = threads
+    panorama = compose(stitcher, rig_frames[1], compositor='strips')
+    assert len(stitcher.compositor.strips) > 1
+    np.testing.assert_array_equal(panorama, expected)
+
+
+def test_viewport_matches_panorama_crop(stitcher, rig_frames):
+    panorama = compose(stitcher, rig_frames[1], compositor='fixed_point')
+    height, width = panorama.shape[:2]
+    # Spans a camera overlap
+    x, y, w, h = width // 4, height // 8, width // 2, height * 3 // 4
+    viewport = stitcher.render_viewport(rig_frames[1], (x, y, w, h))
+    np.testing.assert_array_equal(viewport, panorama[y:y + h, x:x + w])
+
+
+def test_ptz_view_positions_do_not_blend_the_sentinel(stitcher, rig_frames):
+    compose(stitcher, rig_frames[0], compositor='fixed_point')
+    plan = stitcher.compose_plan
+    # Wide enough to look away from every camera on one side
+    canvas_x, canvas_y, _ = ptz_view_maps(plan, VirtualView(130.0, 0.0, 150.0, (320, 180)))
+    # Cells without a canvas position hold -1e5 on the coarse grid
+    assert canvas_x.min() > -1e4 and canvas_y.min() > -1e4
+
+
+def test_multiband_blends_only_the_seam_bands(rig_frames):
+    stitcher = FrameStitcher(rig_frames[0], compositor='fixed_point', blend_type='multiband', max_bands=2)
+    panorama = stitcher.stitch_frames(rig_frames[1])
+    compositor = stitcher.compositor
+    assert isinstance(compositor, MultiBandCompositor)
+    outside = np.ones(panorama.shape[:2], bool)
+    for x, y, w, h in (band['rect'] for band in compositor.bands):
+        outside[y:y + h, x:x + w] = False
+    covered = compositor.owner >= 0
+    assert outside[covered].any() and not outside[covered].all()
+
+    # Away from the seams the hard-seam fixed-point composite is exact
+    hard_seam = FixedPointCompositor.compose(compositor, rig_frames[1])
+    np.testing.assert_array_equal(panorama[outside], hard_seam[outside])
+    assert (panorama[~outside] != hard_seam[~outside]).any()
+
+    # Across the seams the blend stays close to feathering
+    stitcher.update_render_settings(blend_type='feather')
+    feathered = stitcher.stitch_frames(rig_frames[1]).astype(np.int16)
+    difference = np.abs(panorama.astype(np.int16) - feathered)
+    assert difference[~outside & covered].mean() < 4
+    assert difference[outside & covered].mean() < 1
+
+
+def test_incremental_matches_full_compose(stitcher, rig_frames):
+    compose(stitcher, rig_frames[0], compositor='incremental')
+    compositor = stitcher.compositor
+    changed = [frame.copy() for frame in rig_frames[0]]
+    changed[1][100:160, 150:230] = (0, 255, 255)
+    for frames in (rig_frames[0], changed, rig_frames[0], rig_frames[2]):
+        panorama = stitcher.stitch_frames(frames)
+        assert stitcher.compositor is compositor
+        np.testing.assert_array_equal(panorama, compose_unpartitioned(compositor, frames))
+        if frames is changed:
+            assert 0 < compositor.dirty_fraction < compositor.full_fraction
+
+
+@pytest.mark.parametrize('compositor', ['strips', 'incremental'])
+def test_multiband_rejected_with_feather_only_compositors(stitcher, compositor):
+    stitcher.update_render_settings(compositor='fixed_point', blend_type='feather')
+    with pytest.raises(ValueError):
+        stitcher.update_render_settings(compositor=compositor, blend_type='multiband')
+    stitcher.update_render_settings(compositor=compositor)
+    with pytest.raises(ValueError):
+        stitcher.update_render_settings(blend_type='multiband')
+    assert stitcher.blend_type == 'feather'
+
+
+@pytest.fixture(scope='module')
+def yuv_stitcher(rig_frames):
+    return FrameStitcher(rig_frames[0], compositor='fixed_point', yuv=True)
+
+
+def test_yuv_panorama_is_within_the_nv12_round_trip_limit(stitcher, yuv_stitcher, rig_frames):
+    expected = compose(stitcher, rig_frames[1], compositor='fixed_point')
+    panorama = yuv_stitcher.stitch_frames(rig_frames[1])
+    assert isinstance(yuv_stitcher.compositor, YuvCompositor)
+    assert isinstance(panorama, YuvFrame) and panorama.shape == expected.shape
+    # Stitching in NV12 loses no more than converting the BGR panorama to NV12 and back
+    round_trip = YuvFrame.from_bgr(expected).to_bgr()
+    assert cv.PSNR(panorama.to_bgr(), expected) > cv.PSNR(round_trip, expected) - 0.5
+
+
+def test_yuv_uncovered_canvas_is_black(yuv_stitcher, rig_frames):
+    panorama = yuv_stitcher.stitch_frames(rig_frames[1])
+    uncovered = yuv_stitcher.compositor.uncovered > 0
+    assert uncovered.any()
+    assert (panorama.uv[uncovered] == YuvCompositor.NEUTRAL_CHROMA).all()
+    # Away from coverage edges, where chroma cells are shared with covered pixels
+    inner = cv.erode(yuv_stitcher.compositor.uncovered, np.ones((3, 3), np.uint8))
+    inner = cv.resize(inner, (panorama.y.shape[1], panorama.y.shape[0]), interpolation=cv.INTER_NEAREST) > 0
+    assert inner.any()
+    assert (panorama.to_bgr()[inner] == 0).all()
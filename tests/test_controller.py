@@ -0,0 +1,105 @@
+# tests/test_controller.py
+import os
+from collections import OrderedDict
+from unittest import mock
+
+import cv2 as cv
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+
+import controller  # noqa: E402
+from capture_config import CaptureMode, fourcc_code  # noqa: E402
+from frame_stitcher import StitchingError  # noqa: E402
+from stitcher import CalibrationResult  # noqa: E402
+
+
+class FakeCapture:
+    def __init__(self, fourcc='MJPG', width=640, height=480, fps=30.0, convert_rgb=1):
+        self.props = {cv.CAP_PROP_FOURCC: fourcc_code(fourcc), cv.CAP_PROP_FRAME_WIDTH: width,
+                      cv.CAP_PROP_FRAME_HEIGHT: height, cv.CAP_PROP_FPS: fps, cv.CAP_PROP_CONVERT_RGB: convert_rgb}
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return self.props.get(prop, 0)
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+
+class FakeStitcher:
+    def __init__(self):
+        self.is_running = True
+
+    def stop(self):
+        self.is_running = False
+
+
+class FakeSignal:
+    def connect(self, slot):
+        pass
+
+
+class FakeWorker:
+    def __init__(self, frames, settings, fallback_cameras):
+        self.progress = self.calibrated = self.finished = FakeSignal()
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+
+@pytest.fixture
+def main_controller(monkeypatch):
+    QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    monkeypatch.setattr(controller, 'METRICS_PORT', 0)
+    monkeypatch.setattr(controller, 'FRAME_RING_PATH', None)
+    monkeypatch.setattr(controller, 'QMessageBox', mock.MagicMock())
+    monkeypatch.setattr(controller, 'CalibrationWorker', FakeWorker)
+    monkeypatch.setattr(controller, 'grab_frames', lambda feeds, metrics: ([], []))
+    window = mock.MagicMock()
+    window.stitching_settings_panel.get_settings.return_value = {'capture_format': 'auto', 'compose_megapix': -1}
+    main = controller.MainController(window)
+    main.stitcher = FakeStitcher()
+    return main
+
+
+def set_cameras(main, captures, plans):
+    widget = main.main_window.video_display_widget
+    widget.cameras = [mock.MagicMock(capture=capture) for capture in captures]
+    widget.plan_capture_modes.return_value = plans
+
+
+def test_unchanged_capture_modes_keep_the_stitcher_running(main_controller):
+    captures = [FakeCapture(), FakeCapture()]
+    set_cameras(main_controller, captures, [(CaptureMode('MJPG', 640, 480, 30.0), True)] * 2)
+    old = main_controller.stitcher
+    main_controller.start_stitching()
+    assert main_controller.calibration_worker.started
+    assert main_controller.stitcher is old and old.is_running
+    main_controller.main_window.video_display_widget.apply_capture_modes.assert_not_called()
+
+
+def test_changed_frame_size_stops_the_stitcher_first(main_controller):
+    captures = [FakeCapture(), FakeCapture()]
+    set_cameras(main_controller, captures, [(CaptureMode('MJPG', 1280, 720, 30.0), True), None])
+    old = main_controller.stitcher
+    main_controller.start_stitching()
+    assert not old.is_running and main_controller.stitcher is None
+    main_controller.main_window.video_display_widget.apply_capture_modes.assert_called_once()
+
+
+def test_failed_calibration_keeps_the_old_stitcher(main_controller):
+    set_cameras(main_controller, [FakeCapture()], [(CaptureMode('MJPG', 640, 480, 30.0), True)])
+    old = main_controller.stitcher
+    main_controller.start_stitching()
+    worker = main_controller.calibration_worker
+    main_controller.sender = lambda: worker
+    error = StitchingError("Homography estimation failed", stage='estimation')
+    main_controller.on_calibrated(CalibrationResult(None, None, error, OrderedDict(), [], 0.1))
+    assert main_controller.stitcher is old and old.is_running
+    assert main_controller.calibration_worker is None
@@ -0,0 +1,40 @@
+# tests/test_frame_ring.py
+import numpy as np
+
+from frame_ring import PAGE, FrameRingReader, FrameRingWriter
+
+
+def frame(height, width, value):
+    return np.full((height, width, 3), value, np.uint8)
+
+
+def test_pixel_data_is_page_aligned(tmp_path):
+    writer = FrameRingWriter(str(tmp_path / 'ring'), slot_count=3, slot_bytes=1000)
+    reader = FrameRingReader(writer.path)
+    for index in range(3):
+        _, data = reader._slot(index)
+        assert (data.ctypes.data - reader.mm.ctypes.data) % PAGE == 0
+    writer.close()
+
+
+def test_reader_follows_replacement_and_stops_after_close(tmp_path):
+    path = str(tmp_path / 'ring')
+    writer = FrameRingWriter(path, slot_count=4)
+    writer.write(frame(4, 4, 1))
+    reader = FrameRingReader(path)
+    seq = writer.write(frame(64, 64, 2))  # Does not fit: the file is replaced
+    meta, latest = reader.latest(copy=True)
+    assert meta['seq'] == seq and (latest == 2).all()
+
+    writer.close()
+    mm = reader.mm
+    assert reader.closed
+    assert reader.write_seq == seq
+    assert reader.mm is mm  # Not re-mapped on every poll
+
+    writer = FrameRingWriter(path, slot_count=4)
+    seq = writer.write(frame(8, 8, 3))
+    meta, latest = reader.latest(copy=True)
+    assert not reader.closed
+    assert meta['seq'] == seq and (latest == 3).all()
+    writer.close()
@@ -0,0 +1,124 @@
+# tests/test_lens_calibration.py
+import cv2 as cv
+import numpy as np
+import pytest
+
+from frame_stitcher import FrameStitcher
+from lens_calibration import LensCorrection, LensModel, load_lens_calibration
+
+WIDTH, HEIGHT = 400, 300
+CAMERA_MATRIX = np.array([[376.0, 0.0, 199.5], [0.0, 376.0, 149.5], [0.0, 0.0, 1.0]])
+PINHOLE = LensModel(CAMERA_MATRIX, np.array([-0.3, 0.0, 0.0, 0.0, 0.0]), (WIDTH, HEIGHT), 'pinhole')
+FISHEYE = LensModel(CAMERA_MATRIX, np.array([-0.05, 0.01, 0.0, 0.0]), (WIDTH, HEIGHT), 'fisheye')
+
+
+def write_lens(storage, lens):
+    storage.write('camera_matrix', lens.camera_matrix)
+    storage.write('distortion_coefficients', lens.dist_coeffs.reshape(1, -1))
+    storage.write('image_width', lens.image_size[0])
+    storage.write('image_height', lens.image_size[1])
+
+
+def distort_frame(lens, frame):
+    """
+    What a camera with ``lens`` captures of the pinhole image ``frame``
+    (taken with the lens' camera matrix).
+    """
+    x, y = np.meshgrid(np.arange(WIDTH, dtype=np.float64), np.arange(HEIGHT, dtype=np.float64))
+    points = np.stack([x, y], axis=-1).reshape(-1, 1, 2)
+    if lens.model == 'fisheye':
+        ideal = cv.fisheye.undistortPoints(points, lens.camera_matrix, lens.dist_coeffs[:4], P=lens.camera_matrix)
+    else:
+        ideal = cv.undistortPointsIter(points, lens.camera_matrix, lens.dist_coeffs, None, lens.camera_matrix,
+                                       (cv.TERM_CRITERIA_COUNT | cv.TERM_CRITERIA_EPS, 50, 1e-6))
+    ideal = ideal.reshape(HEIGHT, WIDTH, 2).astype(np.float32)
+    return cv.remap(frame, ideal[..., 0], ideal[..., 1], cv.INTER_LINEAR, borderMode=cv.BORDER_CONSTANT)
+
+
+def test_loads_a_single_camera_yaml(tmp_path):
+    path = str(tmp_path / 'lens.yaml')
+    storage = cv.FileStorage(path, cv.FILE_STORAGE_WRITE)
+    write_lens(storage, PINHOLE)
+    storage.release()
+    [lens] = load_lens_calibration(path)
+    assert lens.model == 'pinhole' and lens.image_size == (WIDTH, HEIGHT)
+    np.testing.assert_allclose(lens.camera_matrix, CAMERA_MATRIX)
+    np.testing.assert_allclose(lens.dist_coeffs, PINHOLE.dist_coeffs)
+
+
+def test_loads_a_camera_sequence_json(tmp_path):
+    path = str(tmp_path / 'rig.json')
+    storage = cv.FileStorage(path, cv.FILE_STORAGE_WRITE)
+    storage.startWriteStruct('cameras', cv.FileNode_SEQ)
+    for lens in (PINHOLE, FISHEYE):
+        storage.startWriteStruct('', cv.FileNode_MAP)
+        write_lens(storage, lens)
+        storage.write('model', lens.model)
+        storage.endWriteStruct()
+    storage.endWriteStruct()
+    storage.release()
+    lenses = load_lens_calibration(path)
+    assert [lens.model for lens in lenses] == ['pinhole', 'fisheye']
+    np.testing.assert_allclose(lenses[1].dist_coeffs, FISHEYE.dist_coeffs)
+
+
+def test_rejects_incomplete_and_unknown_lenses(tmp_path):
+    path = str(tmp_path / 'lens.yaml')
+    storage = cv.FileStorage(path, cv.FILE_STORAGE_WRITE)
+    write_lens(storage, PINHOLE)
+    storage.write('model', 'orthographic')
+    storage.release()
+    with pytest.raises(ValueError):
+        load_lens_calibration(path)
+    with pytest.raises(ValueError):
+        load_lens_calibration(str(tmp_path / 'missing.yaml'))
+
+
+def test_shared_and_per_camera_lenses():
+    assert FrameStitcher.load_lenses([PINHOLE], 3) == [PINHOLE] * 3
+    assert FrameStitcher.load_lenses([PINHOLE, FISHEYE, None], 3) == [PINHOLE, FISHEYE, None]
+    assert FrameStitcher.load_lenses(None, 3) == [None] * 3
+    with pytest.raises(ValueError):
+        FrameStitcher.load_lenses([PINHOLE, FISHEYE], 3)
+
+
+@pytest.mark.parametrize('lens', [PINHOLE, FISHEYE], ids=['pinhole', 'fisheye'])
+def test_distort_inverts_undistort_point(lens):
+    correction = LensCorrection(lens, (WIDTH // 2, HEIGHT // 2))  # Calibrated at twice the frame size
+    for x, y in ((10.0, 12.0), (100.0, 75.0), (180.0, 130.0)):
+        ideal = correction.undistort_point(x, y)
+        distorted = correction.distort(np.array([ideal[0]]), np.array([ideal[1]]))
+        np.testing.assert_allclose([distorted[0][0], distorted[1][0]], [x, y], atol=0.05)
+    x, y = correction.distort(np.array([-5.0, WIDTH]), np.array([10.0, 10.0]))
+    assert (x == -1).all() and (y == -1).all()
+
+
+@pytest.mark.parametrize('lens', [PINHOLE, FISHEYE], ids=['pinhole', 'fisheye'])
+def test_folded_remap_matches_undistort_then_warp(rig_frames, lens):
+    captured = [[distort_frame(lens, frame) for frame in frames] for frames in rig_frames[:2]]
+    stitcher = FrameStitcher(captured[0], compositor='fixed_point', lens_calibration=[lens])
+    stitcher.stitch_frames(captured[1])
+    plan = stitcher.compose_plan
+    for idx in range(plan.num_images):
+        correction = plan.lenses[idx]
+        _, ideal_x, ideal_y = plan.warper.buildMaps(plan.compose_sizes[idx], plan.K[idx], plan.R[idx])
+        if correction.fisheye:
+            undistort_x, undistort_y = cv.fisheye.initUndistortRectifyMap(
+                correction.camera_matrix, correction.dist_coeffs, np.eye(3), correction.ideal_matrix,
+                (WIDTH, HEIGHT), cv.CV_32FC1)
+        else:
+            undistort_x, undistort_y = cv.initUndistortRectifyMap(
+                correction.camera_matrix, correction.dist_coeffs, None, correction.ideal_matrix,
+                (WIDTH, HEIGHT), cv.CV_32FC1)
+        # Where the two-pass path (undistort, then warp) samples the captured frame
+        two_pass_x = cv.remap(undistort_x, ideal_x, ideal_y, cv.INTER_LINEAR)
+        two_pass_y = cv.remap(undistort_y, ideal_x, ideal_y, cv.INTER_LINEAR)
+        inside = (ideal_x >= 1) & (ideal_x <= WIDTH - 2) & (ideal_y >= 1) & (ideal_y <= HEIGHT - 2)
+        folded_x, folded_y = plan.float_maps(idx)
+        error = np.hypot(folded_x - two_pass_x, folded_y - two_pass_y)[inside]
+        assert inside.mean() > 0.8 and error.max() < 1.0
+
+        two_pass = cv.remap(correction.undistort(captured[1][idx]), ideal_x, ideal_y, cv.INTER_LINEAR)
+        inner = cv.erode(inside.astype(np.uint8), np.ones((5, 5), np.uint8)) > 0
+        difference = np.abs(plan.warp(idx, captured[1][idx]).astype(np.int16) - two_pass)
+        assert difference[inner].mean() < 3
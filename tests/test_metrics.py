@@ -0,0 +1,31 @@
+# tests/test_metrics.py
+from frame_metadata import FrameMetadata
+from metrics import StitchMetrics
+
+
+def test_latencies_are_prometheus_summaries():
+    metrics = StitchMetrics()
+    for latency in (0.01, 0.02, 0.03):
+        metrics.record_stitch(latency)
+    metadata = FrameMetadata(1, [100.0, 100.01])
+    metadata.stitch_end = 100.05
+    metadata.display_time = 100.08
+    metrics.record_frame_set(metadata)
+    metrics.record_display(metadata)
+
+    lines = metrics.render_prometheus().splitlines()
+    assert '# TYPE camdev_stitch_latency_seconds summary' in lines
+    assert 'camdev_stitch_latency_seconds_sum 0.060000' in lines
+    assert 'camdev_stitch_latency_seconds_count 3' in lines
+    assert 'camdev_stitch_latency_seconds{quantile="0.50"} 0.020000' in lines
+    assert '# TYPE camdev_capture_to_display_latency_seconds summary' in lines
+    assert 'camdev_capture_to_display_latency_seconds_sum 0.080000' in lines
+    assert 'camdev_capture_to_display_latency_seconds_count 1' in lines
+
+
+def test_peak_rss_is_its_own_metric():
+    snap = StitchMetrics().snapshot()
+    assert snap['memory_rss'] > 0 and snap['memory_peak_rss'] > 0
+    text = StitchMetrics().render_prometheus()
+    assert 'camdev_memory_rss_bytes ' in text
+    assert 'camdev_memory_peak_rss_bytes ' in text
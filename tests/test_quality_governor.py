@@ -0,0 +1,132 @@
+# tests/test_quality_governor.py
+import numpy as np
+import pytest
+
+from metrics import StitchMetrics
+from quality_governor import QualityGovernor
+from stitcher import CalibrationResult, VideoStitcher
+from stitching_session import StitchingSession
+
+BASE = {'compose_megapix': -1, 'blend_type': 'multiband', 'blend_strength': 5, 'max_bands': -1,
+        'exposure_compensation': True}
+SLOW, FAST = 0.2, 0.01
+
+
+def governor(base=None, **kwargs):
+    options = dict(target_fps=10.0, window=2, upgrade_window=4, settle_frames=0)
+    options.update(kwargs)
+    return QualityGovernor(dict(base or BASE), (1000, 1000), **options)
+
+
+def feed(gov, latency, count):
+    return [gov.record(latency) for _ in range(count)]
+
+
+def test_steps_down_through_the_tiers():
+    gov = governor()
+    assert feed(gov, SLOW, 2) == [None, {**BASE, 'max_bands': 2}]
+    assert gov.tier == 1
+    feed(gov, SLOW, 2)
+    assert gov.tier_settings() == {**BASE, 'blend_type': 'feather'}
+    feed(gov, SLOW, 6)
+    assert gov.tier == 5
+    assert gov.tier_settings()['compose_megapix'] == pytest.approx(0.25)
+    assert feed(gov, SLOW, 2) == [None, None]  # No tier below the last
+
+
+def test_settle_frames_are_not_counted():
+    gov = governor(settle_frames=2)
+    feed(gov, SLOW, 2)
+    assert gov.tier == 1
+    assert feed(gov, SLOW, 3) == [None, None, None]
+    assert gov.tier == 1
+    feed(gov, SLOW, 1)
+    assert gov.tier == 2
+
+
+def test_skips_tiers_that_change_nothing():
+    # Already feathering with two bands: the band limit and the feather tier are no-ops
+    gov = governor({**BASE, 'blend_type': 'feather', 'max_bands': 2})
+    settings = feed(gov, SLOW, 2)[-1]
+    assert gov.tier == 3
+    assert settings['exposure_compensation'] is False
+    feed(gov, FAST, 4)
+    assert gov.tier == 2  # Exposure compensation back on
+    feed(gov, FAST, 4)
+    assert gov.tier == 0
+
+
+def test_upgrade_that_does_not_hold_doubles_the_wait():
+    gov = governor()
+    feed(gov, SLOW, 2)
+    feed(gov, FAST, 4)
+    assert gov.tier == 0
+    feed(gov, SLOW, 2)
+    assert gov.tier == 1 and gov.upgrade_window == 8
+    feed(gov, FAST, 7)
+    assert gov.tier == 1
+    feed(gov, FAST, 1)
+    assert gov.tier == 0
+
+
+def test_no_upgrade_without_headroom():
+    gov = governor()
+    feed(gov, SLOW, 2)
+    feed(gov, 0.08, 20)  # Within budget, but not below 60% of it
+    assert gov.tier == 1
+
+
+def test_rebase_keeps_the_tier_on_new_configured_values():
+    gov = governor()
+    feed(gov, SLOW, 4)
+    assert gov.tier == 2
+    settings = gov.rebase({'compose_megapix': 2.0, 'blend_strength': 10, 'seam_finder': 'gc_color'})
+    assert settings == {**BASE, 'compose_megapix': 2.0, 'blend_strength': 10, 'blend_type': 'feather'}
+    assert 'seam_finder' not in gov.base_settings
+    feed(gov, SLOW, 4)
+    assert gov.tier_settings()['compose_megapix'] == pytest.approx(1.0)
+
+
+class FailingStitcher:
+    views = {}
+
+    def prepare_frames(self, frames):
+        return frames
+
+    def stitch_frames(self, frames):
+        return np.hstack(frames)
+
+    def update_render_settings(self, **settings):
+        raise ValueError("cannot rebuild the compose plan")
+
+
+class StillCamera:
+    def isOpened(self):
+        return True
+
+    def read(self):
+        return True, np.zeros((4, 4, 3), np.uint8)
+
+
+def test_stitcher_emits_panoramas_when_the_tier_change_fails():
+    gov = governor(target_fps=1e9)  # Every stitch misses the budget
+    calibration = CalibrationResult(FailingStitcher(), gov, None, {}, [], 0.0)
+    metrics = StitchMetrics()
+    thread = VideoStitcher([StillCamera(), StillCamera()], {}, metrics=metrics, calibration=calibration)
+    panoramas = []
+    thread.frame_ready.connect(panoramas.append)
+    for _ in range(3):
+        thread.run()
+    assert len(panoramas) == 3
+    assert gov.tier == 0
+    assert metrics.snapshot()['stitch_errors'] == 0
+
+
+def test_session_keeps_the_tier_when_its_settings_fail():
+    session = StitchingSession([], metrics=StitchMetrics())
+    session.stitcher = FailingStitcher()
+    session.governor = governor()
+    session.apply_quality_tier(SLOW)
+    session.apply_quality_tier(SLOW)
+    assert session.governor.tier == 0
+    assert session.metrics.snapshot()['quality_tier'] == 0
@@ -0,0 +1,69 @@
+# tests/test_rig_server.py
+import os
+
+from rig_server import Rig, RigServer
+
+SETTINGS = {'compositor': 'fixed_point', 'rig_topology': 'linear'}
+
+
+class FakeSession:
+    def __init__(self):
+        self.stitcher = object()
+        self.finished = False
+        self.error = None
+
+    def has_new_frames(self):
+        return True
+
+
+def run_steps(server, steps, seconds=0.01):
+    """
+    Schedule ``steps`` steps one at a time, each taking ``seconds`` of
+    worker time; returns how many each rig got.
+    """
+    counts = dict.fromkeys(server.rigs, 0)
+    for _ in range(steps):
+        rig = server.pick(0.0)
+        counts[rig.name] += 1
+        rig.virtual_time += seconds / rig.priority
+    return counts
+
+
+def test_workers_are_shared_by_priority():
+    server = RigServer(workers=1)
+    for name, priority in (('a', 1.0), ('b', 2.0), ('c', 1.0)):
+        server.rigs[name] = Rig(name, FakeSession(), target_fps=0, priority=priority)
+    assert run_steps(server, 400) == {'a': 100, 'b': 200, 'c': 100}
+
+
+def test_idle_rig_gets_no_burst():
+    server = RigServer(workers=1)
+    server.rigs['busy'] = Rig('busy', FakeSession(), target_fps=0)
+    run_steps(server, 100)
+    server.rigs['idle'] = Rig('idle', FakeSession(), target_fps=0)
+    counts = run_steps(server, 20)
+    assert counts == {'busy': 10, 'idle': 10}
+
+
+def test_only_schedulable_rigs_are_picked():
+    server = RigServer(workers=1)
+    waiting = Rig('waiting', FakeSession(), target_fps=10)
+    waiting.next_due = 5.0
+    calibrating = Rig('calibrating', FakeSession(), target_fps=0)
+    calibrating.session.stitcher = None
+    server.rigs.update(waiting=waiting, calibrating=calibrating)
+    assert server.pick(0.0) is None
+    assert server.pick(5.0) is waiting
+    server.in_flight = 1
+    assert server.pick(5.0) is None
+
+
+def test_rigs_stream_replayed_frames(rig_directory):
+    specs = [f"replay:{os.path.join(rig_directory, f'cam{idx}')}?realtime=0&loop=0" for idx in range(3)]
+    with RigServer(workers=2) as server:
+        rig = server.add_rig('north', specs, SETTINGS, target_fps=0, lockstep=True, buffer_size=4)
+        frames = [frame.index for frame in rig]
+        stats = server.stats()['north']
+    assert frames == [1, 2, 3, 4]
+    assert stats['state'] == 'finished' and stats['steps'] == 5
+    assert stats['frames_dropped'] == {}
@@ -0,0 +1,99 @@
+# tests/test_stitching_session.py
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from frame_metadata import frame_metadata
+from stitching_session import StitchingSession
+
+SETTINGS = {'compositor': 'fixed_point', 'rig_topology': 'linear'}
+
+
+def replay_specs(directory, **params):
+    query = '&'.join(f'{key}={value}' for key, value in dict(realtime=0, loop=0, **params).items())
+    return [f"replay:{os.path.join(directory, f'cam{idx}')}?{query}" for idx in range(3)]
+
+
+def test_sync_iteration_stitches_every_recorded_frame_set(rig_directory):
+    with StitchingSession(replay_specs(rig_directory), SETTINGS, buffer_size=1, overflow='block',
+                          lockstep=True) as session:
+        frames = list(session)
+    assert [frame.index for frame in frames] == [1, 2, 3, 4]
+    assert all(frame.dropped == 0 and frame.fallback_cameras == [] for frame in frames)
+    metadata = frame_metadata(frames[-1].panorama)
+    assert metadata.sequence == 4 and metadata.display_time >= metadata.stitch_end
+    assert session.metrics.snapshot()['frames_displayed'] == 4
+    assert len(session.metrics.capture_to_display) == 4
+
+
+def test_async_iteration(rig_directory):
+    async def consume():
+        async with StitchingSession(replay_specs(rig_directory), SETTINGS, buffer_size=1, overflow='block',
+                                    lockstep=True) as session:
+            return [frame.index async for frame in session]
+
+    assert asyncio.run(consume()) == [1, 2, 3, 4]
+
+
+def test_drop_overflow_keeps_the_newest_frames(rig_directory):
+    session = StitchingSession(replay_specs(rig_directory), SETTINGS, buffer_size=1, overflow='drop',
+                               lockstep=True).start()
+    deadline = time.monotonic() + 60
+    while not session.finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    frames = list(session)
+    session.close()
+    assert [frame.index for frame in frames] == [4]
+    assert session.dropped == 3
+    assert session.metrics.snapshot()['frames_dropped'] == {'consumer_slow': 3}
+
+
+def test_cancelled_consumer_loses_no_frame(rig_directory):
+    session = StitchingSession(replay_specs(rig_directory), SETTINGS, lockstep=True).start(stitch_thread=False)
+    session.calibrate()
+
+    async def consume():
+        stream = session.stream()
+        waiting = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not session.async_waiters
+        session.stitch_newest()
+        async for frame in session:
+            return frame
+
+    frame = asyncio.run(consume())
+    session.close()
+    assert frame.index == 1
+
+
+def test_frame_sets_coalesce_until_every_camera_delivered():
+    session = StitchingSession([])
+    now = time.time()
+    session.latest = [(None, now - 0.01, 5), (None, now - 0.5, 7), None]
+    session.frame_intervals = [0.1, 0.2, None]
+
+    assert session.frame_set_due([5, 7, None]) is None
+    assert session.frame_set_due([4, 6, None]) == 0.0
+    # Only camera 0 is new: wait up to COALESCE_FACTOR times the slowest interval for camera 1
+    due = session.frame_set_due([4, 7, None])
+    assert 0.2 < due <= StitchingSession.COALESCE_FACTOR * 0.2
+    # A new frame that has waited that long is stitched without the stalled camera
+    session.latest[0] = (None, now - 0.5, 5)
+    assert session.frame_set_due([4, 7, None]) == 0.0
+
+
+def test_stitched_frames_carry_the_panorama_and_views(rig_directory, rig_frames):
+    session = StitchingSession(replay_specs(rig_directory), SETTINGS, buffer_size=1, overflow='block',
+                               lockstep=True)
+    session.add_view('front', fov=40.0, size=(160, 90))
+    with session:
+        frames = list(session)
+    assert frames[-1].views['front'].shape == (90, 160, 3)
+    assert frames[0].panorama.shape[1] > rig_frames[0][0].shape[1]
+    assert all(np.array_equal(a, b) for a, b in zip(frames[-1].frames, rig_frames[3]))
@@ -2,10 +2,17 @@
 from PyQt5.QtWidgets import QWidget, QGridLayout, QPushButton, QMessageBox
 from single_camera_canvas import SingleCameraCanvas
 from video_sync_manager import VideoSyncManager
+from capture_config import apply_capture_modes, plan_capture_modes
+from capture_sources import expand_source_specs
 import logging
+import os
 from PyQt5.QtCore import Qt
 import cv2
 
+# Virtual cameras offered next to the detected devices, e.g.
+# "replay:/data/rig/cam{index}.mp4?count=16&fps=30&jitter=0.004&drop_rate=0.01"
+CAMERA_SOURCES = os.environ.get('CAM_DEV_CAMERA_SOURCES', '')
+
 class VideoDisplayWidget(QWidget):
     def __init__(self, num_cameras):
         super().__init__()
@@ -21,6 +28,7 @@ class VideoDisplayWidget(QWidget):
             if cap.isOpened():
                 available_cameras.append(str(i))
                 cap.release()
+        available_cameras.extend(expand_source_specs(CAMERA_SOURCES))
         if not available_cameras:
             QMessageBox.critical(self, "Error", "No cameras found.")
             self.close()
@@ -30,7 +38,7 @@ class VideoDisplayWidget(QWidget):
         self.layout = QGridLayout()
         self.cameras = []
         try:
-            grid_columns = 3  # Adjust as needed
+            grid_columns = 3 if self.num_cameras <= 9 else 4
             grid_rows = (self.num_cameras + grid_columns - 1) // grid_columns
 
             for idx in range(self.num_cameras):
@@ -115,4 +123,34 @@ class VideoDisplayWidget(QWidget):
                         canvas.camera_dropdown.setCurrentIndex(0)
                     else:
                         canvas.camera_dropdown.setCurrentText("")
-                canvas.camera_dropdown.blockSignals(False)
\ No newline at end of file
+                canvas.camera_dropdown.blockSignals(False)
+
+    def plan_capture_modes(self, compose_megapix=-1, target_fps=30.0, capture_format='auto', raw_yuv=False):
+        """
+        Choose every camera's capture mode for the compose resolution and the
+        shared USB bandwidth, without applying it (see ``apply_capture_modes``).
+        """
+        return plan_capture_modes(
+            [canvas.device_index() for canvas in self.cameras],
+            [canvas.capture for canvas in self.cameras],
+            compose_megapix=compose_megapix, target_fps=target_fps, capture_format=capture_format,
+            raw_yuv=raw_yuv
+        )
+
+    def apply_capture_modes(self, plans):
+        modes = apply_capture_modes(
+            [canvas.device_index() for canvas in self.cameras],
+            [canvas.capture for canvas in self.cameras],
+            plans
+        )
+        for canvas, mode in zip(self.cameras, modes):
+            if mode is not None:
+                canvas.configure_capture(mode)
+        return modes
+
+    def negotiate_capture_modes(self, compose_megapix=-1, target_fps=30.0, capture_format='auto', raw_yuv=False):
+        """
+        Match every camera's capture mode to the compose resolution and the
+        shared USB bandwidth before stitching starts.
+        """
+        return self.apply_capture_modes(self.plan_capture_modes(compose_megapix, target_fps, capture_format, raw_yuv))
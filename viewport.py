@@ -0,0 +1,202 @@
+# viewport.py
+from collections import namedtuple
+
+import cv2 as cv
+import numpy as np
+
+# Virtual pan/tilt/zoom camera: angles in degrees relative to the panorama
+# centre (positive pan turns right, positive tilt looks up), horizontal field
+# of view in degrees and output size as (width, height)
+VirtualView = namedtuple('VirtualView', ['pan', 'tilt', 'fov', 'size'])
+
+
+class ViewRenderer:
+    """
+    Renders one view of the panorama straight from the camera frames.
+
+    The view is described by the canvas position of every output pixel
+    (``canvas_x``/``canvas_y``, float32 at output size). For each camera
+    that contributes, the compose plan's remap table and the compositor's
+    Q8 blend weights (exposure gains included) are resampled at those
+    positions once, so a frame costs one remap, multiply and add per
+    camera, restricted to the output rectangle the camera actually covers.
+    ``camera_maps`` can supply exact per-camera lookups ``(map_x, map_y,
+    valid)`` instead of resampling the plan's tables.
+    """
+
+    WEIGHT_BITS = 8
+
+    def __init__(self, plan, weights, canvas_x, canvas_y, camera_maps=None):
+        self.plan = plan
+        self.size = (canvas_x.shape[1], canvas_x.shape[0])
+        self.cameras = []
+        self.tiles = {}
+        for idx in range(plan.num_images):
+            cx, cy, w, h = plan.canvas_roi(idx)
+            local_x = canvas_x - np.float32(cx)
+            local_y = canvas_y - np.float32(cy)
+            inside = (local_x > -1) & (local_x < w) & (local_y > -1) & (local_y < h)
+            if not inside.any():
+                continue
+            weight = cv.remap(weights[idx], local_x, local_y, cv.INTER_LINEAR,
+                              borderMode=cv.BORDER_CONSTANT, borderValue=0)
+            if camera_maps is None:
+                plan_x, plan_y = plan.float_maps(idx)
+                map_x = cv.remap(plan_x, local_x, local_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+                map_y = cv.remap(plan_y, local_x, local_y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+                valid = cv.remap(plan.masks_warped[idx], local_x, local_y, cv.INTER_NEAREST,
+                                 borderMode=cv.BORDER_CONSTANT, borderValue=0) > 0
+            else:
+                map_x, map_y, valid = camera_maps[idx]
+            weight[~valid] = 0
+
+            # Only the output rectangle this camera contributes to is warped
+            used = weight[..., 0] > 0
+            if not used.any():
+                continue
+            rows = np.flatnonzero(used.any(axis=1))
+            cols = np.flatnonzero(used.any(axis=0))
+            rect = (int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+            x, y, rw, rh = rect
+            map1, map2 = cv.convertMaps(np.ascontiguousarray(map_x[y:y + rh, x:x + rw]),
+                                        np.ascontiguousarray(map_y[y:y + rh, x:x + rw]), cv.CV_16SC2)
+            self.cameras.append((idx, rect, map1, map2, np.ascontiguousarray(weight[y:y + rh, x:x + rw])))
+
+    @property
+    def camera_indices(self):
+        return [idx for idx, _, _, _, _ in self.cameras]
+
+    def render(self, frames, out=None):
+        w, h = self.size
+        if out is None:
+            out = np.zeros((h, w, 3), np.uint8)
+        else:
+            out[:] = 0
+        scale = 1. / (1 << self.WEIGHT_BITS)
+        for idx, (x, y, rw, rh), map1, map2, weight in self.cameras:
+            tile = cv.remap(frames[idx], map1, map2, cv.INTER_LINEAR, dst=self.tiles.get(idx),
+                            borderMode=cv.BORDER_REFLECT)
+            cv.multiply(tile, weight, dst=tile, scale=scale, dtype=cv.CV_8U)
+            self.tiles[idx] = tile
+            roi = out[y:y + rh, x:x + rw]
+            cv.add(roi, tile, dst=roi)
+        return out
+
+
+def viewport_canvas_maps(rect, out_size):
+    """
+    Canvas coordinates of every output pixel when the canvas rectangle
+    ``rect`` = (x, y, w, h) is scaled to ``out_size`` = (w, h).
+    """
+    x, y, w, h = rect
+    out_w, out_h = out_size
+    u = (np.arange(out_w, dtype=np.float32) + 0.5) * np.float32(w / out_w) - 0.5 + x
+    v = (np.arange(out_h, dtype=np.float32) + 0.5) * np.float32(h / out_h) - 0.5 + y
+    canvas_x, canvas_y = np.meshgrid(u, v)
+    return canvas_x, canvas_y
+
+
+def _rotation_y(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+
+def _rotation_x(angle):
+    c, s = np.cos(angle), np.sin(angle)
+    return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+
+def panorama_center_direction(plan):
+    """
+    Yaw and pitch (radians) of the ray at the centre of the panorama canvas,
+    looked up through the remap table of a camera that covers it (camera 0's
+    optical axis if none does).
+    """
+    _, _, canvas_w, canvas_h = plan.dst_roi
+    center_x, center_y = canvas_w // 2, canvas_h // 2
+    ray = plan.R[0].astype(np.float64)[:, 2]
+    for idx in range(plan.num_images):
+        cx, cy, w, h = plan.canvas_roi(idx)
+        if not (cx <= center_x < cx + w and cy <= center_y < cy + h):
+            continue
+        if not plan.masks_warped[idx][center_y - cy, center_x - cx]:
+            continue
+        map_x, map_y = plan.float_maps(idx)
+        px, py = plan.from_frame(idx, map_x[center_y - cy, center_x - cx], map_y[center_y - cy, center_x - cx])
+        ray = plan.R[idx].astype(np.float64) @ np.linalg.inv(plan.K[idx].astype(np.float64)) @ np.array([px, py, 1.0])
+        break
+    return np.arctan2(ray[0], ray[2]), np.arctan2(-ray[1], np.hypot(ray[0], ray[2]))
+
+
+def ptz_view_maps(plan, view, grid_step=16):
+    """
+    Lookup tables of a virtual PTZ camera.
+
+    Every output pixel is turned into a world ray ``d = R_v K_v^-1 p`` and
+    projected into each camera with ``K R^T d``, so the view is sampled
+    straight from the camera frames at its own resolution. The canvas
+    position of each ray, needed to look up the blend weights, varies
+    smoothly and is computed on a coarse grid of ``grid_step`` pixels.
+    Returns ``(canvas_x, canvas_y, camera_maps)`` for ``ViewRenderer``.
+    """
+    out_w, out_h = view.size
+    focal = (out_w / 2) / np.tan(np.radians(view.fov) / 2)
+    yaw, pitch = panorama_center_direction(plan)
+    R_view = _rotation_y(yaw + np.radians(view.pan)) @ _rotation_x(pitch + np.radians(view.tilt))
+
+    def rays(u, v):
+        p = np.stack([u - (out_w - 1) / 2, v - (out_h - 1) / 2, np.full_like(u, focal)], axis=-1)
+        return p @ R_view.T
+
+    u, v = np.meshgrid(np.arange(out_w, dtype=np.float64), np.arange(out_h, dtype=np.float64))
+    d = rays(u, v)
+    camera_maps = {}
+    for idx in range(plan.num_images):
+        K = plan.K[idx].astype(np.float64)
+        R = plan.R[idx].astype(np.float64)
+        q = d @ (K @ R.T).T
+        z = q[..., 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = q[..., 0] / z
+            y = q[..., 1] / z
+        w, h = plan.compose_sizes[idx]
+        valid = (z > 0) & (x >= 0) & (x <= w - 1) & (y >= 0) & (y <= h - 1)
+        map_x, map_y = plan.to_frame(idx, np.where(valid, x, -1), np.where(valid, y, -1))
+        map_x[~valid] = -1
+        map_y[~valid] = -1
+        camera_maps[idx] = (map_x, map_y, valid)
+
+    # Canvas positions on a coarse grid, through the most frontal camera
+    grid_w = -(-out_w // grid_step) + 1
+    grid_h = -(-out_h // grid_step) + 1
+    gu, gv = np.meshgrid((np.arange(grid_w) + 0.5) * out_w / grid_w - 0.5,
+                         (np.arange(grid_h) + 0.5) * out_h / grid_h - 0.5)
+    grid_rays = rays(gu, gv)
+    grid_rays /= np.linalg.norm(grid_rays, axis=-1, keepdims=True)
+    facing = np.stack([grid_rays @ plan.R[idx].astype(np.float64)[:, 2] for idx in range(plan.num_images)])
+    best = facing.argmax(axis=0)
+    grid_x = np.full((grid_h, grid_w), -1e5, np.float32)
+    grid_y = np.full((grid_h, grid_w), -1e5, np.float32)
+    dst_x, dst_y = plan.dst_roi[:2]
+    for gy in range(grid_h):
+        for gx in range(grid_w):
+            idx = best[gy, gx]
+            if facing[idx, gy, gx] <= 0:
+                continue
+            q = plan.K[idx].astype(np.float64) @ plan.R[idx].astype(np.float64).T @ grid_rays[gy, gx]
+            px, py = plan.warper.warpPoint((q[0] / q[2], q[1] / q[2]), plan.K[idx], plan.R[idx])
+            grid_x[gy, gx] = px - dst_x
+            grid_y[gy, gx] = py - dst_y
+    # Give cells without a position that of the nearest cell with one, so the
+    # sentinel is not interpolated into the positions near coverage edges;
+    # the cameras' own ``valid`` masks decide which pixels are covered
+    missing = (grid_x <= -1e4).astype(np.uint8)
+    if missing.any() and not missing.all():
+        _, labels = cv.distanceTransformWithLabels(missing, cv.DIST_L2, 3, labelType=cv.DIST_LABEL_PIXEL)
+        # Labels number the cells with a position in row-major order, from 1
+        nearest = labels - 1
+        grid_x = grid_x[missing == 0][nearest]
+        grid_y = grid_y[missing == 0][nearest]
+    canvas_x = cv.resize(grid_x, (out_w, out_h), interpolation=cv.INTER_LINEAR)
+    canvas_y = cv.resize(grid_y, (out_w, out_h), interpolation=cv.INTER_LINEAR)
+    return canvas_x, canvas_y, camera_maps
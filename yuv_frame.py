@@ -0,0 +1,87 @@
+# yuv_frame.py
+import cv2 as cv
+import numpy as np
+
+
+class YuvFrame:
+    """
+    Frame in YUV 4:2:0 with interleaved chroma, as NV12: a full-resolution
+    luma plane ``y`` (H x W) and a half-resolution chroma plane ``uv``
+    (ceil(H/2) x ceil(W/2) x 2). Half the bytes of BGR, so warping and
+    blending it moves half the data; consumers convert it once with
+    ``to_bgr``/``to_rgb``.
+    """
+
+    def __init__(self, y, uv):
+        self.y = y
+        self.uv = uv
+
+    @property
+    def shape(self):
+        """
+        Shape of the equivalent BGR frame, so size checks work unchanged.
+        """
+        return self.y.shape[0], self.y.shape[1], 3
+
+    @property
+    def nbytes(self):
+        return self.y.nbytes + self.uv.nbytes
+
+    @classmethod
+    def from_bgr(cls, frame):
+        h, w = frame.shape[:2]
+        if h % 2 or w % 2:
+            frame = cv.copyMakeBorder(frame, 0, h % 2, 0, w % 2, cv.BORDER_REPLICATE)
+        i420 = cv.cvtColor(frame, cv.COLOR_BGR2YUV_I420)
+        eh, ew = frame.shape[:2]
+        u = i420[eh:eh + eh // 4].reshape(eh // 2, ew // 2)
+        v = i420[eh + eh // 4:].reshape(eh // 2, ew // 2)
+        return cls(np.ascontiguousarray(i420[:h, :w]), cv.merge([u, v]))
+
+    @classmethod
+    def from_yuyv(cls, raw):
+        """
+        From a packed YUYV 4:2:2 capture (H x W x 2, as V4L2 delivers it
+        with ``CAP_PROP_CONVERT_RGB`` off); chroma rows are averaged in pairs.
+        """
+        h, w = raw.shape[:2]
+        y = np.ascontiguousarray(raw[..., 0])
+        uv = np.ascontiguousarray(raw[..., 1]).reshape(h, w // 2, 2)
+        uv = cv.resize(uv, ((w + 1) // 2, (h + 1) // 2), interpolation=cv.INTER_AREA)
+        return cls(y, uv)
+
+    @classmethod
+    def from_capture(cls, frame):
+        """
+        Wrap what ``read()`` returned: raw YUYV or a converted BGR frame.
+        """
+        if isinstance(frame, cls):
+            return frame
+        if frame.ndim == 3 and frame.shape[2] == 2:
+            return cls.from_yuyv(frame)
+        return cls.from_bgr(frame)
+
+    def convert(self, code):
+        h, w = self.y.shape
+        y = self.y
+        if h % 2 or w % 2:
+            y = cv.copyMakeBorder(y, 0, h % 2, 0, w % 2, cv.BORDER_REPLICATE)
+        return np.ascontiguousarray(cv.cvtColorTwoPlane(y, self.uv, code)[:h, :w])
+
+    def to_bgr(self):
+        return self.convert(cv.COLOR_YUV2BGR_NV12)
+
+    def to_rgb(self):
+        return self.convert(cv.COLOR_YUV2RGB_NV12)
+
+
+def as_bgr(frame):
+    """
+    ``frame`` as a BGR array, converting a ``YuvFrame`` or a raw H x W x 2
+    YUYV capture (``CAP_PROP_CONVERT_RGB`` off).
+    """
+    if isinstance(frame, YuvFrame):
+        return frame.to_bgr()
+    if isinstance(frame, np.ndarray) and frame.ndim == 3 and frame.shape[2] == 2:
+        return cv.cvtColor(frame, cv.COLOR_YUV2BGR_YUYV)
+    return frame